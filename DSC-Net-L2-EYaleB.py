@@ -2,16 +2,30 @@ import tensorflow as tf
 import numpy as np
 from tensorflow.contrib import layers
 import scipy.io as sio
-from scipy.sparse.linalg import svds
-from sklearn import cluster
 from sklearn.preprocessing import normalize
 from munkres import Munkres
+import argparse
+import cpu
+import scheduler
+import svd_backend
+import spectral
+import affinity
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--subjects',   type=int,   nargs='+',  default=[10, 15, 20, 25, 30, 35, 38])    # numbers of subjects K, each is run on its 39-K subsets
+parser.add_argument('--data',       default='/home/pan/workspace-eclipse/deep-subspace-clustering/face_datasets/YaleBCrop025.mat')
+parser.add_argument('--model-path', default='/home/pan/workspace-eclipse/deep-subspace-clustering/models_face/model-102030-48x42-yaleb.ckpt')
+parser.add_argument('--logs-path',  default='/home/pan/workspace-eclipse/deep-subspace-clustering/conv_3_l1_yaleb/ft/logs')
+parser.add_argument('--batch-subsets', type=int, default=1)     # subsets fine-tuned together in one graph, see BatchedConvAE
+scheduler.add_arguments(parser)     # --workers and the budgets of the subset experiments
+svd_backend.add_arguments(parser)   # --svd backend of post_proC, see svd_backend.py
+spectral.add_arguments(parser)      # --spectral clustering of post_proC, see spectral.py
 
 
 class ConvAE(object):
     def __init__(self, n_input, kernel_size, n_hidden, reg_constant1 = 1.0, re_constant2 = 1.0, batch_size = 200, reg = None, \
                 denoise = False, model_path = None, restore_path = None, \
-                logs_path = '/home/pan/workspace-eclipse/deep-subspace-clustering/models_face/logs'):
+                logs_path = '/home/pan/workspace-eclipse/deep-subspace-clustering/models_face/logs', config = None):
         self.n_input = n_input
         self.kernel_size = kernel_size
         self.n_hidden = n_hidden
@@ -65,13 +79,17 @@ class ConvAE(object):
         self.optimizer = tf.train.AdamOptimizer(learning_rate = self.learning_rate).minimize(self.loss) #GradientDescentOptimizer #AdamOptimizer
         
         self.init = tf.global_variables_initializer()
-        self.sess = tf.InteractiveSession()
+        self.sess = tf.InteractiveSession(config=config)
         self.sess.run(self.init)        
-        self.saver = tf.train.Saver([v for v in tf.trainable_variables() if not (v.name.startswith("Coef"))]) 
+        self.pretrained = [v for v in tf.trainable_variables() if not (v.name.startswith("Coef"))]
+        self.saver = tf.train.Saver(self.pretrained) 
+        # sets the pretrained weights from memory, see set_pretrained
+        self.pretrained_in = [tf.placeholder(v.dtype.base_dtype, v.get_shape()) for v in self.pretrained]
+        self.pretrained_assign = [tf.assign(v, p) for v, p in zip(self.pretrained, self.pretrained_in)]
         #[v for v in tf.trainable_variables() if not (v.name.startswith("Coef"))]       
         self.summary_writer = tf.summary.FileWriter(logs_path, graph=tf.get_default_graph())
         
-    def _initialize_weights(self):
+    def _initialize_weights(self, coef = True):
         all_weights = dict()
         all_weights['enc_w0'] = tf.get_variable("enc_w0", shape=[self.kernel_size[0], self.kernel_size[0], 1, self.n_hidden[0]],
             initializer=layers.xavier_initializer_conv2d(),regularizer = self.reg)
@@ -85,7 +103,8 @@ class ConvAE(object):
             initializer=layers.xavier_initializer_conv2d(),regularizer = self.reg)
         all_weights['enc_b2'] = tf.Variable(tf.zeros([self.n_hidden[2]], dtype = tf.float32))        
         
-        all_weights['Coef']   = tf.Variable(1.0e-4 * tf.ones([self.batch_size, self.batch_size],tf.float32), name = 'Coef')
+        if coef:
+            all_weights['Coef']   = tf.Variable(1.0e-4 * tf.ones([self.batch_size, self.batch_size],tf.float32), name = 'Coef')
         
         all_weights['dec_w0'] = tf.get_variable("dec_w0", shape=[self.kernel_size[2], self.kernel_size[2], self.n_hidden[1],self.n_hidden[2]],
             initializer=layers.xavier_initializer_conv2d(),regularizer = self.reg)
@@ -120,15 +139,15 @@ class ConvAE(object):
     def decoder(self,z, weights, shapes):
         # Encoder Hidden layer with sigmoid activation #1
         shape_de1 = shapes[2]
-        layer1 = tf.add(tf.nn.conv2d_transpose(z, weights['dec_w0'], tf.stack([tf.shape(self.x)[0],shape_de1[1],shape_de1[2],shape_de1[3]]),\
+        layer1 = tf.add(tf.nn.conv2d_transpose(z, weights['dec_w0'], tf.stack([tf.shape(z)[0],shape_de1[1],shape_de1[2],shape_de1[3]]),\
          strides=[1,2,2,1],padding='SAME'),weights['dec_b0'])
         layer1 = tf.nn.relu(layer1)
         shape_de2 = shapes[1]
-        layer2 = tf.add(tf.nn.conv2d_transpose(layer1, weights['dec_w1'], tf.stack([tf.shape(self.x)[0],shape_de2[1],shape_de2[2],shape_de2[3]]),\
+        layer2 = tf.add(tf.nn.conv2d_transpose(layer1, weights['dec_w1'], tf.stack([tf.shape(z)[0],shape_de2[1],shape_de2[2],shape_de2[3]]),\
          strides=[1,2,2,1],padding='SAME'),weights['dec_b1'])
         layer2 = tf.nn.relu(layer2)
         shape_de3= shapes[0]
-        layer3 = tf.add(tf.nn.conv2d_transpose(layer2, weights['dec_w2'], tf.stack([tf.shape(self.x)[0],shape_de3[1],shape_de3[2],shape_de3[3]]),\
+        layer3 = tf.add(tf.nn.conv2d_transpose(layer2, weights['dec_w2'], tf.stack([tf.shape(z)[0],shape_de3[1],shape_de3[2],shape_de3[3]]),\
          strides=[1,2,2,1],padding='SAME'),weights['dec_b2'])
         layer3 = tf.nn.relu(layer3)
         return layer3
@@ -155,7 +174,82 @@ class ConvAE(object):
     def restore(self):
         self.saver.restore(self.sess, self.restore_path)
         print ("model restored")
+
+    def get_pretrained(self):
+        # values of the weights restore() loads, they don't depend on batch_size
+        return self.sess.run(self.pretrained)
+
+    def set_pretrained(self, values):
+        # what restore() does, from the values of get_pretrained instead of the checkpoint file
+        self.sess.run(self.pretrained_assign, feed_dict = dict(zip(self.pretrained_in, values)))
         
+class BatchedConvAE(ConvAE):
+    """
+    ConvAE for n_subsets subset problems of the same size, fine-tuned together in one graph and one
+    session step. Every subset has its own copy of the encoder and decoder (in variable scope subset<p>,
+    set from the same pretrained weights) and its own slice of Coef, n_subsets x batch_size x batch_size,
+    whose self-expression is a single batched matmul. The loss is the sum of the subsets' losses, and Adam
+    works per weight, so each subset gets exactly the updates of its own ConvAE run.
+    """
+    def __init__(self, n_input, kernel_size, n_hidden, n_subsets, reg_constant1 = 1.0, re_constant2 = 1.0, batch_size = 200, reg = None, \
+                restore_path = None, config = None):
+        self.n_input = n_input
+        self.kernel_size = kernel_size
+        self.n_hidden = n_hidden
+        self.n_subsets = n_subsets
+        self.batch_size = batch_size
+        self.reg = reg
+        self.restore_path = restore_path
+        self.iter = 0
+
+        # the images of every subset, n_subsets x batch_size x ...
+        self.x = tf.placeholder(tf.float32, [n_subsets, batch_size, n_input[0], n_input[1], 1])
+        self.learning_rate = tf.placeholder(tf.float32, [])
+
+        self.Coef = tf.Variable(1.0e-4 * tf.ones([n_subsets, batch_size, batch_size],tf.float32), name = 'Coef')
+        towers = []
+        for p in range(n_subsets):
+            with tf.variable_scope('subset%d' % p):
+                weights = self._initialize_weights(coef = False)
+                latent, shape = self.encoder(self.x[p], weights)
+            towers.append((weights, latent, shape))
+        z = tf.stack([tf.reshape(latent, [batch_size, -1]) for _, latent, _ in towers])
+        z_c = tf.matmul(self.Coef, z)
+        self.z = z
+        x_r = []
+        for p, (weights, latent, shape) in enumerate(towers):
+            with tf.variable_scope('subset%d' % p):
+                x_r.append(self.decoder(tf.reshape(z_c[p], tf.shape(latent)), weights, shape))
+        self.x_r = tf.stack(x_r)
+
+        # losses of each subset
+        self.reconst_cost = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(self.x_r, self.x), 2.0), axis = [1, 2, 3, 4])
+        self.reg_losses = tf.reduce_sum(tf.pow(self.Coef,2.0), axis = [1, 2])
+        self.selfexpress_losses = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0), axis = [1, 2])
+        self.loss = tf.reduce_sum(self.reconst_cost + reg_constant1 * self.reg_losses + re_constant2 * self.selfexpress_losses)
+        self.optimizer = tf.train.AdamOptimizer(learning_rate = self.learning_rate).minimize(self.loss)
+
+        self.init = tf.global_variables_initializer()
+        self.sess = tf.InteractiveSession(config=config)
+        self.sess.run(self.init)
+        # the pretrained weights of each subset, in the order of ConvAE.pretrained
+        self.tower_pretrained = [[v for v in tf.trainable_variables() if v.name.startswith('subset%d/' % p)] for p in range(n_subsets)]
+        self.pretrained = self.tower_pretrained[0]
+        self.pretrained_in = [tf.placeholder(v.dtype.base_dtype, v.get_shape()) for v in self.pretrained]
+        self.pretrained_assign = [tf.assign(v, ph) for tower in self.tower_pretrained for v, ph in zip(tower, self.pretrained_in)]
+
+    def partial_fit(self, X, lr):
+        # X: n_subsets x batch_size x ..., returns the reconstruction cost and Coef of every subset
+        cost, _, Coef = self.sess.run((self.reconst_cost, self.optimizer, self.Coef), feed_dict = {self.x: X, self.learning_rate: lr})
+        self.iter = self.iter + 1
+        return cost, Coef
+
+    def restore(self):
+        # the checkpoint has the variables of ConvAE, read once and set in every subset
+        reader = tf.train.NewCheckpointReader(self.restore_path)
+        self.set_pretrained([reader.get_tensor(v.op.name.split('/', 1)[1]) for v in self.pretrained])
+        print ("model restored")
+
 def best_map(L1,L2):
     #L1 should be the groundtruth labels and L2 should be the clustering labels we got
     Label1 = np.unique(L1)
@@ -202,33 +296,23 @@ def thrC(C,ro):
 
     return Cp
 
-def build_aff(C):
-    N = C.shape[0]
-    Cabs = np.abs(C)
-    ind = np.argsort(-Cabs,0)
-    for i in range(N):
-        Cabs[:,i]= Cabs[:,i] / (Cabs[ind[0,i],i] + 1e-6)
-    Cksym = Cabs + Cabs.T;
-    return Cksym
-
 def post_proC(C, K, d, alpha):
     # C: coefficient matrix, K: number of clusters, d: dimension of each subspace
     C = 0.5*(C + C.T)
     r = d*K + 1
-    U, S, _ = svds(C,r,v0 = np.ones(C.shape[0]))
+    U, S, _ = svd_backend.svds(C,r)
     U = U[:,::-1]    
     S = np.sqrt(S[::-1])
     S = np.diag(S)    
     U = U.dot(S)    
     U = normalize(U, norm='l2', axis = 1)       
-    Z = U.dot(U.T)
-    Z = Z * (Z>0)    
-    L = np.abs(Z ** alpha) 
-    L = L/L.max()   
-    L = 0.5 * (L + L.T)    
-    spectral = cluster.SpectralClustering(n_clusters=K, eigen_solver='arpack', affinity='precomputed',assign_labels='discretize')
-    spectral.fit(L)
-    grp = spectral.fit_predict(L) + 1
+    kernel = affinity.kernel(alpha, positive=True)
+    if spectral.settings['landmarks']:
+        # the same affinity, between the samples and the landmarks only
+        grp = spectral.landmark_cluster(U, K, kernel) + 1
+        return grp, None
+    L = affinity.post_affinity(U, kernel)
+    grp = spectral.cluster(L, K) + 1
     return grp, L
 
 def err_rate(gt_s, s):
@@ -237,48 +321,70 @@ def err_rate(gt_s, s):
     missrate = err_x.astype(float) / (gt_s.shape[0])
     return missrate 
 
-def build_laplacian(C):
-    C = 0.5 * (np.abs(C) + np.abs(C.T))
-    W = np.sum(C,axis=0)         
-    W = np.diag(1.0/W)
-    L = W.dot(C)    
-    return L
- 
-        
-def test_face(Img, Label, CAE, num_class):       
-    
-    alpha = max(0.4 - (num_class-1)/10 * 0.1, 0.1)
-    print alpha
-    
-    acc_= []
-    for i in range(0,39-num_class): 
-        face_10_subjs = np.array(Img[64*i:64*(i+num_class),:])
-        face_10_subjs = face_10_subjs.astype(float)        
-        label_10_subjs = np.array(Label[64*i:64*(i+num_class)]) 
-        label_10_subjs = label_10_subjs - label_10_subjs.min() + 1
-        label_10_subjs = np.squeeze(label_10_subjs)    
-        
-            
-        CAE.initlization()        
-        CAE.restore() # restore from pre-trained model    
-        
-        max_step =  50 + num_class*25# 100+num_class*20
-        display_step = max_step
-        lr = 1.0e-3
-        # fine-tune network
-        epoch = 0
-        while epoch < max_step:
-            epoch = epoch + 1           
-            cost, Coef = CAE.partial_fit(face_10_subjs, lr)#                                  
-            if epoch % display_step == 0:
-                print "epoch: %.1d" % epoch, "cost: %.8f" % (cost/float(batch_size))                
-                Coef = thrC(Coef,alpha)                                          
-                y_x, _ = post_proC(Coef, label_10_subjs.max(), 10, 3.5)                  
-                missrate_x = err_rate(label_10_subjs, y_x)                
-                acc_x = 1 - missrate_x 
-                print "experiment: %d" % i, "our accuracy: %.4f" % acc_x
-        acc_.append(acc_x)    
-    
+def subset_alpha(num_class):
+    return max(0.4 - (num_class-1)/10 * 0.1, 0.1)
+
+def subset_steps(num_class):
+    return 50 + num_class*25# 100+num_class*20
+
+def subset_data(Img, Label, num_class, i):
+    # images and labels 1..num_class of subjects i..i+num_class-1
+    face_10_subjs = np.array(Img[64*i:64*(i+num_class),:])
+    face_10_subjs = face_10_subjs.astype(float)        
+    label_10_subjs = np.array(Label[64*i:64*(i+num_class)]) 
+    label_10_subjs = label_10_subjs - label_10_subjs.min() + 1
+    label_10_subjs = np.squeeze(label_10_subjs)    
+    return face_10_subjs, label_10_subjs
+
+def evaluate_subset(Coef, label_10_subjs, alpha, i):
+    Coef = thrC(Coef,alpha)                                          
+    y_x, _ = post_proC(Coef, label_10_subjs.max(), 10, 3.5)                  
+    missrate_x = err_rate(label_10_subjs, y_x)                
+    acc_x = 1 - missrate_x 
+    print "experiment: %d" % i, "our accuracy: %.4f" % acc_x
+    return acc_x
+
+def run_subset(Img, Label, CAE, num_class, i):
+    # fine-tunes the pretrained CAE on subjects i..i+num_class-1, returns the accuracy
+    alpha = subset_alpha(num_class)
+    face_10_subjs, label_10_subjs = subset_data(Img, Label, num_class, i)
+    
+    max_step =  subset_steps(num_class)
+    display_step = max_step
+    lr = 1.0e-3
+    # fine-tune network
+    epoch = 0
+    while epoch < max_step:
+        epoch = epoch + 1           
+        cost, Coef = CAE.partial_fit(face_10_subjs, lr)#                                  
+        if epoch % display_step == 0:
+            print "epoch: %.1d" % epoch, "cost: %.8f" % (cost/float(face_10_subjs.shape[0]))                
+            acc_x = evaluate_subset(Coef, label_10_subjs, alpha, i)
+    return acc_x
+
+def run_subsets_batched(Img, Label, CAE, num_class, subsets):
+    # run_subset for CAE.n_subsets subsets at once on a BatchedConvAE, returns their accuracies
+    alpha = subset_alpha(num_class)
+    data = [subset_data(Img, Label, num_class, i) for i in subsets]
+    faces = np.stack([face for face, _ in data])
+    lr = 1.0e-3
+    max_step = subset_steps(num_class)
+    for epoch in range(max_step):
+        cost, Coef = CAE.partial_fit(faces, lr)
+    acc_ = []
+    for p, i in enumerate(subsets):
+        face_10_subjs, label_10_subjs = data[p]
+        print "epoch: %.1d" % max_step, "cost: %.8f" % (cost[p]/float(face_10_subjs.shape[0]))
+        acc_.append(evaluate_subset(Coef[p], label_10_subjs, alpha, i))
+    return acc_
+
+def subset_groups(num_class, batch_subsets):
+    # the 39-num_class subsets in groups of batch_subsets, each group is fine-tuned in one graph
+    subsets = list(range(0,39-num_class))
+    size = max(batch_subsets, 1)
+    return [tuple(subsets[start:start+size]) for start in range(0, len(subsets), size)]
+
+def summarize(num_class, acc_):
     acc_ = np.array(acc_)
     m = np.mean(acc_)
     me = np.median(acc_)
@@ -288,12 +394,78 @@ def test_face(Img, Label, CAE, num_class):
     print(acc_) 
     
     return (1-m), (1-me)  
+
+def test_face(Img, Label, CAE, num_class):       
+    
+    alpha = subset_alpha(num_class)
+    print alpha
+    
+    acc_= []
+    for i in range(0,39-num_class): 
+        CAE.initlization()        
+        CAE.restore() # restore from pre-trained model    
+        acc_.append(run_subset(Img, Label, CAE, num_class, i))    
+    
+    return summarize(num_class, acc_)
+
+def build_model(args, num_class, n_input, kernel_size, n_hidden, config=None, n_subsets=1):
+    batch_size = num_class * 64
+    reg1 = 1.0
+    reg2 = 1.0 * 10 ** (num_class / 10.0 - 3.0)           
+    tf.reset_default_graph()
+    if n_subsets > 1:
+        return BatchedConvAE(n_input=n_input, n_hidden=n_hidden, n_subsets=n_subsets, reg_constant1=reg1, re_constant2=reg2, \
+                             kernel_size=kernel_size, batch_size=batch_size, restore_path=args.model_path, config=config)
+    return ConvAE(n_input=n_input, n_hidden=n_hidden, reg_constant1=reg1, re_constant2=reg2, \
+                  kernel_size=kernel_size, batch_size=batch_size, model_path=args.model_path, restore_path=args.model_path, \
+                  logs_path=args.logs_path, config=config)
+
+"""
+With --workers, every group of subset experiments (num_class, subsets) is a job of scheduler.run_jobs, a
+single subset unless --batch-subsets is set. A worker keeps the model of the last num_class and group size
+it ran (jobs come largest first, so mostly the same one), and reads the pretrained weights from the
+checkpoint only once, later jobs and models get them from memory. --batch-subsets without --workers runs
+the same jobs in this process.
+"""
+def setup_worker(profile, args, Img, Label, n_input, kernel_size, n_hidden):
+    return {'profile': profile, 'args': args, 'Img': Img, 'Label': Label, 'shape': (n_input, kernel_size, n_hidden),
+            'CAE': None, 'num_class': None, 'pretrained': None}
+
+def run_subset_job(state, job):
+    num_class, subsets = job
+    if state['num_class'] != (num_class, len(subsets)):
+        if state['CAE'] is not None:
+            state['CAE'].sess.close()
+        config = state['profile'].configure(tf.ConfigProto())
+        state['CAE'] = build_model(state['args'], num_class, *state['shape'], config=config, n_subsets=len(subsets))
+        state['num_class'] = (num_class, len(subsets))
+    CAE = state['CAE']
+    CAE.initlization()
+    if state['pretrained'] is None:
+        CAE.restore() # restore from pre-trained model
+        state['pretrained'] = CAE.get_pretrained()
+    else:
+        CAE.set_pretrained(state['pretrained'])
+    # fine-tuning and post_proC both stay on the worker's cores
+    with state['profile'].evaluation():
+        if len(subsets) > 1:
+            return run_subsets_batched(state['Img'], state['Label'], CAE, num_class, subsets)
+        return [run_subset(state['Img'], state['Label'], CAE, num_class, subsets[0])]
+
+def test_face_batched(state, num_class, batch_subsets):
+    acc_ = []
+    for subsets in subset_groups(num_class, batch_subsets):
+        acc_ += run_subset_job(state, (num_class, subsets))
+    return summarize(num_class, acc_)
         
     
 if __name__ == '__main__':
+    args = parser.parse_args()
+    svd_backend.configure(args)
+    spectral.configure(args)
     
     # load face images and labels
-    data = sio.loadmat('/home/pan/workspace-eclipse/deep-subspace-clustering/face_datasets/YaleBCrop025.mat')
+    data = sio.loadmat(args.data)
     img = data['Y']
     I = []
     Label = []
@@ -312,61 +484,48 @@ if __name__ == '__main__':
     kernel_size = [5,3,3]
     n_hidden = [10,20,30]
     
-    all_subjects = [10, 15, 20, 25, 30, 35, 38]
+    all_subjects = args.subjects
     
     avg = []
     med = []
     
-    iter_loop = 0
-    while iter_loop < len(all_subjects):
-        num_class = all_subjects[iter_loop]
-        batch_size = num_class * 64
-        reg1 = 1.0
-        reg2 = 1.0 * 10 ** (num_class / 10.0 - 3.0)           
-        model_path = '/home/pan/workspace-eclipse/deep-subspace-clustering/models_face/model-102030-48x42-yaleb.ckpt' 
-        restore_path = '/home/pan/workspace-eclipse/deep-subspace-clustering/models_face/model-102030-48x42-yaleb.ckpt' 
-        logs_path = '/home/pan/workspace-eclipse/deep-subspace-clustering/conv_3_l1_yaleb/ft/logs' 
-        tf.reset_default_graph()
-        CAE = ConvAE(n_input=n_input, n_hidden=n_hidden, reg_constant1=reg1, re_constant2=reg2, \
-                     kernel_size=kernel_size, batch_size=batch_size, model_path=model_path, restore_path=restore_path, logs_path=logs_path)
-    
-        avg_i, med_i = test_face(Img, Label, CAE, num_class)
-        avg.append(avg_i)
-        med.append(med_i)
-        iter_loop = iter_loop + 1
+    workers = scheduler.plan_workers(args.workers, args.cores_per_worker, args.memory_budget, args.memory_per_worker)
+    # the report is written by the scheduler, so a --report run goes through it even with a single worker
+    in_process = workers == 1 and not args.report
+    if in_process and args.batch_subsets > 1:
+        state = setup_worker(cpu.CPUProfile(None), args, Img, Label, n_input, kernel_size, n_hidden)
+        for num_class in all_subjects:
+            avg_i, med_i = test_face_batched(state, num_class, args.batch_subsets)
+            avg.append(avg_i)
+            med.append(med_i)
+    elif in_process:
+        iter_loop = 0
+        while iter_loop < len(all_subjects):
+            num_class = all_subjects[iter_loop]
+            CAE = build_model(args, num_class, n_input, kernel_size, n_hidden)
+        
+            avg_i, med_i = test_face(Img, Label, CAE, num_class)
+            avg.append(avg_i)
+            med.append(med_i)
+            iter_loop = iter_loop + 1
+    else:
+        jobs = [(num_class, subsets) for num_class in all_subjects for subsets in subset_groups(num_class, args.batch_subsets)]
+        print 'running %d jobs of subset experiments on %d workers' % (len(jobs), workers)
+        report = scheduler.Report(args.report, args.memory_per_worker)
+        for row in scheduler.run_jobs(jobs, setup_worker, run_subset_job, workers,
+                                      setup_args=(args, Img, Label, n_input, kernel_size, n_hidden),
+                                      cores_per_worker=args.cores_per_worker, size=lambda job: job[0] * len(job[1])):
+            report.add(row, len(jobs))
+        report.close()
+        groups = report.groups(lambda job: job[0])
+        for num_class in all_subjects:
+            avg_i, med_i = summarize(num_class, sum(groups.get(num_class, []), []) or [np.nan])
+            avg.append(avg_i)
+            med.append(med_i)
         
     iter_loop = 0
     while iter_loop < len(all_subjects):
         num_class = all_subjects[iter_loop]
         print '%d subjects:' % num_class
         print 'Mean: %.4f%%' % (avg[iter_loop]*100), 'Median: %.4f%%' % (med[iter_loop]*100) 
-        iter_loop = iter_loop + 1      
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
+        iter_loop = iter_loop + 1
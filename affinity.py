@@ -0,0 +1,97 @@
+"""
+Affinity construction shared by the training scripts
+
+The scripts each had their own copies of
+    build_aff      : |C| with every column divided by its largest entry, plus its transpose. The maximum
+                     came from an argsort of the whole matrix (O(N^2 log N)) and the division ran in a
+                     Python loop over the N columns
+    build_laplacian: the row-normalized D^-1 |C|, with D^-1 formed as a dense N x N diagonal matrix and
+                     multiplied in, O(N^3)
+    post_proC      : |U U^T|^alpha (the positive part of U U^T in dsc_gan.py, dsc_gan2.py and
+                     DSC-Net-L2-EYaleB.py), scaled to a maximum of 1 and symmetrized
+Here the column maxima are a max along an axis, diagonal scalings are broadcasts (sparse.diags for scipy
+sparse input, the Coef of --knn and --coef-prox) and the post_proC affinity is computed in place, one
+N x N array instead of four. kernel() is the affinity block between two sets of embedding rows, which
+the landmark mode of spectral.py uses as well. thrC_sparse() is the scripts' thrC for a scipy sparse Coef.
+"""
+import numpy as np
+from scipy import sparse
+
+
+def column_max(C):
+    # largest entry of every column as a flat array, C dense or scipy sparse and nonnegative
+    return np.asarray(C.max(0).todense() if sparse.issparse(C) else C.max(0)).ravel()
+
+
+def scale_columns(C, s):
+    return C.dot(sparse.diags(s)).tocsr() if sparse.issparse(C) else C * s[None, :]
+
+
+def scale_rows(C, s):
+    return sparse.diags(s).dot(C).tocsr() if sparse.issparse(C) else C * s[:, None]
+
+
+def thrC_sparse(C, ro):
+    """
+    thrC for a scipy.sparse C, only the stored entries of each column are sorted; returns CSC
+    """
+    C = sparse.csc_matrix(C)
+    if ro >= 1:
+        return C
+    rows, cols, vals = [], [], []
+    for i in range(C.shape[1]):
+        v = C.data[C.indptr[i]:C.indptr[i + 1]]
+        if len(v) == 0:
+            continue
+        order = np.argsort(-np.abs(v))
+        csum = np.cumsum(np.abs(v[order]))
+        # like thrC: the largest entries up to and including the one where the sum exceeds ro * L1
+        keep = order[:min(np.searchsorted(csum, ro * csum[-1], side='right') + 1, len(v))]
+        rows.append(C.indices[C.indptr[i]:C.indptr[i + 1]][keep])
+        cols.append(np.full(len(keep), i))
+        vals.append(v[keep])
+    if not vals:
+        return sparse.csc_matrix(C.shape)
+    return sparse.csc_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=C.shape)
+
+
+def build_aff(C):
+    """
+    |C| with every column scaled to a maximum of 1, symmetrized as Cabs + Cabs^T
+    """
+    Cabs = abs(C)
+    Cabs = scale_columns(Cabs, 1. / (column_max(Cabs) + 1e-6))
+    return Cabs + Cabs.T
+
+
+def build_laplacian(C):
+    """
+    D^-1 A for A = (|C| + |C^T|) / 2 and D the diagonal of its column sums, the random walk matrix
+    """
+    A = 0.5 * (abs(C) + abs(C.T))
+    W = np.asarray(A.sum(0)).ravel()
+    return scale_rows(A, 1.0 / W)
+
+
+def kernel(alpha, positive=False):
+    """
+    the function (X, Y) -> |X Y^T|^alpha, or max(X Y^T, 0)^alpha with positive, of post_proC
+    """
+    def block(X, Y):
+        Z = X.dot(Y.T)
+        if positive:
+            np.maximum(Z, 0, out=Z)
+        else:
+            np.abs(Z, out=Z)
+        Z **= alpha
+        return Z
+    return block
+
+
+def post_affinity(U, block):
+    """
+    the affinity post_proC clusters, block(U, U) scaled to a maximum of 1 and symmetrized
+    """
+    L = block(U, U)
+    L /= L.max()
+    return 0.5 * (L + L.T)
@@ -0,0 +1,509 @@
+"""
+Benchmarks for the training and evaluation hot paths
+
+Every benchmark runs on synthetic union-of-subspaces images with a fixed seed, at each of the --sizes
+settings (K subspaces with M images each, N = K*M). Covered are the post-processing functions (thrC,
+build_aff, build_laplacian, post_proC, best_map, each backend of svd_backend.py and each method of
+spectral.py), and for each training script the graph build, one call of every partial_fit_* / step*
+method on the full batch, and whole fine-tuning epochs including evaluation.
+
+Example:
+    python benchmark.py --out bench_before.json
+    python benchmark.py --out bench_after.json --baseline bench_before.json
+        the second run prints the ratio to the first one and exits with status 1 if any benchmark got
+        more than --tolerance slower
+    CUDA_VISIBLE_DEVICES= python benchmark.py --scripts dsc_gan5 t28825 --skip-post --xla
+        CPU only, also runs the scripts that have --xla with it (as dsc_gan5+xla, ...) and prints their
+        ratio to the uncompiled graph
+    CUDA_VISIBLE_DEVICES= python benchmark.py --sizes 20x50 --cores 2 4 8
+        also runs everything with the CPU execution profile of cpu.py at each core count n (as
+        dsc_gan5@4c, post@4c, ...): training on cores 0..n-1, evaluation on the next n cores if the
+        machine has them, otherwise on the same ones; prints the ratio to the default thread pools
+    CUDA_VISIBLE_DEVICES= python benchmark.py --scripts dsc_gan5 --skip-post --coef-closed --converge 0.9
+        also runs the scripts that have --coef-closed with it (as dsc_gan5+closed, ...), and for both
+        times the self-expression phase from the same pretrained weights until the clustering reaches
+        90% accuracy: seconds of training (evaluations not counted) and epochs needed
+    python benchmark.py --skip-train --sizes 100x72 --landmarks 500 1000 --landmark-sizes 100x720 100x2160
+        times the clustering post_proC runs after its SVD, exactly and through 500 and 1000 landmarks with
+        either extension of spectral.py, with the accuracy of each; at the --landmark-sizes the embedding is
+        synthetic and the exact path only runs up to --landmark-exact-max samples
+"""
+import argparse
+import imp
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+import cpu
+import affinity
+import masks
+import spectral
+import svd_backend
+import synthetic
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--out',        default=None)                   # write results to this JSON file
+parser.add_argument('--baseline',   default=None)                   # JSON file of an earlier run to compare against
+parser.add_argument('--tolerance',  type=float, default=0.2)        # relative slowdown of the median that counts as a regression
+parser.add_argument('--sizes',      nargs='+',  default=['5x20', '10x40', '20x50'])   # KxM, K subspaces with M points each
+parser.add_argument('--scripts',    nargs='+',  default=None)       # training scripts to benchmark, default all
+parser.add_argument('--post-script',default='dsc_gan5')             # script whose thrC/post_proC/best_map are timed
+parser.add_argument('--repeat',     type=int,   default=5)          # timed runs per benchmark, the median is reported
+parser.add_argument('--epochs',     type=int,   default=4)          # epochs per phase in the epoch benchmarks
+parser.add_argument('--seed',       type=int,   default=0)
+parser.add_argument('--skip-post',  action='store_true')            # training scripts only
+parser.add_argument('--skip-train', action='store_true')            # post-processing only, no TensorFlow graphs
+parser.add_argument('--xla',        action='store_true')            # also benchmark the scripts in xla_scripts with --xla
+parser.add_argument('--cores',      nargs='+',  type=int, default=[])  # also benchmark with the CPU profile on this many cores each
+parser.add_argument('--coef-closed',action='store_true')            # also benchmark the scripts in closed_scripts with --coef-closed
+parser.add_argument('--converge',   type=float, default=None)       # accuracy to reach in the time-to-accuracy benchmark of closed_scripts
+parser.add_argument('--converge-every',   type=int, default=10)     # epochs between evaluations of the time-to-accuracy benchmark
+parser.add_argument('--converge-epochs',  type=int, default=1000)   # epochs after which it gives up
+parser.add_argument('--converge-pretrain',type=int, default=200)    # pretraining steps before it, the same for every variant
+parser.add_argument('--landmarks',  nargs='+', type=int, default=[])   # also cluster through this many landmarks each, see bench_landmarks
+parser.add_argument('--landmark-sizes',   nargs='+', default=[])   # KxM settings where only the clustering after the SVD is benchmarked
+parser.add_argument('--landmark-exact-max', type=int, default=20000) # largest N the exact path runs at in the landmark benchmark
+
+
+folder = os.path.dirname(os.path.abspath(__file__))
+
+# shared by all scripts, the ORL architecture on 32x32 images
+n_input     = [32, 32]
+n_hidden    = [5, 3, 3]
+kernel_size = [5, 3, 3]
+disc_size   = [200, 50, 1]
+subspace_dim = 5
+
+
+def self_expression(Img, lambd=1.0):
+    # closed-form C = argmin ||X - CX||^2 + lambd ||C||^2 with the diagonal zeroed, stands in for a trained Coef
+    X = Img.reshape(Img.shape[0], -1).astype(np.float64)
+    G = X.dot(X.T)
+    C = np.linalg.solve(G + lambd * np.eye(G.shape[0]), G)
+    np.fill_diagonal(C, 0)
+    return C
+
+
+def measure(func, repeat, warmup=1):
+    for i in range(warmup):
+        func()
+    times = []
+    for i in range(repeat):
+        t_begin = time.time()
+        func()
+        times.append(time.time() - t_begin)
+    return {'median': float(np.median(times)), 'min': float(np.min(times)), 'mean': float(np.mean(times)), 'repeat': repeat}
+
+
+modules = {}
+def load_script(name):
+    # the scripts are not importable as a package (and DSC-Net-L2-EYaleB is not a module name), load them by path
+    if name not in modules:
+        modules[name] = imp.load_source(name.replace('-', '_'), os.path.join(folder, name + '.py'))
+    return modules[name]
+
+
+def make_args(mod, flags=()):
+    # the script's own defaults, as if run with only an experiment name (and flags)
+    args = mod.parser.parse_args(['benchmark'] + list(flags))
+    # globals the scripts read from inside ConvAE and reinit_and_optimize
+    mod.args = args
+    mod.kernel_size = kernel_size
+    return args
+
+
+def build_gan(mod, args, Img, Label, logs_path):
+    # the constructor shared by dsc_gan, dsc_gan2, dsc_gan5, dsc_resgan and t28825
+    n_class = len(np.unique(Label))
+    kwargs = {'rank': args.rank} if 'rank' in args else {}
+    return mod.ConvAE(args,
+            n_input, n_hidden, kernel_size, n_class, Img.shape[0] // n_class, disc_size,
+            args.lambda1, args.lambda2, args.lambda3, Img.shape[0], r=args.r,
+            reg=tf.contrib.layers.l2_regularizer(tf.ones(1) * args.lambda4), disc_bound=args.bound,
+            logs_path=logs_path, **kwargs)
+
+
+def build_incomplete(mod, args, Img, Label, logs_path):
+    n_class = len(np.unique(Label))
+    Masks = masks.make_masks('pixel', Img.shape, 0.1, seed=0)
+    CAE = mod.ConvAE(args,
+            n_input, n_hidden, kernel_size, n_class, Img.shape[0] // n_class,
+            args.lambda1, args.lambda2, args.lambda3, Img.shape[0], args.hardness,
+            reg=tf.contrib.layers.l2_regularizer(tf.ones(1) * args.lambda4), mask_mode=Masks.mode,
+            logs_path=logs_path)
+    CAE.Masks = Masks  # kept with the model for setup_incomplete and the pretraining step
+    return CAE
+
+
+def build_dscnet(mod, args, Img, Label, logs_path):
+    n_class = len(np.unique(Label))
+    return mod.ConvAE(n_input=n_input, n_hidden=n_hidden, kernel_size=kernel_size,
+            reg_constant1=1.0, re_constant2=1.0 * 10 ** (n_class / 10.0 - 3.0), batch_size=Img.shape[0],
+            logs_path=logs_path)
+
+
+def make_args_dscnet(mod, flags=()):
+    mod.kernel_size = kernel_size
+    return None
+
+
+def setup_u(CAE, Img, Label):
+    CAE.assign_u_parameter(Img, Label)
+
+
+def setup_incomplete(CAE, Img, Label):
+    CAE.set_mask(CAE.Masks.index(mode=CAE.mask_mode))
+    CAE.initialize_kmeans(self_expression(Img), Label)
+
+
+lr = 1e-4
+minibatch_size = 128
+steps_gan = [
+    ('partial_fit_pretrain', lambda CAE, Img, Label: CAE.partial_fit_pretrain(Img[:minibatch_size], lr)),
+    ('partial_fit_eqn3',     lambda CAE, Img, Label: CAE.partial_fit_eqn3(Img, lr)),
+    ('partial_fit_disc',     lambda CAE, Img, Label: CAE.partial_fit_disc(Img, Label, lr)),
+    ('partial_fit_eqn3plus', lambda CAE, Img, Label: CAE.partial_fit_eqn3plus(Img, Label, lr))]
+steps_resgan = [
+    ('partial_fit_pretrain', lambda CAE, Img, Label: CAE.partial_fit_pretrain(Img[:minibatch_size], lr)),
+    ('partial_fit_eqn3',     lambda CAE, Img, Label: CAE.partial_fit_eqn3(Img, lr)),
+    ('step1_assign_u',       lambda CAE, Img, Label: CAE.step1_assign_u(Img, Label)),
+    ('step2_optimize_loss_u_combined',  lambda CAE, Img, Label: CAE.step2_optimize_loss_u_combined(Img, Label, lr)),
+    ('step3_optimize_loss_ae_combined', lambda CAE, Img, Label: CAE.step3_optimize_loss_ae_combined(Img, Label, lr)),
+    ('step4_optimize_loss_disc',        lambda CAE, Img, Label: CAE.step4_optimize_loss_disc(Img, Label, lr)),
+    ('step5_optimize_loss_gen',         lambda CAE, Img, Label: CAE.step5_optimize_loss_gen(Img, Label, lr))]
+steps_incomplete = [
+    ('partial_fit_pretrain', lambda CAE, Img, Label: CAE.partial_fit_pretrain(Img[:minibatch_size],
+            CAE.Masks.index(np.arange(min(minibatch_size, Img.shape[0])), mode=CAE.mask_mode), lr)),
+    ('partial_fit_eqn3',     lambda CAE, Img, Label: CAE.partial_fit_eqn3(Img, lr)),
+    ('partial_fit_eqn3plus', lambda CAE, Img, Label: CAE.partial_fit_eqn3plus(Img, lr))]
+steps_dscnet = [
+    ('partial_fit',          lambda CAE, Img, Label: CAE.partial_fit(Img, lr))]
+
+"""
+For each script: how to make its args, build its ConvAE and prepare it for the GAN steps, its steps,
+and which of them make up an epoch of the first (self-expression) and second (GAN) fine-tuning phase.
+"""
+scripts = {
+    'dsc_gan':    (make_args, build_gan, None, steps_gan,
+                   ['partial_fit_eqn3'], ['partial_fit_disc', 'partial_fit_eqn3plus']),
+    'dsc_gan2':   (make_args, build_gan, setup_u, steps_gan,
+                   ['partial_fit_eqn3'], ['partial_fit_disc', 'partial_fit_eqn3plus']),
+    'dsc_gan5':   (make_args, build_gan, setup_u, steps_gan,
+                   ['partial_fit_eqn3'], ['partial_fit_disc', 'partial_fit_eqn3plus']),
+    't28825':     (make_args, build_gan, setup_u, steps_gan,
+                   ['partial_fit_eqn3'], ['partial_fit_disc', 'partial_fit_eqn3plus']),
+    'dsc_resgan': (make_args, build_gan, setup_u, steps_resgan,
+                   ['partial_fit_eqn3'], [name for name, _ in steps_resgan[2:]]),
+    'incomplete': (make_args, build_incomplete, setup_incomplete, steps_incomplete,
+                   ['partial_fit_eqn3'], ['partial_fit_eqn3plus']),
+    'DSC-Net-L2-EYaleB': (make_args_dscnet, build_dscnet, None, steps_dscnet,
+                   ['partial_fit'], [])}
+# scripts with an --xla option
+xla_scripts = ['dsc_gan5', 't28825']
+# scripts with a --coef-closed option
+closed_scripts = ['dsc_gan', 'dsc_gan5']
+
+
+def evaluate(mod, CAE, Coef, Label, n_class):
+    # what reinit_and_optimize does every interval epochs
+    Coef = mod.thrC(Coef, 0.1)
+    with getattr(CAE, 'cpu', no_profile).evaluation():
+        y_x, _ = mod.post_proC(Coef, n_class, subspace_dim, 3.5)
+    return mod.err_rate(Label, y_x)
+
+
+def core_flags(n_cores):
+    # --train-cores/--eval-cores of the CPU profile on n_cores cores, disjoint if the machine has enough
+    available = cpu.get_affinity() or list(range(n_cores))
+    train = available[:n_cores]
+    evaluation = available[n_cores:2 * n_cores]
+    if len(evaluation) < n_cores:
+        evaluation = train
+    return ['--train-cores', cpu.format_cores(train), '--eval-cores', cpu.format_cores(evaluation)]
+
+
+def profile_of(flags):
+    # the CPU profile that flags give the scripts, for the benchmarks that run without a ConvAE
+    cpu_parser = argparse.ArgumentParser()
+    cpu.add_arguments(cpu_parser)
+    return cpu.CPUProfile(cpu_parser.parse_known_args(flags)[0])
+
+no_profile = cpu.CPUProfile(None)
+
+
+def unpin(cores):
+    # undo what a profiled benchmark pinned, so the next benchmark starts from the whole machine again
+    if cores:
+        cpu.pin_threads(cores)
+    cpu.CPUProfile.moved_threads = False
+
+
+def bench_post(mod, Img, Label, n_class, repeat, profile=no_profile):
+    C = self_expression(Img)
+    Cp = mod.thrC(C, 0.1)
+    # a permuted labelling, so best_map has a non-trivial assignment to find
+    y_x = np.random.RandomState(0).permutation(n_class)[Label]
+    with profile.evaluation():
+        yield 'thrC',      measure(lambda: mod.thrC(C, 0.1), repeat)
+        yield 'build_aff', measure(lambda: affinity.build_aff(Cp), repeat)
+        yield 'build_laplacian', measure(lambda: affinity.build_laplacian(Cp), repeat)
+        yield 'post_proC', measure(lambda: mod.post_proC(Cp, n_class, subspace_dim, 3.5), repeat)
+        yield 'best_map',  measure(lambda: mod.best_map(Label, y_x), repeat)
+        # every SVD backend on the matrix post_proC decomposes, with the residual of its rank-r approximation
+        Cs = 0.5 * (Cp + Cp.T)
+        for method in sorted(svd_backend.backends):
+            result = measure(lambda: svd_backend.svds(Cs, subspace_dim * n_class + 1, method), repeat)
+            result['residual'] = float(svd_backend.last['residual'])
+            yield 'svd_' + method, result
+        # the native spectral engine against sklearn's SpectralClustering on the affinity post_proC builds
+        _, L = mod.post_proC(Cp, n_class, subspace_dim, 3.5)
+        for method in spectral.methods:
+            yield 'spectral_' + method, measure(lambda: spectral.cluster(L, n_class, method), repeat)
+
+
+def post_embedding(C, n_class):
+    # U of post_proC after the SVD, scaling and row normalization
+    C = 0.5 * (C + C.T)
+    U, S, _ = svd_backend.svds(C, subspace_dim * n_class + 1)
+    U = U[:, ::-1] * np.sqrt(S[::-1])
+    return U / np.linalg.norm(U, axis=1, keepdims=True)
+
+
+def bench_landmarks(mod, U, Label, n_class, landmarks, exact=True, alpha=3.5):
+    """
+    the clustering post_proC runs on its embedding U (dsc_gan5's |U U^T|^alpha affinity), exactly and
+    through each number of landmarks with each extension; yields (bench, result) with the seconds of one
+    run and the accuracy
+    """
+    kernel = affinity.kernel(alpha)
+
+    def run(func):
+        t_begin = time.time()
+        y = func()
+        return {'median': time.time() - t_begin, 'accuracy': 1 - mod.err_rate(Label, y), 'repeat': 1}
+    if exact:
+        yield 'exact', run(lambda: spectral.cluster(affinity.post_affinity(U, kernel), n_class))
+    for m in landmarks:
+        for extend in spectral.extensions:
+            yield 'm{}+{}'.format(m, extend), run(lambda: spectral.landmark_cluster(U, n_class, kernel, m, extend))
+
+
+def bench_train(name, Img, Label, n_class, repeat, epochs, seed, logs_path, flags=()):
+    make, build, setup, steps, epoch_eqn3, epoch_gan = scripts[name]
+    mod = load_script(name)
+    args = make(mod, flags)
+    mod.batch_size = Img.shape[0]
+
+    def build_graph():
+        tf.reset_default_graph()
+        tf.set_random_seed(seed)
+        np.random.seed(seed)
+        return build(mod, args, Img, Label, logs_path)
+
+    # graph build is timed once per repeat, each build replaces the previous graph and session
+    times = []
+    for i in range(repeat):
+        t_begin = time.time()
+        CAE = build_graph()
+        times.append(time.time() - t_begin)
+        if i < repeat - 1:
+            CAE.sess.close()
+    yield 'build', {'median': float(np.median(times)), 'min': float(np.min(times)), 'mean': float(np.mean(times)), 'repeat': repeat}
+
+    CAE.initlization()
+    if setup is not None:
+        setup(CAE, Img, Label)
+    step_funcs = dict(steps)
+    for step, func in steps:
+        yield step, measure(lambda: func(CAE, Img, Label), repeat)
+
+    # whole epochs: epochs of each phase back to back, then the evaluation reinit_and_optimize runs
+    def run_epochs():
+        for phase in [epoch_eqn3, epoch_gan]:
+            for epoch in range(epochs if phase else 0):
+                for step in phase:
+                    step_funcs[step](CAE, Img, Label)
+            if phase:
+                evaluate(mod, CAE, CAE.sess.run(CAE.Coef, feed_dict={CAE.x: Img}), Label, n_class)
+    result = measure(run_epochs, 1, warmup=0)
+    n_epochs = epochs * len([phase for phase in [epoch_eqn3, epoch_gan] if phase])
+    result['per_epoch'] = result['median'] / n_epochs
+    yield 'epochs', result
+    CAE.sess.close()
+
+
+def bench_converge(name, Img, Label, n_class, seed, logs_path, target, every, max_epochs, pretrain, flags=()):
+    """
+    time to accuracy: pretraining steps with a fixed seed, so every variant starts from the same weights,
+    then self-expression epochs at the script's --lr until the accuracy of the evaluation reaches target
+    """
+    make, build, setup, steps, epoch_eqn3, epoch_gan = scripts[name]
+    mod = load_script(name)
+    args = make(mod, flags)
+    mod.batch_size = Img.shape[0]
+    tf.reset_default_graph()
+    tf.set_random_seed(seed)
+    np.random.seed(seed)
+    CAE = build(mod, args, Img, Label, logs_path)
+    CAE.initlization()
+    for i in range(pretrain):
+        CAE.partial_fit_pretrain(Img, args.lr)
+    seconds, acc, epoch = 0.0, 0.0, 0
+    while epoch < max_epochs and acc < target:
+        t_begin = time.time()
+        for i in range(every):
+            CAE.partial_fit_eqn3(Img, args.lr)
+        Coef = CAE.sess.run(CAE.Coef, feed_dict={CAE.x: Img})
+        seconds += time.time() - t_begin
+        epoch += every
+        acc = 1.0 - evaluate(mod, CAE, Coef, Label, n_class)
+    CAE.sess.close()
+    # median is the seconds of training, so compare() puts it next to the other variant's
+    return {'median': seconds, 'epochs': epoch, 'accuracy': acc, 'reached': acc >= target, 'repeat': 1}
+
+
+def compare(results, baseline, tolerance):
+    """
+    prints current against baseline medians, returns the names of the benchmarks that got slower by more
+    than tolerance
+    """
+    regressions = []
+    print('{:<60} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline(s)', 'current(s)', 'ratio'))
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key]['median'] / max(baseline[key]['median'], 1e-9)
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print('{:<60} {:>12.4f} {:>12.4f} {:>8.2f}{}'.format(key, baseline[key]['median'], results[key]['median'], ratio, flag))
+    return regressions
+
+
+def main(args):
+    names = []
+    for name in args.scripts or sorted(scripts):
+        assert name in scripts, 'unknown script {}, choose from {}'.format(name, sorted(scripts))
+        try:
+            load_script(name)
+            names.append(name)
+        except ImportError as e:
+            # e.g. dsc_gan.py needs skcuda/pycuda
+            print('skipping {}: {}'.format(name, e))
+    # (label, script, command line flags)
+    variants = [(name, name, []) for name in names]
+    if args.xla:
+        variants += [(name + '+xla', name, ['--xla']) for name in names if name in xla_scripts]
+    if args.coef_closed or args.converge:
+        variants += [(name + '+closed', name, ['--coef-closed']) for name in names if name in closed_scripts]
+    # DSC-Net-L2-EYaleB has no CPU profile options
+    for n_cores in args.cores:
+        variants += [('{}@{}c'.format(name, n_cores), name, core_flags(n_cores)) for name in names
+                     if name != 'DSC-Net-L2-EYaleB']
+    logs_path = tempfile.mkdtemp(prefix='benchmark_logs')
+    results = {}
+    all_cores = cpu.get_affinity()
+
+    def record(key, result):
+        results[key] = result
+        print('{:<60} {:>10.4f}s{}'.format(key, result['median'],
+                ', accuracy {:.4f}'.format(result['accuracy']) if 'accuracy' in result else ''))
+
+    for size in args.sizes:
+        n_class, n_per_class = [int(s) for s in size.split('x')]
+        Img, Label, _ = synthetic.SubspaceGenerator(n_class, n_per_class, subspace_dim, shape=n_input,
+                noise=0.05, seed=args.seed).generate()
+        tag = 'K{}xM{}'.format(n_class, n_per_class)
+        if not args.skip_post:
+            for bench, result in bench_post(load_script(args.post_script), Img, Label, n_class, args.repeat):
+                record('post/{}/{}'.format(bench, tag), result)
+            for n_cores in args.cores:
+                profile = profile_of(core_flags(n_cores))
+                for bench, result in bench_post(load_script(args.post_script), Img, Label, n_class, args.repeat, profile):
+                    record('post@{}c/{}/{}'.format(n_cores, bench, tag), result)
+                unpin(all_cores)
+            if args.landmarks:
+                mod = load_script(args.post_script)
+                U = post_embedding(mod.thrC(self_expression(Img), 0.1), n_class)
+                for bench, result in bench_landmarks(mod, U, Label, n_class, args.landmarks):
+                    record('landmarks/{}/{}'.format(bench, tag), result)
+        if args.skip_train:
+            continue
+        for label, name, flags in variants:
+            for bench, result in bench_train(name, Img, Label, n_class, args.repeat, args.epochs, args.seed, logs_path, flags):
+                record('{}/{}/{}'.format(label, bench, tag), result)
+            unpin(all_cores)
+            if args.converge and name in closed_scripts and (label == name or label == name + '+closed'):
+                result = bench_converge(name, Img, Label, n_class, args.seed, logs_path, args.converge,
+                        args.converge_every, args.converge_epochs, args.converge_pretrain, flags)
+                record('{}/converge/{}'.format(label, tag), result)
+                print('{:<60} {} epochs, accuracy {:.4f}{}'.format('', result['epochs'], result['accuracy'],
+                        '' if result['reached'] else ', target not reached'))
+    shutil.rmtree(logs_path, ignore_errors=True)
+    for size in args.landmark_sizes:
+        # past the sizes whose N x N Coef fits in memory: rows of K random subspaces of R^r stand in for
+        # post_proC's embedding U of a well-trained Coef
+        n_class, n_per_class = [int(s) for s in size.split('x')]
+        U, Label, _ = synthetic.SubspaceGenerator(n_class, n_per_class, subspace_dim,
+                shape=[subspace_dim * n_class + 1], noise=0.05, seed=args.seed).generate()
+        U = U.reshape(U.shape[0], -1)
+        U /= np.linalg.norm(U, axis=1, keepdims=True)
+        exact = U.shape[0] <= args.landmark_exact_max
+        for bench, result in bench_landmarks(load_script(args.post_script), U, Label, n_class, args.landmarks, exact):
+            record('landmarks-synthetic/{}/K{}xM{}'.format(bench, n_class, n_per_class), result)
+
+    meta = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'tensorflow': tf.__version__,
+        'machine': platform.machine(),
+        'node': platform.node(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'epochs': args.epochs,
+        'xla': args.xla,
+        'cores': args.cores,
+        'coef_closed': args.coef_closed,
+        'converge': args.converge,
+        'landmarks': args.landmarks,
+        'cpus': len(cpu.get_affinity() or []) or None,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+    if args.xla:
+        print('')
+        print('with --xla (current) against the uncompiled graph (baseline):')
+        compiled = dict((key.replace('+xla/', '/', 1), result) for key, result in results.items() if '+xla/' in key)
+        compare(compiled, results, float('inf'))
+    if args.coef_closed or args.converge:
+        print('')
+        print('with --coef-closed (current) against Adam on Coef (baseline):')
+        closed = dict((key.replace('+closed/', '/', 1), result) for key, result in results.items() if '+closed/' in key)
+        compare(closed, results, float('inf'))
+    for n_cores in args.cores:
+        suffix = '@{}c/'.format(n_cores)
+        print('')
+        print('on {} cores, {} (current) against the default thread pools (baseline):'.format(
+                n_cores, profile_of(core_flags(n_cores)).describe()))
+        pinned = dict((key.replace(suffix, '/', 1), result) for key, result in results.items() if suffix in key)
+        compare(pinned, results, float('inf'))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('{} regression(s) over {:.0f}%: {}'.format(len(regressions), args.tolerance * 100, ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,192 @@
+"""
+CPU execution profile for the training scripts
+
+Left alone, the TensorFlow session sizes its intra-op and inter-op thread pools to the whole machine, and
+so do the BLAS, OpenMP and ARPACK code under svds and SpectralClustering in post_proC. On a CPU-only node
+every evaluation then oversubscribes the cores the session is using. The --*-threads and --*-cores
+options split the machine instead:
+    --train-cores 0-11 --eval-cores 12-15
+        the session's thread pools are created on cores 0-11 and sized to them, post-processing runs on
+        cores 12-15 with at most 4 BLAS threads
+    --intra-threads / --inter-threads / --blas-threads
+        the pool sizes on their own, without pinning anything
+Unset options keep the library defaults, so without any of them nothing changes.
+
+Core affinity needs Linux with python 3 (os.sched_setaffinity) or psutil, limiting BLAS threads needs
+threadpoolctl or, for MKL only, mkl-service. Without them the options only size the TensorFlow pools and
+a warning is printed.
+"""
+import contextlib
+import os
+import threading
+
+
+def add_arguments(parser):
+    # options of the CPU execution profile, see the module docstring
+    parser.add_argument('--intra-threads',   type=int, default=None)   # TF intra-op pool, default the number of --train-cores
+    parser.add_argument('--inter-threads',   type=int, default=None)   # TF inter-op pool, default the number of --train-cores
+    parser.add_argument('--blas-threads',    type=int, default=None)   # BLAS/OpenMP threads of post-processing, default the number of --eval-cores
+    parser.add_argument('--train-cores',     default=None)             # cores of the training session, e.g. 0-11 or 0,2,4-7
+    parser.add_argument('--eval-cores',      default=None)             # cores of the evaluation (post_proC)
+
+
+warned = set()
+def warn_once(key, message):
+    if key not in warned:
+        warned.add(key)
+        print(message)
+
+
+def parse_cores(spec):
+    """
+    sorted list of core ids from '0-3,8,10-11', None for None or ''
+    """
+    if not spec:
+        return None
+    cores = set()
+    for part in spec.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cores.update(range(int(first), int(last) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+def format_cores(cores):
+    return ','.join([str(c) for c in cores])
+
+
+def thread_ids():
+    # linux: every thread of this process is a directory in /proc/self/task
+    try:
+        return [int(tid) for tid in os.listdir('/proc/self/task')]
+    except OSError:
+        return []
+
+
+def get_affinity():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return sorted(psutil.Process(os.getpid()).cpu_affinity())
+
+
+def set_affinity(cores, tid=None):
+    """
+    restrict thread tid (default the calling thread) to cores, threads it starts afterwards inherit them;
+    False if neither os.sched_setaffinity nor psutil is available
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(tid or 0, cores)
+        return True
+    try:
+        import psutil
+    except ImportError:
+        return False
+    if tid is None:
+        # psutil only knows processes, the main thread is the one whose id is the pid
+        assert isinstance(threading.current_thread(), threading._MainThread), 'pin other threads by their tid'
+        tid = os.getpid()
+    psutil.Process(tid).cpu_affinity(list(cores))
+    return True
+
+
+def pin_threads(cores, exclude=()):
+    """
+    set_affinity for every thread of this process but those in exclude, False if it isn't available
+    """
+    for tid in thread_ids():
+        if tid not in exclude and not set_affinity(cores, tid):
+            return False
+    return True
+
+
+@contextlib.contextmanager
+def blas_limit(n_threads):
+    """
+    at most n_threads threads in the BLAS and OpenMP libraries loaded in this process, inside the block
+    """
+    if not n_threads:
+        yield
+        return
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        threadpool_limits = None
+    if threadpool_limits is not None:
+        with threadpool_limits(limits=n_threads):
+            yield
+        return
+    try:
+        import mkl
+    except ImportError:
+        warn_once('blas', 'cpu: neither threadpoolctl nor mkl-service is installed, BLAS threads are not limited')
+        yield
+        return
+    previous = mkl.get_max_threads()
+    mkl.set_num_threads(n_threads)
+    try:
+        yield
+    finally:
+        mkl.set_num_threads(previous)
+
+
+affinity_warning = 'cpu: neither os.sched_setaffinity nor psutil is available, cores are not pinned'
+
+
+class CPUProfile(object):
+    # threads existing before the first session (the BLAS pool started when numpy was imported) are moved
+    # to the evaluation cores once per process
+    moved_threads = False
+
+    def __init__(self, args):
+        self.train_cores = parse_cores(getattr(args, 'train_cores', None))
+        self.eval_cores = parse_cores(getattr(args, 'eval_cores', None))
+        n_train = len(self.train_cores) if self.train_cores else 0
+        n_eval = len(self.eval_cores) if self.eval_cores else None
+        self.intra_threads = getattr(args, 'intra_threads', None) or n_train
+        self.inter_threads = getattr(args, 'inter_threads', None) or n_train
+        self.blas_threads = getattr(args, 'blas_threads', None) or n_eval
+
+    def configure(self, config):
+        """
+        sets the thread pool sizes of the session config, and pins the calling thread to the training
+        cores so the pools the session creates next start there; call it right before tf.Session(config)
+        """
+        # 0 lets TensorFlow choose
+        config.intra_op_parallelism_threads = self.intra_threads
+        config.inter_op_parallelism_threads = self.inter_threads
+        if self.eval_cores and not CPUProfile.moved_threads:
+            CPUProfile.moved_threads = True
+            if not pin_threads(self.eval_cores, exclude=[os.getpid()]):
+                warn_once('affinity', affinity_warning)
+        if self.train_cores and not set_affinity(self.train_cores):
+            warn_once('affinity', affinity_warning)
+        return config
+
+    @contextlib.contextmanager
+    def evaluation(self):
+        """
+        runs the block on the evaluation cores with at most blas_threads BLAS threads, then moves the
+        calling thread back to where it was
+        """
+        previous = get_affinity() if self.eval_cores else None
+        if previous is not None and not set_affinity(self.eval_cores):
+            warn_once('affinity', affinity_warning)
+            previous = None
+        try:
+            with blas_limit(self.blas_threads):
+                yield
+        finally:
+            if previous is not None:
+                set_affinity(previous)
+
+    def describe(self):
+        return 'train cores {}, eval cores {}, intra {}, inter {}, blas {}'.format(
+            format_cores(self.train_cores) if self.train_cores else 'all',
+            format_cores(self.eval_cores) if self.eval_cores else 'all',
+            self.intra_threads or 'default', self.inter_threads or 'default', self.blas_threads or 'default')
@@ -2,16 +2,21 @@ import tensorflow as tf
 import numpy as np
 from tensorflow.contrib import layers
 import scipy.io as sio
-from scipy.sparse.linalg import svds
 from skcuda.linalg import svd as svd_cuda
 import pycuda.gpuarray as gpuarray
 from pycuda.tools import DeviceMemoryPool
-from sklearn import cluster
 from sklearn.preprocessing import normalize
 from munkres import Munkres
 import os
 import time
 import argparse
+import synthetic
+import pipeline
+import cpu
+import selfexpress
+import svd_backend
+import spectral
+import affinity
 
 
 parser = argparse.ArgumentParser()
@@ -27,7 +32,7 @@ parser.add_argument('--lr2',        type=float, default=2e-4)   # learning rate
 parser.add_argument('--pretrain',   type=int,   default=0)      # number of iterations of pretraining
 parser.add_argument('--epochs',     type=int,   default=None)   # number of epochs to train on eqn3 and eqn3plus 
 parser.add_argument('--enable-at',  type=int,   default=1000)   # epoch at which to enable eqn3plus
-parser.add_argument('--dataset',    type=str,   default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100'])
+parser.add_argument('--dataset',    type=str,   default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100', 'synthetic'])
 parser.add_argument('--interval',   type=int,   default=50)
 parser.add_argument('--interval2',  type=int,   default=1)
 parser.add_argument('--bound',      type=float, default=0.02)   # discriminator weight clipping limit
@@ -50,6 +55,12 @@ parser.add_argument('--s-tau2',     type=float, default=0.99)
 parser.add_argument('--s-sparse-min', type=int, default=5)      # minimum number of dimensions in S that should be kept
 
 parser.add_argument('--submean',    action='store_true')
+parser.add_argument('--mem-budget', type=float, default=0)      # peak memory budget in MB for chunked fine-tuning, 0 runs the full batch at once
+parser.add_argument('--coef-closed',action='store_true')        # solve Coef in closed form every step, Adam only trains the autoencoder
+synthetic.add_arguments(parser)      # --synth-* options of --dataset synthetic
+cpu.add_arguments(parser)            # --*-threads and --*-cores of the CPU execution profile
+svd_backend.add_arguments(parser)    # --svd backend of post_proC, see svd_backend.py
+spectral.add_arguments(parser)       # --spectral clustering of post_proC, see spectral.py
 
 
 """
@@ -61,6 +72,10 @@ CUDA_VISIBLE_DEVICES=0 python dsc_gan.py yaleb_run1 --pretrain 60000 --epochs 40
 CUDA_VISIBLE_DEVICES=0 python dsc_gan.py orl_run1   --pretrain 10000 --epochs 4000 --enable-at 2000 --dataset orl
     pretrain for 10000 iterations first, then train on eqn3 for 2000 epochs, and on eqn3plus for 2000 epochs
 
+CUDA_VISIBLE_DEVICES=0 python dsc_gan.py yaleb_run2 --epochs 4000 --enable-at 3000 --dataset yaleb --mem-budget 2000
+    same fine-tuning as yaleb_run1 from the saved pretrained model, with the encoder and decoder run a chunk of
+    images at a time so that a step stays within about 2000MB
+
 """
 
 
@@ -97,15 +112,23 @@ class ConvAE(object):
 
         # self-expressive layer
         z = tf.reshape(latent, [batch_size, -1])
-        if r==0:
-            Coef = tf.Variable(1.0e-4 * tf.ones([self.batch_size, self.batch_size],tf.float32), name = 'Coef')
+        if args.coef_closed:
+            assert r==0 and args.mem_budget == 0, '--coef-closed solves the full NxN Coef, it does not take --r or --mem-budget'
+            # exact Coef for the current z, see selfexpress.py; the N x N matrix is only built when fetched
+            z.set_shape([batch_size, self.latent_size])
+            Coef, z_c, loss_sparsity = selfexpress.closed_form_coef(z, lambda1, lambda2)
         else:
-            v = (1e-2) / r
-            L = tf.Variable(v * tf.ones([self.batch_size, r]), name='Coef_L')
-            R = tf.Variable(v * tf.ones([r, self.batch_size]), name='Coef_R')
-            Coef = tf.matmul(L, R, name='Coef_full')
-        z_c = tf.matmul(Coef,z, name='matmul_Cz')
+            if r==0:
+                Coef = tf.Variable(1.0e-4 * tf.ones([self.batch_size, self.batch_size],tf.float32), name = 'Coef')
+            else:
+                v = (1e-2) / r
+                L = tf.Variable(v * tf.ones([self.batch_size, r]), name='Coef_L')
+                R = tf.Variable(v * tf.ones([r, self.batch_size]), name='Coef_R')
+                Coef = tf.matmul(L, R, name='Coef_full')
+            z_c = tf.matmul(Coef,z, name='matmul_Cz')
+            loss_sparsity = tf.reduce_sum(tf.pow(Coef,2.0))
         self.Coef = Coef
+        self.Coef_step = tf.no_op() if args.coef_closed else Coef # what the training steps return as Coef, None with --coef-closed
         Coef_weights = [v for v in tf.trainable_variables() if v.name.startswith('Coef')]
         latent_c = tf.reshape(z_c, tf.shape(latent)) # petential problem here
         self.z = z
@@ -121,7 +144,7 @@ class ConvAE(object):
 
         # Eqn 3 loss
         self.loss_recon = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(self.x_r, self.x), 2.0))
-        self.loss_sparsity = tf.reduce_sum(tf.pow(self.Coef,2.0))
+        self.loss_sparsity = loss_sparsity
         self.loss_selfexpress = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0))
         self.loss_eqn3 = self.loss_recon + lambda1 * self.loss_sparsity + lambda2 * self.loss_selfexpress + self.loss_aereg
         with tf.variable_scope('optimizer_eqn3'):
@@ -160,6 +183,11 @@ class ConvAE(object):
         with tf.variable_scope('optimizer_eqn3plus'):
             self.optimizer_eqn3plus = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss_eqn3plus, var_list=eqn3_weights)
 
+        # memory-bounded versions of the fine-tuning steps
+        self.chunk_size = None
+        if args.mem_budget > 0:
+            self.build_chunked(lambda1, lambda2, lambda3, Coef_weights, ae_weights, shape, args.mem_budget)
+
         # finalize stuffs
         s0 = tf.summary.scalar("loss_recon_pre",   self.loss_recon_pre / batch_size) # 13372
         s1 = tf.summary.scalar("loss_recon",       self.loss_recon)
@@ -174,6 +202,8 @@ class ConvAE(object):
         config = tf.ConfigProto()
         #config.gpu_options.allow_growth = True  # stop TF from eating up all GPU RAM 
         #config.gpu_options.per_process_gpu_memory_fraction = 0.4
+        self.cpu = cpu.CPUProfile(args)  # thread pools and cores of the session and of post_proC
+        self.cpu.configure(config)
         self.sess = tf.InteractiveSession(config=config)
         self.sess.run(self.init)
         self.saver = tf.train.Saver([v for v in ae_weights if v.name.startswith('enc_w') or v.name.startswith('dec_w')])
@@ -201,12 +231,13 @@ class ConvAE(object):
         input = z
         n_hidden = list(reversed([1] + self.n_hidden))
         shapes   = list(reversed(shapes))
+        batch    = tf.shape(z)[0]
         for i, k_size in enumerate(reversed(kernel_size)):
             with tf.variable_scope('', reuse=reuse):
                 w = tf.get_variable('dec_w{}'.format(i), shape=[k_size, k_size, n_hidden[i+1], n_hidden[i]],
                         initializer=layers.xavier_initializer_conv2d(), regularizer=self.reg)
                 b = tf.get_variable('dec_b{}'.format(i), shape=[n_hidden[i+1]], initializer=tf.zeros_initializer())
-                dec_i = tf.nn.conv2d_transpose(input, w, tf.stack([tf.shape(self.x)[0], shapes[i][1], shapes[i][2], shapes[i][3]]), 
+                dec_i = tf.nn.conv2d_transpose(input, w, tf.stack([batch, shapes[i][1], shapes[i][2], shapes[i][3]]), 
                     strides=[1,2,2,1], padding='SAME')
                 dec_i = tf.add(dec_i, b)
                 if i != len(self.n_hidden) - 1:
@@ -228,10 +259,10 @@ class ConvAE(object):
                 input = disc_i
         return input
 
-    def score_discriminator(self, z_real, z_fake, stop_real):
+    def score_discriminator(self, z_real, z_fake, stop_real, reuse=False):
         if stop_real:
             z_real = tf.stop_gradient(z_real)
-        score_real = self.discriminator(z_real)
+        score_real = self.discriminator(z_real, reuse=reuse)
         score_fake = self.discriminator(z_fake, reuse=True)
         score = tf.reduce_mean(score_real) - tf.reduce_mean(score_fake) # maximize score_real, minimize score_fake
         # a good discriminator would have a very positive score
@@ -317,9 +348,140 @@ class ConvAE(object):
         _, g_fake = tf.while_loop(cond, body, loop_vars=[i, g_fake], shape_invariants=[i.get_shape(), tf.TensorShape([None, None]) ])
         return g_fake
 
+    def build_chunked(self, lambda1, lambda2, lambda3, Coef_weights, ae_weights, shapes, mem_budget):
+        """
+        The full-batch steps keep the activations of every layer for all N images alive through the
+        backward pass. The chunked steps take the same gradient with only one chunk of images in the
+        encoder or decoder at a time:
+            1. encode each chunk and scatter its codes into z_full (N x latent_size)
+            2. z_c = Coef z_full on the whole batch, the self-expressive coupling stays exact
+            3. decode each chunk of z_c, accumulate the decoder gradients and dloss_recon/dz_c
+            4. backprop dloss_recon/dz_c and the sparsity, self-expression and discriminator losses
+               to Coef and z_full
+            5. run the encoder again on each chunk (gradient checkpointing) and backprop dloss/dz
+               into the encoder weights
+            6. apply the accumulated gradients with Adam
+        mem_budget: peak memory in MB, sets the chunk size
+        """
+        args = self.args
+        N, D = self.batch_size, self.latent_size
+        self.x_chunk    = tf.placeholder(tf.float32, [None, self.n_input[0], self.n_input[1], 1])
+        self.chunk_rows = tf.placeholder(tf.int32, [None])      # rows of the full batch held by x_chunk
+        enc_weights = [v for v in ae_weights if v.name.startswith('enc')]
+        dec_weights = [v for v in ae_weights if v.name.startswith('dec')]
+        train_weights = Coef_weights + enc_weights + dec_weights
+        nC, nE = len(Coef_weights), len(enc_weights)
+        with tf.variable_scope('chunked'):
+            z_full   = tf.Variable(tf.zeros([N, D]), trainable=False, name='z')
+            zc_full  = tf.Variable(tf.zeros([N, D]), trainable=False, name='z_c')
+            grad_z   = tf.Variable(tf.zeros([N, D]), trainable=False, name='grad_z')
+            grad_zc  = tf.Variable(tf.zeros([N, D]), trainable=False, name='grad_z_c')
+            grad_acc = [tf.Variable(tf.zeros(v.shape), trainable=False, name='grad_' + v.op.name) for v in train_weights]
+
+        # 1. encoder, one chunk
+        with tf.variable_scope('', reuse=True):
+            latent_chunk, _ = self.encoder(self.x_chunk)
+        z_chunk = tf.reshape(latent_chunk, [-1, D])
+        self.chunk_encode = tf.scatter_update(z_full, self.chunk_rows, z_chunk)
+
+        # 2. self-expressive layer, full batch
+        z   = tf.identity(z_full)
+        z_c = tf.matmul(self.Coef, z, name='matmul_Cz_chunked')
+        self.chunk_couple = tf.group(zc_full.assign(z_c), grad_zc.assign(tf.zeros([N, D])),
+                *[g.assign(tf.zeros(g.shape)) for g in grad_acc])
+
+        # 3. decoder, one chunk
+        zc_chunk = tf.gather(zc_full, self.chunk_rows)
+        latent_c_chunk = tf.reshape(zc_chunk, [-1] + [int(d) for d in self.latent_shape[1:]])
+        x_r_chunk = self.decoder(latent_c_chunk, shapes, reuse=True)
+        self.chunk_recon = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(x_r_chunk, self.x_chunk), 2.0))
+        grads = tf.gradients(self.chunk_recon, [zc_chunk] + dec_weights)
+        self.chunk_decode = tf.group(tf.scatter_update(grad_zc, self.chunk_rows, grads[0]),
+                *[g.assign_add(gv) for g, gv in zip(grad_acc[nC+nE:], grads[1:])])
+
+        # 4. gradients of everything that sees the whole batch; sum(grad_zc * z_c) carries loss_recon through z_c
+        loss_couple = lambda1 * tf.reduce_sum(tf.pow(self.Coef, 2.0)) \
+                + lambda2 * 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0)) + tf.reduce_sum(grad_zc * z_c)
+        z_real, z_fake = self.make_z_fake(z, self.y_x, self.n_class, self.n_sample_perclass, use_closedform=args.s_closed, use_nodiag=args.s_nodiag)
+        z_real.set_shape([N, D])
+        z_real_stationary = tf.Variable(tf.zeros([N, D]), trainable=False)
+        z_real_stationary = tf.cond(tf.equal(self.gen_step % args.stationary, 0),
+                lambda: z_real_stationary.assign(z_real), lambda: z_real_stationary)
+        score_disc = self.score_discriminator(z_real_stationary, z_fake, args.stop_real, reuse=True)
+        def backprop_couple(loss):
+            grads = tf.gradients(loss, Coef_weights + [z])
+            return tf.group(grad_z.assign(grads[-1]), *[g.assign(gv) for g, gv in zip(grad_acc[:nC], grads[:-1])])
+        self.chunk_backprop_eqn3     = backprop_couple(loss_couple)
+        self.chunk_backprop_eqn3plus = backprop_couple(loss_couple + lambda3 * score_disc)
+
+        # 5. encoder again, one chunk
+        grads = tf.gradients(z_chunk, enc_weights, grad_ys=tf.gather(grad_z, self.chunk_rows))
+        self.chunk_encode_backprop = tf.group(*[g.assign_add(gv) for g, gv in zip(grad_acc[nC:nC+nE], grads)])
+
+        # 6. loss_eqn3 adds the scalar losses to the list of regularization losses, which broadcasts them to
+        # one copy per regularized weight (loss_eqn3plus adds the list twice); scale the same way so the
+        # chunked steps take the same step as the full-batch ones
+        n_copies = len(self.loss_aereg)
+        grads_reg = tf.gradients(tf.add_n(self.loss_aereg), train_weights)
+        def apply_grads(reg_copies):
+            grads = [n_copies * g + (reg_copies * gr if gr is not None else 0) for g, gr in zip(grad_acc, grads_reg)]
+            return tf.train.AdamOptimizer(learning_rate=self.learning_rate).apply_gradients(zip(grads, train_weights))
+        with tf.variable_scope('optimizer_eqn3_chunked'):
+            self.chunk_apply_eqn3 = apply_grads(1)
+        with tf.variable_scope('optimizer_eqn3plus_chunked'):
+            self.chunk_apply_eqn3plus = apply_grads(2)
+        disc_weights = [v for v in tf.trainable_variables() if v.name.startswith('disc')]
+        with tf.variable_scope('optimizer_disc_chunked'):
+            self.chunk_apply_disc = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(-score_disc, var_list=disc_weights)
+
+        # size the chunks: all variables and a few N x N / N x D temporaries are fixed, activations scale
+        # with the chunk (every layer's input, pre-activation and both their gradients, in float32)
+        n_var = sum([int(np.prod(v.shape.as_list())) for v in tf.global_variables()])
+        fixed = 4 * (n_var + 2 * N * N + 4 * N * D)
+        per_sample = 4 * 4 * (sum([int(np.prod(s[1:])) for s in shapes]) + D)
+        budget = mem_budget * 2 ** 20
+        self.chunk_size = int(min(max((budget - fixed) // per_sample, 1), N))
+        print 'chunked fine-tuning: {} samples per chunk, about {:.0f}MB fixed + {:.0f}MB per chunk'.format(
+                self.chunk_size, fixed / 2.0 ** 20, self.chunk_size * per_sample / 2.0 ** 20)
+        if fixed + per_sample > budget:
+            print 'Warning: --mem-budget {} is below the fixed cost, using chunks of one sample'.format(mem_budget)
+
+    def chunks(self):
+        return [(i, min(i + self.chunk_size, self.batch_size)) for i in xrange(0, self.batch_size, self.chunk_size)]
+
+    def encode_chunked(self, X):
+        for begin, end in self.chunks():
+            self.sess.run(self.chunk_encode, feed_dict={self.x_chunk: X[begin:end], self.chunk_rows: np.arange(begin, end)})
+
+    def partial_fit_chunked(self, X, lr, y_x=None):
+        # one step on Eqn 3 (y_x=None) or Eqn 3 + generator loss, see build_chunked
+        self.encode_chunked(X)
+        self.sess.run(self.chunk_couple)
+        cost = 0.0
+        for begin, end in self.chunks():
+            cost_chunk, _ = self.sess.run([self.chunk_recon, self.chunk_decode],
+                    feed_dict={self.x_chunk: X[begin:end], self.chunk_rows: np.arange(begin, end)})
+            cost += cost_chunk
+        if y_x is None:
+            self.sess.run(self.chunk_backprop_eqn3)
+        else:
+            self.sess.run(self.chunk_backprop_eqn3plus, feed_dict={self.y_x: y_x})
+        for begin, end in self.chunks():
+            self.sess.run(self.chunk_encode_backprop, feed_dict={self.x_chunk: X[begin:end], self.chunk_rows: np.arange(begin, end)})
+        if y_x is None:
+            Coef, _ = self.sess.run([self.Coef, self.chunk_apply_eqn3], feed_dict={self.learning_rate: lr})
+        else:
+            Coef, _, _ = self.sess.run([self.Coef, self.chunk_apply_eqn3plus, self.gen_step_op], feed_dict={self.learning_rate: lr})
+        summary = tf.Summary(value=[tf.Summary.Value(tag='loss_recon', simple_value=cost)])
+        self.summary_writer.add_summary(summary, self.iter)
+        self.iter += 1
+        return cost, Coef
+
     def partial_fit_eqn3(self, X, lr):
         # take a step on Eqn 3/4
-        cost, Coef, summary, _ = self.sess.run((self.loss_recon, self.Coef, self.summaryop_eqn3, self.optimizer_eqn3),
+        if self.chunk_size:
+            return self.partial_fit_chunked(X, lr)
+        cost, Coef, summary, _ = self.sess.run((self.loss_recon, self.Coef_step, self.summaryop_eqn3, self.optimizer_eqn3),
                 feed_dict = {self.x: X, self.learning_rate: lr})
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
@@ -327,11 +489,17 @@ class ConvAE(object):
 
     def partial_fit_disc(self, X, y_x, lr):
         #assert y_x.min() == 0, 'y_x is 0-based, but received min={}'.format(y_x.min())
+        if self.chunk_size:
+            self.encode_chunked(X)
+            self.sess.run([self.chunk_apply_disc, self.clip_weight], feed_dict={self.y_x:y_x, self.learning_rate:lr})
+            return
         self.sess.run([self.optimizer_disc, self.clip_weight], feed_dict={self.x:X, self.y_x:y_x, self.learning_rate:lr})
 
     def partial_fit_eqn3plus(self, X, y_x, lr):
         #assert y_x.min() == 0, 'y_x is 0-based'
-        cost, Coef, summary, _, _ = self.sess.run([self.loss_recon, self.Coef, self.summaryop_eqn3plus, self.optimizer_eqn3plus, self.gen_step_op], 
+        if self.chunk_size:
+            return self.partial_fit_chunked(X, lr, y_x)
+        cost, Coef, summary, _, _ = self.sess.run([self.loss_recon, self.Coef_step, self.summaryop_eqn3plus, self.optimizer_eqn3plus, self.gen_step_op], 
                 feed_dict={self.x:X, self.y_x:y_x, self.learning_rate:lr})
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
@@ -365,6 +533,10 @@ class ConvAE(object):
     def transform(self, X):
         return self.sess.run(self.z, feed_dict = {self.x:X})
 
+    def get_coef(self, X):
+        # with --coef-closed Coef is solved from the latent codes of X on demand
+        return self.sess.run(self.Coef, feed_dict = {self.x:X})
+
     def save_model(self):
         save_path = self.saver.save(self.sess,self.model_path)
         print ("model saved in file: %s" % save_path)
@@ -426,40 +598,11 @@ def thrC(C,ro):
     return Cp
 
 
-def build_aff(C):
-    N = C.shape[0]
-    Cabs = np.abs(C)
-    ind = np.argsort(-Cabs,0)
-    for i in range(N):
-        Cabs[:,i]= Cabs[:,i] / (Cabs[ind[0,i],i] + 1e-6)
-    Cksym = Cabs + Cabs.T;
-    return Cksym
-
-
-def spectral_cluster(L, n, eps=2.2*10-8):
-    """
-    L: Laplacian
-    n: number of clusters
-    Translates MATLAB code below:
-    N  = size(L, 1)
-    DN = diag( 1./sqrt(sum(L)+eps) );
-    LapN = speye(N) - DN * L * DN;
-    [~,~,vN] = svd(LapN);
-    kerN = vN(:,N-n+1:N);
-    normN = sum(kerN .^2, 2) .^.5;
-    kerNS = bsxfun(@rdivide, kerN, normN + eps);
-    groups = kmeans(kerNS,n,'maxiter',MAXiter,'replicates',REPlic,'EmptyAction','singleton');
-    """
-    N  = L.shape[0]
-    DN = (1. / np.sqrt(L.sum(0)+eps))
-    LapN = np.eye(N) - DN * L * DN
-
-
 def post_proC(C, K, d, alpha):
     # C: coefficient matrix, K: number of clusters, d: dimension of each subspace
     C = 0.5*(C + C.T)
     r = d*K + 1 # K=38, d=10
-    U, S, _ = svds(C,r,v0 = np.ones(C.shape[0]))
+    U, S, _ = svd_backend.svds(C,r)
     #U, S, _ = svd_cuda(C, allocator=mem_pool)
     # take U and S from GPU
     # U = U[:, :r].get()
@@ -469,14 +612,13 @@ def post_proC(C, K, d, alpha):
     S = np.diag(S)
     U = U.dot(S)
     U = normalize(U, norm='l2', axis = 1)
-    Z = U.dot(U.T)
-    Z = Z * (Z>0)
-    L = np.abs(Z ** alpha)
-    L = L/L.max()
-    L = 0.5 * (L + L.T)
-    spectral = cluster.SpectralClustering(n_clusters=K, eigen_solver='arpack', affinity='precomputed',assign_labels='discretize')
-    spectral.fit(L)
-    grp = spectral.fit_predict(L) # +1
+    kernel = affinity.kernel(alpha, positive=True)
+    if spectral.settings['landmarks']:
+        # the same affinity, between the samples and the landmarks only
+        grp = spectral.landmark_cluster(U, K, kernel)
+        return grp, None
+    L = affinity.post_affinity(U, kernel)
+    grp = spectral.cluster(L, K) # +1
     return grp, L
 
 
@@ -487,14 +629,6 @@ def err_rate(gt_s, s):
     return missrate
 
 
-def build_laplacian(C):
-    C = 0.5 * (np.abs(C) + np.abs(C.T))
-    W = np.sum(C,axis=0)
-    W = np.diag(1.0/W)
-    L = W.dot(C)
-    return L
-
-
 def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
     alpha = max(0.4 - (n_class-1)/10 * 0.1, 0.1)
     print alpha
@@ -523,14 +657,15 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
             AE l2 norm   : 29
             Ae recon loss: 13372
         """
+        minibatch_size = 128
+        batches = pipeline.BatchPrefetcher(Img, minibatch_size)  # shuffled mini-batches, prepared in the background
         for epoch in xrange(1, args.pretrain+1):
-            minibatch_size = 128
-            indices = np.random.permutation(Img.shape[0])[:minibatch_size]
-            minibatch = Img[indices] # pretrain with random mini-batch
+            minibatch, _, _ = next(batches)
             cost = CAE.partial_fit_pretrain(minibatch, args.lr)
             if epoch % 100 == 0:
                 norm = CAE.get_ae_weight_norm()
                 print 'pretraining epoch {}, cost: {}, norm: {}'.format(epoch, cost/float(minibatch_size), norm)
+        batches.close()
         if args.save:
             CAE.save_model()
     ###
@@ -558,9 +693,12 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
         # every interval epochs, perform clustering and evaluate accuracy
         if epoch % interval == 0:
             print "epoch: %.1d" % epoch, "cost: %.8f" % (cost/float(batch_size))
+            if Coef is None:
+                Coef = CAE.get_coef(Img) # --coef-closed, the steps don't build Coef
             Coef = thrC(Coef,alpha)
             t_begin = time.time()
-            y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
+            with CAE.cpu.evaluation():
+                y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
             if len(set(list(np.squeeze(y_x_new)))) == n_class:
                 y_x = y_x_new
             else:
@@ -676,6 +814,11 @@ def prepare_data_coil100(folder):
     return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
 
 
+def prepare_data_synthetic(folder):
+    # K random subspaces, see synthetic.py
+    return synthetic.prepare_data(folder, args)
+
+
 def normalize_data(data):
     data = data - data.mean(axis=0)
     data = data / data.std(axis=0)
@@ -684,6 +827,8 @@ def normalize_data(data):
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    svd_backend.configure(args)
+    spectral.configure(args)
     assert args.name is not None and args.name != '', 'name of experiment must be specified'
 
     # prepare data
@@ -692,7 +837,8 @@ if __name__ == '__main__':
             'yaleb':prepare_data_YaleB, 
             'orl':prepare_data_orl,
             'coil20':prepare_data_coil20,
-            'coil100':prepare_data_coil100}
+            'coil100':prepare_data_coil100,
+            'synthetic':prepare_data_synthetic}
     assert args.dataset in preparation_funcs
     Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path = preparation_funcs[args.dataset](folder)
     logs_path    = os.path.join(folder, 'logs', args.name)
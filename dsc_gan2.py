@@ -2,16 +2,20 @@ import tensorflow as tf
 import numpy as np
 from tensorflow.contrib import layers
 import scipy.io as sio
-from scipy.sparse.linalg import svds
 #from skcuda.linalg import svd as svd_cuda
 #import pycuda.gpuarray as gpuarray
 #from pycuda.tools import DeviceMemoryPool
-from sklearn import cluster
 from sklearn.preprocessing import normalize
 from munkres import Munkres
 import os
 import time
 import argparse
+import pipeline
+import synthetic
+import cpu
+import svd_backend
+import spectral
+import affinity
 
 
 parser = argparse.ArgumentParser()
@@ -27,7 +31,7 @@ parser.add_argument('--lr2',        type=float, default=2e-4)   # learning rate
 parser.add_argument('--pretrain',   type=int,   default=0)      # number of iterations of pretraining
 parser.add_argument('--epochs',     type=int,   default=None)   # number of epochs to train on eqn3 and eqn3plus 
 parser.add_argument('--enable-at',  type=int,   default=1000)   # epoch at which to enable eqn3plus
-parser.add_argument('--dataset',    type=str,   default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100'])
+parser.add_argument('--dataset',    type=str,   default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100', 'synthetic'])
 parser.add_argument('--interval',   type=int,   default=50)
 parser.add_argument('--interval2',  type=int,   default=1)
 parser.add_argument('--bound',      type=float, default=0.02)   # discriminator weight clipping limit
@@ -57,7 +61,11 @@ parser.add_argument('--s-sparse-min', type=int, default=5)      # minimum number
 parser.add_argument('--submean',    action='store_true')
 parser.add_argument('--proj-cluster', action='store_true')
 
-parser.add_argument('--noisestd',   type=float, default=0.2)
+parser.add_argument('--noisestd',   type=float, default=0.2)    # std of the noise added to the eqn3 reconstruction target
+synthetic.add_arguments(parser)      # --synth-* options of --dataset synthetic
+cpu.add_arguments(parser)            # --*-threads and --*-cores of the CPU execution profile
+svd_backend.add_arguments(parser)    # --svd backend of post_proC, see svd_backend.py
+spectral.add_arguments(parser)       # --spectral clustering of post_proC, see spectral.py
 
 
 """
@@ -98,7 +106,8 @@ class ConvAE(object):
         #input required to be fed
         self.x = tf.placeholder(tf.float32, [None, n_input[0], n_input[1], 1])
         self.learning_rate = tf.placeholder(tf.float32, [])
-        self.x_target = self.x + tf.random_normal(shape=tf.shape(self.x), mean=0, stddev=args.noisestd, dtype=tf.float32)
+        # noisy reconstruction target, fed by the input pipeline when --noisestd > 0
+        self.x_target = tf.placeholder_with_default(self.x, self.x.shape)
 
         # run input through encoder, latent is the output, shape is the shape of encoder
         latent, shape = self.encoder(self.x)
@@ -210,6 +219,8 @@ class ConvAE(object):
         config = tf.ConfigProto()
         #config.gpu_options.allow_growth = True  # stop TF from eating up all GPU RAM 
         #config.gpu_options.per_process_gpu_memory_fraction = 0.4
+        self.cpu = cpu.CPUProfile(args)  # thread pools and cores of the session and of post_proC
+        self.cpu.configure(config)
         self.sess = tf.InteractiveSession(config=config)
         self.sess.run(self.init)
         self.saver = tf.train.Saver([v for v in ae_weights if v.name.startswith('enc_w') or v.name.startswith('dec_w')])
@@ -463,10 +474,13 @@ class ConvAE(object):
         _, g_fake = tf.while_loop(cond, body, loop_vars=[i, g_fake], shape_invariants=[i.get_shape(), tf.TensorShape([None, None]) ])
         return g_fake
 
-    def partial_fit_eqn3(self, X, lr):
+    def partial_fit_eqn3(self, X, lr, X_target=None):
         # take a step on Eqn 3/4
+        feed_dict = {self.x: X, self.learning_rate: lr}
+        if X_target is not None:
+            feed_dict[self.x_target] = X_target
         cost, Coef, summary, _ = self.sess.run((self.loss_recon, self.Coef, self.summaryop_eqn3, self.optimizer_eqn3),
-                feed_dict = {self.x: X, self.learning_rate: lr})
+                feed_dict = feed_dict)
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
         return cost, Coef
@@ -477,10 +491,13 @@ class ConvAE(object):
     def partial_fit_disc(self, X, y_x, lr):
         self.sess.run([self.optimizer_disc], feed_dict={self.x:X, self.y_x:y_x, self.learning_rate:lr})
 
-    def partial_fit_eqn3plus(self, X, y_x, lr):
+    def partial_fit_eqn3plus(self, X, y_x, lr, X_target=None):
         #assert y_x.min() == 0, 'y_x is 0-based'
+        feed_dict = {self.x:X, self.y_x:y_x, self.learning_rate:lr}
+        if X_target is not None:
+            feed_dict[self.x_target] = X_target
         cost, Coef, summary, _, _ = self.sess.run([self.loss_recon, self.Coef, self.summaryop_eqn3plus, self.optimizer_eqn3plus, self.gen_step_op], 
-                feed_dict={self.x:X, self.y_x:y_x, self.learning_rate:lr})
+                feed_dict=feed_dict)
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
         return cost, Coef
@@ -590,40 +607,11 @@ def thrC(C,ro):
     return Cp
 
 
-def build_aff(C):
-    N = C.shape[0]
-    Cabs = np.abs(C)
-    ind = np.argsort(-Cabs,0)
-    for i in range(N):
-        Cabs[:,i]= Cabs[:,i] / (Cabs[ind[0,i],i] + 1e-6)
-    Cksym = Cabs + Cabs.T;
-    return Cksym
-
-
-def spectral_cluster(L, n, eps=2.2*10-8):
-    """
-    L: Laplacian
-    n: number of clusters
-    Translates MATLAB code below:
-    N  = size(L, 1)
-    DN = diag( 1./sqrt(sum(L)+eps) );
-    LapN = speye(N) - DN * L * DN;
-    [~,~,vN] = svd(LapN);
-    kerN = vN(:,N-n+1:N);
-    normN = sum(kerN .^2, 2) .^.5;
-    kerNS = bsxfun(@rdivide, kerN, normN + eps);
-    groups = kmeans(kerNS,n,'maxiter',MAXiter,'replicates',REPlic,'EmptyAction','singleton');
-    """
-    N  = L.shape[0]
-    DN = (1. / np.sqrt(L.sum(0)+eps))
-    LapN = np.eye(N) - DN * L * DN
-
-
 def post_proC(C, K, d, alpha):
     # C: coefficient matrix, K: number of clusters, d: dimension of each subspace
     C = 0.5*(C + C.T)
     r = d*K + 1 # K=38, d=10
-    U, S, _ = svds(C,r,v0 = np.ones(C.shape[0]))
+    U, S, _ = svd_backend.svds(C,r)
     #U, S, _ = svd_cuda(C, allocator=mem_pool)
     # take U and S from GPU
     # U = U[:, :r].get()
@@ -633,14 +621,13 @@ def post_proC(C, K, d, alpha):
     S = np.diag(S)
     U = U.dot(S)
     U = normalize(U, norm='l2', axis = 1)
-    Z = U.dot(U.T)
-    Z = Z * (Z>0)
-    L = np.abs(Z ** alpha)
-    L = L/L.max()
-    L = 0.5 * (L + L.T)
-    spectral = cluster.SpectralClustering(n_clusters=K, eigen_solver='arpack', affinity='precomputed',assign_labels='discretize')
-    spectral.fit(L)
-    grp = spectral.fit_predict(L) # +1
+    kernel = affinity.kernel(alpha, positive=True)
+    if spectral.settings['landmarks']:
+        # the same affinity, between the samples and the landmarks only
+        grp = spectral.landmark_cluster(U, K, kernel)
+        return grp, None
+    L = affinity.post_affinity(U, kernel)
+    grp = spectral.cluster(L, K) # +1
     return grp, L
 
 
@@ -651,14 +638,6 @@ def err_rate(gt_s, s):
     return missrate
 
 
-def build_laplacian(C):
-    C = 0.5 * (np.abs(C) + np.abs(C.T))
-    W = np.sum(C,axis=0)
-    W = np.diag(1.0/W)
-    L = W.dot(C)
-    return L
-
-
 def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
     alpha = max(0.4 - (n_class-1)/10 * 0.1, 0.1)
     print alpha
@@ -688,14 +667,15 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
             AE l2 norm   : 29
             Ae recon loss: 13372
         """
+        minibatch_size = 128
+        batches = pipeline.BatchPrefetcher(Img, minibatch_size) # shuffled mini-batches, prepared in the background
         for epoch in xrange(1, args.pretrain+1):
-            minibatch_size = 128
-            indices = np.random.permutation(Img.shape[0])[:minibatch_size]
-            minibatch = Img[indices] # pretrain with random mini-batch
+            minibatch, _, _ = next(batches)
             cost = CAE.partial_fit_pretrain(minibatch, args.lr)
             if epoch % 100 == 0:
                 norm = CAE.get_ae_weight_norm()
                 print 'pretraining epoch {}, cost: {}, norm: {}'.format(epoch, cost/float(minibatch_size), norm)
+        batches.close()
         if args.save:
             CAE.save_model()
     ###
@@ -704,10 +684,13 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
     print 'Finetune for {} steps'.format(num_epochs)
     acc_x = 0.0
     y_x_mode = 'svd'
+    # full batch with a fresh noisy target per step, drawn in the background
+    targets = pipeline.BatchPrefetcher(Img, Img.shape[0], noise_std=args.noisestd, shuffle=False) if args.noisestd > 0 else None
     for epoch in xrange(1, num_epochs+1):
+        Img_target = next(targets)[1] if targets is not None else None
         # eqn3
         if epoch < args.enable_at:
-            cost, Coef = CAE.partial_fit_eqn3(Img, args.lr)
+            cost, Coef = CAE.partial_fit_eqn3(Img, args.lr, Img_target)
             interval = args.interval # normal interval
         # overtrain discriminator
         elif epoch == args.enable_at:
@@ -722,7 +705,9 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
             for i in xrange(args.D_steps):
                 CAE.partial_fit_disc(Img, y_x, args.lr2)  # discriminator step discriminator
             for i in xrange(args.G_steps):
-                cost, Coef = CAE.partial_fit_eqn3plus(Img, y_x, args.lr2)
+                if i > 0 and targets is not None:
+                    Img_target = next(targets)[1]
+                cost, Coef = CAE.partial_fit_eqn3plus(Img, y_x, args.lr2, Img_target)
             interval = args.interval2 # GAN interval
         # every interval epochs, perform clustering and evaluate accuracy
         if epoch % interval == 0:
@@ -730,7 +715,8 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
             Coef = thrC(Coef,alpha)
             t_begin = time.time()
             if y_x_mode == 'svd':
-                y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
+                with CAE.cpu.evaluation():
+                    y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
             else:
                 y_x_new = CAE.get_projection_y_x(Img)
             if len(set(list(np.squeeze(y_x_new)))) == n_class:
@@ -747,6 +733,8 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
             print 'post processing time: {}'.format(t_end - t_begin)
             CAE.log_accuracy(acc_x)
             clustered = True
+    if targets is not None:
+        targets.close()
 
     mean   = acc_x
     median = acc_x
@@ -849,6 +837,11 @@ def prepare_data_coil100(folder):
     return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
 
 
+def prepare_data_synthetic(folder):
+    # K random subspaces, see synthetic.py
+    return synthetic.prepare_data(folder, args)
+
+
 def normalize_data(data):
     data = data - data.mean(axis=0)
     data = data / data.std(axis=0)
@@ -857,6 +850,8 @@ def normalize_data(data):
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    svd_backend.configure(args)
+    spectral.configure(args)
     assert args.name is not None and args.name != '', 'name of experiment must be specified'
 
     # prepare data
@@ -865,7 +860,8 @@ if __name__ == '__main__':
             'yaleb':prepare_data_YaleB, 
             'orl':prepare_data_orl,
             'coil20':prepare_data_coil20,
-            'coil100':prepare_data_coil100}
+            'coil100':prepare_data_coil100,
+            'synthetic':prepare_data_synthetic}
     assert args.dataset in preparation_funcs
     Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path = preparation_funcs[args.dataset](folder)
     logs_path    = os.path.join(folder, 'logs', args.name)
@@ -2,16 +2,28 @@ import tensorflow as tf
 import numpy as np
 from tensorflow.contrib import layers
 import scipy.io as sio
-from scipy.sparse.linalg import svds
+from scipy import sparse
 # from skcuda.linalg import svd as svd_cuda
 # import pycuda.gpuarray as gpuarray
 # from pycuda.tools import DeviceMemoryPool
-from sklearn import cluster
 from sklearn.preprocessing import normalize
 from munkres import Munkres
 import os
 import time
 import argparse
+import synthetic
+import pipeline
+import cpu
+import early_stop
+import eval_cache
+import eval_schedule
+import profiling
+import graph_cache
+import xla
+import selfexpress
+import svd_backend
+import spectral
+import affinity
 
 parser = argparse.ArgumentParser()
 parser.add_argument('name')  # name of experiment, used for creating log directory
@@ -26,7 +38,7 @@ parser.add_argument('--lr2', type=float, default=2e-4)  # learning rate for disc
 parser.add_argument('--pretrain', type=int, default=0)  # number of iterations of pretraining
 parser.add_argument('--epochs', type=int, default=1000)  # number of epochs to train on eqn3 and eqn3plus
 parser.add_argument('--enable-at', type=int, default=300)  # epoch at which to enable eqn3plus
-parser.add_argument('--dataset', type=str, default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100'])
+parser.add_argument('--dataset', type=str, default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100', 'synthetic'])
 parser.add_argument('--interval', type=int, default=50)
 parser.add_argument('--interval2', type=int, default=1)
 parser.add_argument('--bound', type=float, default=0.02)  # discriminator weight clipping limit
@@ -59,6 +71,23 @@ parser.add_argument('--kernel-size',    type=int,       nargs='+',  default=None
 
 parser.add_argument('--m',              type=float,     default=None)
 
+parser.add_argument('--profile',        action='store_true')            # time phases and steps, write logs/<name>/trace-<K>.json
+parser.add_argument('--trace-every',    type=int,       default=0)      # with --profile, full TF trace every so calls of each step
+parser.add_argument('--graph-cache',    default=None)                   # folder of built graphs, reused by runs with the same configuration
+parser.add_argument('--xla',            action='store_true')            # compile the self-expressive and loss subgraphs with XLA
+parser.add_argument('--coef-closed',    action='store_true')            # solve Coef in closed form every step, Adam only trains the autoencoder
+parser.add_argument('--block-coef',     action='store_true')            # GAN phase: Coef only within the clusters of y_x, see ConvAE.build_block_coef
+parser.add_argument('--block-margin',   type=int,       default=0)      # with --block-coef, cross-cluster entries kept per row
+parser.add_argument('--block-slack',    type=float,     default=1.5)    # with --block-coef, largest block size relative to N/K, larger clusters are split
+parser.add_argument('--knn',            type=int,       default=0)      # express each sample over its k nearest pretrained neighbours only, 0 for a dense Coef
+synthetic.add_arguments(parser)      # --synth-* options of --dataset synthetic
+cpu.add_arguments(parser)            # --*-threads and --*-cores of the CPU execution profile
+early_stop.add_arguments(parser)     # --early-stop and its --es-* criteria
+eval_cache.add_arguments(parser)     # --eval-cache of the post_proC labels, see eval_cache.py
+eval_schedule.add_arguments(parser)  # --adaptive-eval interval and its --eval-* options, see eval_schedule.py
+svd_backend.add_arguments(parser)    # --svd backend of post_proC, see svd_backend.py
+spectral.add_arguments(parser)       # --spectral clustering of post_proC, see spectral.py
+
 """
 Example launch commands:
 CUDA_VISIBLE_DEVICES=0 python dsc_gan.py yaleb_run1 --pretrain 60000 --epochs 4000 --enable-at 3000 --dataset yaleb
@@ -75,7 +104,7 @@ class ConvAE(object):
                  lambda1, lambda2, lambda3, batch_size, r=0, rank=10,
                  reg=None, disc_bound=0.02,
                  model_path=None, restore_path=None,
-                 logs_path='logs'):
+                 logs_path='logs', profiler=None):
         self.args = args
         self.n_class = n_class
         self.n_input = n_input
@@ -89,7 +118,45 @@ class ConvAE(object):
         self.restore_path = restore_path
         self.rank = rank
         self.iter = 0
+        self.profiler = profiler or profiling.NullProfiler()
+        if args.block_coef:
+            assert not args.coef_closed, '--block-coef needs the Coef of the self-expression phase, not --coef-closed'
+            self.block_margin = args.block_margin
+            self.block_size_max = min(batch_size, int(np.ceil(args.block_slack * n_sample_perclass)))
+        self.block_layout = None  # (slots, used entries, margin columns) of the --block-coef Coef, set by set_blocks
+        self.knn_cols_value = None  # the --knn neighbours, set by set_neighbours
+
+        # build the graph, or import it from --graph-cache if it was built before with the same configuration
+        self.t_start = time.time()
+        cache = None
+        if args.graph_cache:
+            key = graph_cache.config_key(__file__, args, n_input, n_hidden, kernel_size, n_class, n_sample_perclass,
+                                         disc_size, lambda1, lambda2, lambda3, batch_size, r, rank, disc_bound)
+            cache = graph_cache.GraphCache(args.graph_cache, key)
+        if cache is not None and cache.exists():
+            cache.load(self)
+            self.graph_source = 'loaded from ' + cache.path
+        else:
+            before = set(vars(self))
+            self.build_graph(args, n_input, lambda1, lambda2, lambda3, batch_size, r)
+            if cache is not None:
+                cache.save(self, exclude=before)
+            self.graph_source = 'built'
+        print('graph {} in {:.1f}s'.format(self.graph_source, time.time() - self.t_start))
 
+        # finalize stuffs
+        ae_weights = [v for v in tf.trainable_variables() if (v.name.startswith('enc') or v.name.startswith('dec'))]
+        config = tf.ConfigProto()
+        # config.gpu_options.allow_growth = True  # stop TF from eating up all GPU RAM
+        # config.gpu_options.per_process_gpu_memory_fraction = 0.4
+        self.cpu = cpu.CPUProfile(args)  # thread pools and cores of the session and of post_proC
+        self.cpu.configure(config)
+        self.sess = tf.InteractiveSession(config=config)
+        self.sess.run(self.init)
+        self.saver = tf.train.Saver([v for v in ae_weights if v.name.startswith('enc_w') or v.name.startswith('dec_w')])
+        self.summary_writer = tf.summary.FileWriter(logs_path, graph=tf.get_default_graph(), flush_secs=20)
+
+    def build_graph(self, args, n_input, lambda1, lambda2, lambda3, batch_size, r):
         """
         Eqn3
         """
@@ -109,15 +176,32 @@ class ConvAE(object):
         if args.usebn:
             z = tf.contrib.layers.batch_norm(z)
 
-        if r == 0:
-            Coef = tf.Variable(1.0e-4 * tf.ones([self.batch_size, self.batch_size], tf.float32), name='Coef')
+        if args.coef_closed:
+            assert r == 0, '--coef-closed solves the full NxN Coef, it does not take --r'
+            # exact Coef for the current z, see selfexpress.py; the N x N matrix is only built when fetched
+            Coef, z_c, loss_sparsity = selfexpress.closed_form_coef(z, lambda1, lambda2)
+        elif args.knn:
+            assert r == 0 and not args.block_coef, '--knn replaces the NxN Coef, it does not take --r or --block-coef'
+            # Coef holds the values of the N x k neighbour layout, set_neighbours fills knn_cols
+            self.knn_cols = tf.Variable(tf.zeros([batch_size, args.knn], tf.int32), trainable=False, name='knn_cols')
+            self.knn_cols_init = tf.placeholder(tf.int32, [batch_size, args.knn])
+            self.knn_assign = self.knn_cols.assign(self.knn_cols_init)
+            Coef = tf.Variable(1.0e-4 * tf.ones([batch_size, args.knn], tf.float32), name='Coef')
+            with xla.jit_scope(args.xla):
+                z_c, loss_sparsity = selfexpress.knn_self_expression(z, self.knn_cols, Coef)
         else:
-            v = (1e-2) / r
-            L = tf.Variable(v * tf.ones([self.batch_size, r]), name='Coef_L')
-            R = tf.Variable(v * tf.ones([r, self.batch_size]), name='Coef_R')
-            Coef = tf.matmul(L, R, name='Coef_full')
-        z_c = tf.matmul(Coef, z, name='matmul_Cz')
+            if r == 0:
+                Coef = tf.Variable(1.0e-4 * tf.ones([self.batch_size, self.batch_size], tf.float32), name='Coef')
+            else:
+                v = (1e-2) / r
+                L = tf.Variable(v * tf.ones([self.batch_size, r]), name='Coef_L')
+                R = tf.Variable(v * tf.ones([r, self.batch_size]), name='Coef_R')
+                Coef = tf.matmul(L, R, name='Coef_full')
+            with xla.jit_scope(args.xla):
+                z_c = tf.matmul(Coef, z, name='matmul_Cz')
+                loss_sparsity = tf.reduce_sum(tf.pow(Coef, 2.0))
         self.Coef = Coef
+        self.Coef_step = tf.no_op() if args.coef_closed else Coef  # what the training steps return as Coef, None with --coef-closed
         Coef_weights = [v for v in tf.trainable_variables() if v.name.startswith('Coef')]
         latent_c = tf.reshape(z_c, tf.shape(latent))  # petential problem here
         self.z = z
@@ -132,10 +216,11 @@ class ConvAE(object):
         self.loss_aereg = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)  # weight decay
 
         # Eqn 3 loss
-        self.loss_recon = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(self.x_r, self.x), 2.0))
-        self.loss_sparsity = tf.reduce_sum(tf.pow(self.Coef, 2.0))
-        self.loss_selfexpress = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0))
-        self.loss_eqn3 = self.loss_recon + lambda1 * self.loss_sparsity + lambda2 * self.loss_selfexpress + self.loss_aereg
+        with xla.jit_scope(args.xla):
+            self.loss_recon = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(self.x_r, self.x), 2.0))
+            self.loss_sparsity = loss_sparsity
+            self.loss_selfexpress = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0))
+            self.loss_eqn3 = self.loss_recon + lambda1 * self.loss_sparsity + lambda2 * self.loss_selfexpress + self.loss_aereg
         with tf.variable_scope('optimizer_eqn3'):
             self.optimizer_eqn3 = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss_eqn3,
                                                                                                     var_list=eqn3_weights)
@@ -165,6 +250,7 @@ class ConvAE(object):
         self.u_ini = [tf.assign(u, u_prime) for u, u_prime in zip(self.Us, u_primes)]
 
         z_real = self.z
+        # the discriminator loss stays uncompiled, see xla.py
         self.score_disc, self.Us_update_op = self.compute_disc_loss(z_real, self.y_x)
 
         print 'adding disc regularization'
@@ -179,10 +265,13 @@ class ConvAE(object):
 
         print 'building eqn3plus optimizers'
         # Eqn 3 + generator loss
-        self.loss_eqn3plus = self.loss_eqn3 + lambda3 * self.score_disc
+        with xla.jit_scope(args.xla):
+            self.loss_eqn3plus = self.loss_eqn3 + lambda3 * self.score_disc
         with tf.variable_scope('optimizer_eqn3plus'):
             self.optimizer_eqn3plus = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(
                 self.loss_eqn3plus, var_list=eqn3_weights)
+        if args.block_coef:
+            self.build_block_coef(latent, shape, z, lambda1, lambda2, lambda3, ae_weights)
 
         # finalize stuffs
         s0 = tf.summary.scalar("loss_recon_pre", self.loss_recon_pre / batch_size)  # 13372
@@ -197,13 +286,127 @@ class ConvAE(object):
         self.summaryop_eqn3plus = tf.summary.merge([s1, s2, s3, s4, s5, s6, s7])
         self.summaryop_pretrain = tf.summary.merge([s0, s5])
         self.init = tf.global_variables_initializer()
-        config = tf.ConfigProto()
-        # config.gpu_options.allow_growth = True  # stop TF from eating up all GPU RAM
-        # config.gpu_options.per_process_gpu_memory_fraction = 0.4
-        self.sess = tf.InteractiveSession(config=config)
-        self.sess.run(self.init)
-        self.saver = tf.train.Saver([v for v in ae_weights if v.name.startswith('enc_w') or v.name.startswith('dec_w')])
-        self.summary_writer = tf.summary.FileWriter(logs_path, graph=tf.get_default_graph(), flush_secs=20)
+
+    def build_block_coef(self, latent, shape, z, lambda1, lambda2, lambda3, ae_weights):
+        """
+        --block-coef: Eqn 3 + generator loss with a Coef restricted to the clusters of y_x. The samples are
+        permuted into n_blocks blocks of B slots, one block per cluster (a cluster larger than block_size_max
+        is split over several), and Coef only has the within-block entries: z_c is a batched
+        [n_blocks, B, B] x [n_blocks, B, D] matmul instead of the N x N one, and Adam keeps moments for
+        n_blocks * B^2 values instead of N^2. The variables have no static shape: set_blocks sizes them to
+        the layout of the current labels, B the largest block, so for balanced clusters n_blocks * B^2 is
+        close to sum_k N_k^2; unused slots are masked. With block_margin > 0 every row also keeps that many
+        entries outside its cluster, applied with a gather.
+        """
+        margin, D = self.block_margin, self.latent_size
+        self.block_slots = tf.Variable(tf.zeros([1, 1], tf.int32), trainable=False, validate_shape=False, name='block_slots')
+        self.block_mask = tf.Variable(tf.zeros([1, 1, 1]), trainable=False, validate_shape=False, name='block_mask')
+        self.block_values = tf.Variable(tf.zeros([1, 1, 1]), validate_shape=False, name='block_values')
+        self.block_slots_init = tf.placeholder(tf.int32, [None, None])
+        self.block_mask_init = tf.placeholder(tf.float32, [None, None, None])
+        self.block_values_init = tf.placeholder(tf.float32, [None, None, None])
+        assigns = [tf.assign(self.block_slots, self.block_slots_init, validate_shape=False),
+                   tf.assign(self.block_mask, self.block_mask_init, validate_shape=False),
+                   tf.assign(self.block_values, self.block_values_init, validate_shape=False)]
+        block_weights = [self.block_values]
+
+        # unused slots point at an extra row of zeros, and their outputs are summed into it
+        z_pad = tf.concat([z, tf.zeros([1, D])], 0)
+        values = self.block_values * self.block_mask
+        z_c = tf.matmul(values, tf.gather(z_pad, self.block_slots), name='matmul_Cz_block')
+        z_c = tf.unsorted_segment_sum(tf.reshape(z_c, [-1, D]), tf.reshape(self.block_slots, [-1]), self.batch_size + 1)
+        z_c = z_c[:self.batch_size]
+        loss_sparsity = tf.reduce_sum(tf.pow(values, 2.0))
+        if margin:
+            self.margin_cols = tf.Variable(tf.zeros([self.batch_size, margin], tf.int32), trainable=False, name='margin_cols')
+            self.margin_values = tf.Variable(tf.zeros([self.batch_size, margin]), name='margin_values')
+            self.margin_cols_init = tf.placeholder(tf.int32, [self.batch_size, margin])
+            self.margin_values_init = tf.placeholder(tf.float32, [self.batch_size, margin])
+            assigns += [self.margin_cols.assign(self.margin_cols_init), self.margin_values.assign(self.margin_values_init)]
+            block_weights.append(self.margin_values)
+            z_c += tf.reduce_sum(tf.expand_dims(self.margin_values, 2) * tf.gather(z, self.margin_cols), 1)
+            loss_sparsity += tf.reduce_sum(tf.pow(self.margin_values, 2.0))
+        self.block_assign = tf.group(*assigns)
+
+        x_r = self.decoder(tf.reshape(z_c, tf.shape(latent)), shape, reuse=True)
+        self.loss_recon_block = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(x_r, self.x), 2.0))
+        loss_selfexpress = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0))
+        self.loss_eqn3plus_block = self.loss_recon_block + lambda1 * loss_sparsity + lambda2 * loss_selfexpress + \
+                                   self.loss_aereg + lambda3 * self.score_disc
+        with tf.variable_scope('optimizer_eqn3plus_block'):
+            optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate)
+            self.optimizer_eqn3plus_block = optimizer.minimize(self.loss_eqn3plus_block, var_list=block_weights + ae_weights)
+        # the moments of the old layout's values mean nothing for the new one, and re-initializing them
+        # also gives them the new layout's shape
+        self.block_reset = tf.variables_initializer([optimizer.get_slot(v, name) for v in block_weights
+                                                     for name in optimizer.get_slot_names()])
+        self.block_fetch = block_weights
+        self.summaryop_eqn3plus_block = tf.summary.merge([
+            tf.summary.scalar("loss_recon_block", self.loss_recon_block),
+            tf.summary.scalar("loss_sparsity_block", loss_sparsity),
+            tf.summary.scalar("loss_selfexpress_block", loss_selfexpress)])
+
+    def set_blocks(self, y):
+        """
+        --block-coef: lays the restricted Coef out for the labels y, starting from the current Coef (the
+        full one on the first call, the restricted one after)
+        """
+        if self.block_layout is None:
+            Coef = self.sess.run(self.Coef)
+        else:
+            Coef = self.block_to_dense(self.sess.run(self.block_fetch))
+        y = np.squeeze(y)
+        N, margin = self.batch_size, self.block_margin
+        labels, counts = np.unique(y, return_counts=True)
+        size = min(counts.max(), self.block_size_max)
+        n_blocks = int(np.sum(np.ceil(counts / float(size))))
+        slots = np.full([n_blocks, size], N, np.int32)
+        margin_cols = np.zeros([N, margin], np.int32)
+        b = 0
+        for label in labels:
+            members = np.where(y == label)[0]
+            for begin in range(0, len(members), size):
+                chunk = members[begin:begin + size]
+                slots[b, :len(chunk)] = chunk
+                b += 1
+            if margin:
+                # the rows' largest entries outside the cluster
+                outside = np.where(y != label)[0]
+                margin_cols[members] = outside[np.argsort(-np.abs(Coef[np.ix_(members, outside)]), 1)[:, :margin]]
+        used = slots < N
+        mask = (used[:, :, None] & used[:, None, :]).astype(np.float32)
+        Coef_pad = np.pad(Coef, [(0, 1), (0, 1)], 'constant')
+        feed_dict = {self.block_slots_init: slots, self.block_mask_init: mask,
+                     self.block_values_init: Coef_pad[slots[:, :, None], slots[:, None, :]]}
+        if margin:
+            feed_dict.update({self.margin_cols_init: margin_cols,
+                              self.margin_values_init: Coef[np.arange(N)[:, None], margin_cols]})
+        self.sess.run(self.block_assign, feed_dict=feed_dict)
+        self.sess.run(self.block_reset)
+        self.block_layout = (slots, mask > 0, margin_cols)
+        print('block Coef: {} blocks of up to {}, {} of {} entries'.format(
+            b, size, int(mask.sum()) + N * margin, N * N))
+
+    def set_neighbours(self, X):
+        # --knn: each sample's neighbours in the current (pretrained) latent space
+        self.knn_cols_value = selfexpress.nearest_neighbours(self.transform(X), self.args.knn)
+        self.sess.run(self.knn_assign, feed_dict={self.knn_cols_init: self.knn_cols_value})
+
+    def knn_to_sparse(self, values):
+        # the --knn Coef as an N x N CSR matrix, values is what the steps fetch
+        N, k = values.shape
+        return sparse.csr_matrix((values.ravel(), self.knn_cols_value.ravel(), np.arange(0, N * k + 1, k)), shape=[N, N])
+
+    def block_to_dense(self, fetched):
+        # the --block-coef Coef as an N x N matrix, fetched holds the values of block_fetch
+        slots, used, margin_cols = self.block_layout
+        Coef = np.zeros([self.batch_size] * 2, np.float32)
+        rows = np.broadcast_to(slots[:, :, None], used.shape)
+        cols = np.broadcast_to(slots[:, None, :], used.shape)
+        Coef[rows[used], cols[used]] = fetched[0][used]
+        if self.block_margin:
+            Coef[np.arange(self.batch_size)[:, None], margin_cols] = fetched[1]
+        return Coef
 
     # Building the encoder
     def encoder(self, x):
@@ -391,30 +594,46 @@ class ConvAE(object):
 
     def partial_fit_eqn3(self, X, lr):
         # take a step on Eqn 3/4
-        cost, Coef, summary, _ = self.sess.run((self.loss_recon, self.Coef, self.summaryop_eqn3, self.optimizer_eqn3),
-                                               feed_dict={self.x: X, self.learning_rate: lr})
+        cost, Coef, summary, _ = self.profiler.run(self.sess, (self.loss_recon, self.Coef_step, self.summaryop_eqn3, self.optimizer_eqn3),
+                                               feed_dict={self.x: X, self.learning_rate: lr}, name='partial_fit_eqn3')
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
+        if self.knn_cols_value is not None:
+            Coef = self.knn_to_sparse(Coef)
         return cost, Coef
 
     def assign_u_parameter(self, X, y):
-        self.sess.run(self.u_ini, feed_dict={self.x: X, self.y_x: y})
+        self.profiler.run(self.sess, self.u_ini, feed_dict={self.x: X, self.y_x: y}, name='assign_u_parameter')
 
     def partial_fit_disc(self, X, y_x, lr):
-        self.sess.run([self.optimizer_disc, self.Us_update_op], feed_dict={self.x: X, self.y_x: y_x, self.learning_rate: lr})
+        self.profiler.run(self.sess, [self.optimizer_disc, self.Us_update_op], feed_dict={self.x: X, self.y_x: y_x, self.learning_rate: lr},
+                          name='partial_fit_disc')
 
     def partial_fit_eqn3plus(self, X, y_x, lr):
         # assert y_x.min() == 0, 'y_x is 0-based'
-        cost, Coef, summary, _, _ = self.sess.run(
-            [self.loss_recon, self.Coef, self.summaryop_eqn3plus, self.optimizer_eqn3plus, self.gen_step_op],
-            feed_dict={self.x: X, self.y_x: y_x, self.learning_rate: lr})
+        if self.block_layout is not None:
+            return self.partial_fit_eqn3plus_block(X, y_x, lr)
+        cost, Coef, summary, _, _ = self.profiler.run(self.sess,
+            [self.loss_recon, self.Coef_step, self.summaryop_eqn3plus, self.optimizer_eqn3plus, self.gen_step_op],
+            feed_dict={self.x: X, self.y_x: y_x, self.learning_rate: lr}, name='partial_fit_eqn3plus')
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
+        if self.knn_cols_value is not None:
+            Coef = self.knn_to_sparse(Coef)
         return cost, Coef
 
+    def partial_fit_eqn3plus_block(self, X, y_x, lr):
+        # partial_fit_eqn3plus with the --block-coef Coef, returned dense like the full one
+        cost, fetched, summary, _, _ = self.profiler.run(self.sess,
+            [self.loss_recon_block, self.block_fetch, self.summaryop_eqn3plus_block, self.optimizer_eqn3plus_block, self.gen_step_op],
+            feed_dict={self.x: X, self.y_x: y_x, self.learning_rate: lr}, name='partial_fit_eqn3plus_block')
+        self.summary_writer.add_summary(summary, self.iter)
+        self.iter += 1
+        return cost, self.block_to_dense(fetched)
+
     def partial_fit_pretrain(self, X, lr):
-        cost, summary, _ = self.sess.run([self.loss_recon_pre, self.summaryop_pretrain, self.optimizer_pre],
-                                         feed_dict={self.x: X, self.learning_rate: lr})
+        cost, summary, _ = self.profiler.run(self.sess, [self.loss_recon_pre, self.summaryop_pretrain, self.optimizer_pre],
+                                         feed_dict={self.x: X, self.learning_rate: lr}, name='partial_fit_pretrain')
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
         return cost
@@ -429,7 +648,7 @@ class ConvAE(object):
 
     def get_projection_y_x(self, X):
         disc_weights = self.sess.run(self.disc_weights)
-        z_real = self.sess.run(self.z_real_submean, feed_dict={self.x: X})
+        z_real = self.profiler.run(self.sess, self.z_real_submean, feed_dict={self.x: X}, name='get_projection_y_x')
         residuals = []
         for Ui in disc_weights:
             proj = np.matmul(z_real, Ui)
@@ -453,6 +672,10 @@ class ConvAE(object):
     def transform(self, X):
         return self.sess.run(self.z, feed_dict={self.x: X})
 
+    def get_coef(self, X):
+        # with --coef-closed Coef is solved from the latent codes of X on demand
+        return self.profiler.run(self.sess, self.Coef, feed_dict={self.x: X}, name='get_coef')
+
     def save_model(self):
         save_path = self.saver.save(self.sess, self.model_path)
         print("model saved in file: %s" % save_path)
@@ -492,6 +715,8 @@ def best_map(L1, L2):
 
 
 def thrC(C, ro):
+    if sparse.issparse(C):
+        return affinity.thrC_sparse(C, ro)
     if ro < 1:
         N = C.shape[1]
         Cp = np.zeros((N, N))
@@ -514,40 +739,11 @@ def thrC(C, ro):
     return Cp
 
 
-def build_aff(C):
-    N = C.shape[0]
-    Cabs = np.abs(C)
-    ind = np.argsort(-Cabs, 0)
-    for i in range(N):
-        Cabs[:, i] = Cabs[:, i] / (Cabs[ind[0, i], i] + 1e-6)
-    Cksym = Cabs + Cabs.T;
-    return Cksym
-
-
-def spectral_cluster(L, n, eps=2.2 * 10 - 8):
-    """
-    L: Laplacian
-    n: number of clusters
-    Translates MATLAB code below:
-    N  = size(L, 1)
-    DN = diag( 1./sqrt(sum(L)+eps) );
-    LapN = speye(N) - DN * L * DN;
-    [~,~,vN] = svd(LapN);
-    kerN = vN(:,N-n+1:N);
-    normN = sum(kerN .^2, 2) .^.5;
-    kerNS = bsxfun(@rdivide, kerN, normN + eps);
-    groups = kmeans(kerNS,n,'maxiter',MAXiter,'replicates',REPlic,'EmptyAction','singleton');
-    """
-    N = L.shape[0]
-    DN = (1. / np.sqrt(L.sum(0) + eps))
-    LapN = np.eye(N) - DN * L * DN
-
-
 def post_proC(C, K, d, alpha):
     # C: coefficient matrix, K: number of clusters, d: dimension of each subspace
     C = 0.5 * (C + C.T)
     r = d * K + 1  # K=38, d=10
-    U, S, _ = svds(C, r, v0=np.ones(C.shape[0]))
+    U, S, _ = svd_backend.svds(C, r)
     # U, S, _ = svd_cuda(C, allocator=mem_pool)
     # take U and S from GPU
     # U = U[:, :r].get()
@@ -557,18 +753,25 @@ def post_proC(C, K, d, alpha):
     S = np.diag(S)
     U = U.dot(S)
     U = normalize(U, norm='l2', axis=1)
-    Z = U.dot(U.T)
-    #Z = Z * (Z > 0)
-    L = np.abs(np.abs(Z) ** alpha)
-    L = L / L.max()
-    L = 0.5 * (L + L.T)
-    spectral = cluster.SpectralClustering(n_clusters=K, eigen_solver='arpack', affinity='precomputed',
-                                          assign_labels='discretize')
-    spectral.fit(L)
-    grp = spectral.fit_predict(L)  # +1
+    kernel = affinity.kernel(alpha)
+    if spectral.settings['landmarks']:
+        # the same affinity, between the samples and the landmarks only
+        grp = spectral.landmark_cluster(U, K, kernel)
+        return grp, None
+    L = affinity.post_affinity(U, kernel)
+    grp = spectral.cluster(L, K)  # +1
     return grp, L
 
 
+def same_partition(y1, y2):
+    # True if the labellings group the samples the same way, whatever the label numbers
+    if y1 is None or y2 is None:
+        return y1 is y2
+    y1, y2 = np.squeeze(y1), np.squeeze(y2)
+    pairs = len(set(zip(y1, y2)))
+    return pairs == len(set(y1)) == len(set(y2))
+
+
 def err_rate(gt_s, s):
     c_x = best_map(gt_s, s)
     err_x = np.sum(gt_s[:] != c_x[:])
@@ -576,15 +779,7 @@ def err_rate(gt_s, s):
     return missrate
 
 
-def build_laplacian(C):
-    C = 0.5 * (np.abs(C) + np.abs(C.T))
-    W = np.sum(C, axis=0)
-    W = np.diag(1.0 / W)
-    L = W.dot(C)
-    return L
-
-
-def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
+def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5, stopper=None, cache=None, schedule=None):
     alpha = args.alpha #max(0.4 - (n_class - 1) / 10 * 0.1, 0.1)
     print
     alpha
@@ -596,15 +791,19 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
     else:
         num_epochs = args.epochs
 
+    profiler = CAE.profiler
+
     # init
-    CAE.initlization()
+    with profiler.phase('init'):
+        CAE.initlization()
 
     ###
     ### Stage 1: pretrain
     ###
     # if we skip pretraining, we restore already-trained model
     if args.pretrain == 0:
-        CAE.restore()
+        with profiler.phase('restore'):
+            CAE.restore()
     # otherwise we pretrain the model first
     else:
         print
@@ -614,16 +813,22 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
             AE l2 norm   : 29
             Ae recon loss: 13372
         """
-        for epoch in xrange(1, args.pretrain + 1):
+        with profiler.phase('pretrain'):
             minibatch_size = 128
-            indices = np.random.permutation(Img.shape[0])[:minibatch_size]
-            minibatch = Img[indices]  # pretrain with random mini-batch
-            cost = CAE.partial_fit_pretrain(minibatch, args.lr)
-            if epoch % 100 == 0:
-                norm = CAE.get_ae_weight_norm()
-                print 'pretraining epoch {}, cost: {}, norm: {}'.format(epoch, cost / float(minibatch_size), norm)
+            batches = pipeline.BatchPrefetcher(Img, minibatch_size)  # shuffled mini-batches, prepared in the background
+            for epoch in xrange(1, args.pretrain + 1):
+                minibatch, _, _ = next(batches)
+                cost = CAE.partial_fit_pretrain(minibatch, args.lr)
+                if epoch % 100 == 0:
+                    norm = CAE.get_ae_weight_norm()
+                    print 'pretraining epoch {}, cost: {}, norm: {}'.format(epoch, cost / float(minibatch_size), norm)
+            batches.close()
         if args.save:
             CAE.save_model()
+    if args.knn:
+        with profiler.phase('neighbours'):
+            CAE.set_neighbours(Img)
+    print('startup: {:.1f}s before the first fine-tune step (graph {})'.format(time.time() - CAE.t_start, CAE.graph_source))
     ###
     ### Stage 2: fine-tune network
     ###
@@ -631,48 +836,77 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
     'Finetune for {} steps'.format(num_epochs)
     acc_x = 0.0
     y_x_mode = 'svd'
+    enable_at = args.enable_at  # moved forward by early stopping
+    block_labels = None  # the y_x the --block-coef layout was made for
     for epoch in xrange(1, num_epochs + 1):
         # eqn3
-        if epoch < args.enable_at:
-            cost, Coef = CAE.partial_fit_eqn3(Img, args.lr)
+        if epoch < enable_at:
+            with profiler.phase('eqn3'):
+                cost, Coef = CAE.partial_fit_eqn3(Img, args.lr)
             interval = args.interval  # normal interval
         # overtrain discriminator
-        elif epoch == args.enable_at:
+        elif epoch == enable_at:
             print('Initialize discriminator for {} steps'.format(args.D_init))
-            CAE.assign_u_parameter(Img, y_x)
-            for i in xrange(args.D_init):
-                CAE.partial_fit_disc(Img, y_x, args.lr2)
+            with profiler.phase('disc_init'):
+                CAE.assign_u_parameter(Img, y_x)
+                for i in xrange(args.D_init):
+                    CAE.partial_fit_disc(Img, y_x, args.lr2)
             if args.proj_cluster:
                 y_x_mode = 'projection'
         # eqn3plus
         else:
-            for i in xrange(args.D_steps):
-                CAE.partial_fit_disc(Img, y_x, args.lr2)  # discriminator step discriminator
-            for i in xrange(args.G_steps):
-                cost, Coef = CAE.partial_fit_eqn3plus(Img, y_x, args.lr2)
+            with profiler.phase('disc'):
+                for i in xrange(args.D_steps):
+                    CAE.partial_fit_disc(Img, y_x, args.lr2)  # discriminator step discriminator
+            with profiler.phase('eqn3plus'):
+                if args.block_coef and not same_partition(block_labels, y_x):
+                    CAE.set_blocks(y_x)
+                    block_labels = y_x
+                for i in xrange(args.G_steps):
+                    cost, Coef = CAE.partial_fit_eqn3plus(Img, y_x, args.lr2)
             interval = args.interval2  # GAN interval
         # every interval epochs, perform clustering and evaluate accuracy
-        if epoch % interval == 0:
+        if schedule is not None:
+            # --adaptive-eval, always before the GAN phase starts and at the end
+            evaluate = schedule.due(epoch, interval, force=epoch in (enable_at - 1, num_epochs))
+        else:
+            evaluate = epoch % interval == 0
+        if evaluate:
             print("epoch: %.1d" % epoch, "cost: %.8f" % (cost / float(batch_size)))
-            Coef = thrC(Coef, alpha)
             t_begin = time.time()
-            if y_x_mode == 'svd':
-                y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
-            else:
-                y_x_new = CAE.get_projection_y_x(Img)
-            if len(set(list(np.squeeze(y_x_new)))) == n_class:
-                y_x = y_x_new
-            else:
-                print('================================================')
-                print('Warning: clustering produced empty clusters')
-                print('================================================')
-            missrate_x = err_rate(Label, y_x)
+            with profiler.phase('evaluation'), CAE.cpu.evaluation():
+                if Coef is None:
+                    Coef = CAE.get_coef(Img)  # --coef-closed, the steps don't build Coef
+                Coef = thrC(Coef, alpha)
+                if y_x_mode == 'svd' and cache is not None:
+                    y_x_new = cache.evaluate(Coef, lambda C: post_proC(C, n_class, k, post_alpha)[0])
+                elif y_x_mode == 'svd':
+                    y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
+                else:
+                    y_x_new = CAE.get_projection_y_x(Img)
+                if len(set(list(np.squeeze(y_x_new)))) == n_class:
+                    y_x = y_x_new
+                else:
+                    print('================================================')
+                    print('Warning: clustering produced empty clusters')
+                    print('================================================')
+                missrate_x = err_rate(Label, y_x)
             t_end = time.time()
             acc_x = 1 - missrate_x
             print("accuracy: {}".format(acc_x))
             print('post processing time: {}'.format(t_end - t_begin))
+            if schedule is not None:
+                print('next evaluation in {} epochs'.format(schedule.update(epoch, y_x, t_end - t_begin)))
             CAE.log_accuracy(acc_x)
             clustered = True
+            if stopper is not None and stopper.update(epoch, y_x, cost, Coef):
+                # converged without looking at Label: start the GAN phase now, or end the run
+                if epoch < enable_at <= num_epochs:
+                    print('early stopping: GAN phase from epoch {} on, {}'.format(epoch + 1, stopper.record(epoch, 'switch')))
+                    enable_at = epoch + 1
+                else:
+                    print('early stopping: stopped at epoch {}, {}'.format(epoch, stopper.record(epoch, 'stop')))
+                    break
 
     mean = acc_x
     median = acc_x
@@ -775,6 +1009,11 @@ def prepare_data_coil100(folder):
     return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
 
 
+def prepare_data_synthetic(folder):
+    # K random subspaces, see synthetic.py
+    return synthetic.prepare_data(folder, args)
+
+
 def normalize_data(data):
     data = data - data.mean(axis=0)
     data = data / data.std(axis=0)
@@ -783,6 +1022,8 @@ def normalize_data(data):
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    svd_backend.configure(args)
+    spectral.configure(args)
     assert args.name is not None and args.name != '', 'name of experiment must be specified'
 
     # prepare data
@@ -791,7 +1032,8 @@ if __name__ == '__main__':
         'yaleb': prepare_data_YaleB,
         'orl': prepare_data_orl,
         'coil20': prepare_data_coil20,
-        'coil100': prepare_data_coil100}
+        'coil100': prepare_data_coil100,
+        'synthetic': prepare_data_synthetic}
     assert args.dataset in preparation_funcs
     Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path = \
             preparation_funcs[args.dataset](folder)
@@ -814,15 +1056,31 @@ if __name__ == '__main__':
 
         # clear graph and build a new conv-AE
         tf.reset_default_graph()
-        CAE = ConvAE(
-            args,
-            n_input, n_hidden, kernel_size, n_class, n_sample_perclass, disc_size,
-            lambda1, lambda2, lambda3, batch_size, r=args.r, rank=args.rank,
-            reg=tf.contrib.layers.l2_regularizer(tf.ones(1) * args.lambda4), disc_bound=args.bound,
-            model_path=model_path, restore_path=restore_path, logs_path=logs_path)
+        profiler = profiling.make_profiler(args.profile, args.trace_every)
+        with profiler.phase('build'):
+            CAE = ConvAE(
+                args,
+                n_input, n_hidden, kernel_size, n_class, n_sample_perclass, disc_size,
+                lambda1, lambda2, lambda3, batch_size, r=args.r, rank=args.rank,
+                reg=tf.contrib.layers.l2_regularizer(tf.ones(1) * args.lambda4), disc_bound=args.bound,
+                model_path=model_path, restore_path=restore_path, logs_path=logs_path, profiler=profiler)
 
         # perform optimization
-        avg_i, med_i = reinit_and_optimize(args, Img, Label, CAE, n_class, k=k, post_alpha=post_alpha)
+        stopper = early_stop.make_early_stopping(args)
+        cache = eval_cache.make_eval_cache(args)
+        schedule = eval_schedule.make_schedule(args)
+        avg_i, med_i = reinit_and_optimize(args, Img, Label, CAE, n_class, k=k, post_alpha=post_alpha, stopper=stopper, cache=cache, schedule=schedule)
+        if stopper is not None:
+            stopper.save(os.path.join(logs_path, 'early_stop-{}.json'.format(n_class)))
+        if cache is not None:
+            print(cache.summary())
+            cache.save(os.path.join(logs_path, 'eval_cache-{}.json'.format(n_class)))
+        if schedule is not None:
+            print(schedule.summary())
+            schedule.save(os.path.join(logs_path, 'eval_schedule-{}.json'.format(n_class)))
+        if args.profile:
+            print(profiler.summary(CAE.sess))
+            profiler.save_trace(os.path.join(logs_path, 'trace-{}.json'.format(n_class)))
         # add result to list
         avg.append(avg_i)
         med.append(med_i)
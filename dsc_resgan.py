@@ -2,16 +2,21 @@ import tensorflow as tf
 import numpy as np
 from tensorflow.contrib import layers
 import scipy.io as sio
-from scipy.sparse.linalg import svds
 # from skcuda.linalg import svd as svd_cuda
 # import pycuda.gpuarray as gpuarray
 # from pycuda.tools import DeviceMemoryPool
-from sklearn import cluster
 from sklearn.preprocessing import normalize
 from munkres import Munkres
 import os
 import time
 import argparse
+import synthetic
+import pipeline
+import cpu
+import graph_cache
+import svd_backend
+import spectral
+import affinity
 
 parser = argparse.ArgumentParser()
 parser.add_argument('name')  # name of experiment, used for creating log directory
@@ -28,7 +33,7 @@ parser.add_argument('--lr2', type=float, default=2e-4)  # learning rate for disc
 parser.add_argument('--pretrain', type=int, default=0)  # number of iterations of pretraining
 parser.add_argument('--epochs', type=int, default=1000) # number of epochs to train on eqn3 and eqn3plus
 parser.add_argument('--enable-at', type=int, default=300)  # epoch at which to enable eqn3plus
-parser.add_argument('--dataset', type=str, default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100'])
+parser.add_argument('--dataset', type=str, default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100', 'synthetic'])
 parser.add_argument('--interval', type=int, default=50)
 parser.add_argument('--interval2', type=int, default=1)
 parser.add_argument('--bound', type=float, default=0.2)  # discriminator weight clipping limit
@@ -57,6 +62,11 @@ parser.add_argument('--kernel-size',    type=int,       nargs='+',  default=None
 
 parser.add_argument('--k1',             type=int,       default=1)  # step2 repeats
 parser.add_argument('--k2',             type=int,       default=1)  # step2&3 outter loop repeats
+parser.add_argument('--graph-cache',    default=None)  # folder of built graphs, reused by runs with the same configuration
+synthetic.add_arguments(parser)      # --synth-* options of --dataset synthetic
+cpu.add_arguments(parser)            # --*-threads and --*-cores of the CPU execution profile
+svd_backend.add_arguments(parser)    # --svd backend of post_proC, see svd_backend.py
+spectral.add_arguments(parser)       # --spectral clustering of post_proC, see spectral.py
 
 """
 Example launch commands:
@@ -89,6 +99,37 @@ class ConvAE(object):
         self.rank = rank
         self.iter = 0
 
+        # build the graph, or import it from --graph-cache if it was built before with the same configuration
+        self.t_start = time.time()
+        cache = None
+        if args.graph_cache:
+            key = graph_cache.config_key(__file__, args, n_input, n_hidden, kernel_size, n_class, n_sample_perclass,
+                                         disc_size, lambda1, lambda2, lambda3, batch_size, r, rank, disc_bound)
+            cache = graph_cache.GraphCache(args.graph_cache, key)
+        if cache is not None and cache.exists():
+            cache.load(self)
+            self.graph_source = 'loaded from ' + cache.path
+        else:
+            before = set(vars(self))
+            self.build_graph(args, n_input, lambda1, lambda2, lambda3, batch_size, r, disc_bound)
+            if cache is not None:
+                cache.save(self, exclude=before)
+            self.graph_source = 'built'
+        print('graph {} in {:.1f}s'.format(self.graph_source, time.time() - self.t_start))
+
+        # finalize stuffs
+        ae_weights = [v for v in tf.trainable_variables() if (v.name.startswith('enc') or v.name.startswith('dec'))]
+        config = tf.ConfigProto()
+        # config.gpu_options.allow_growth = True  # stop TF from eating up all GPU RAM
+        # config.gpu_options.per_process_gpu_memory_fraction = 0.4
+        self.cpu = cpu.CPUProfile(args)  # thread pools and cores of the session and of post_proC
+        self.cpu.configure(config)
+        self.sess = tf.InteractiveSession(config=config)
+        self.sess.run(self.init)
+        self.saver = tf.train.Saver([v for v in ae_weights if v.name.startswith('enc_w') or v.name.startswith('dec_w')])
+        self.summary_writer = tf.summary.FileWriter(logs_path, graph=tf.get_default_graph(), flush_secs=20)
+
+    def build_graph(self, args, n_input, lambda1, lambda2, lambda3, batch_size, r, disc_bound):
         """
         Eqn3
         """
@@ -217,13 +258,6 @@ class ConvAE(object):
         self.summaryop_pretrain = tf.summary.merge([s0, s5])
         self.summaryop_eqn3plus = tf.summary.merge([s1, s2, s3, ])
         self.init = tf.global_variables_initializer()
-        config = tf.ConfigProto()
-        # config.gpu_options.allow_growth = True  # stop TF from eating up all GPU RAM
-        # config.gpu_options.per_process_gpu_memory_fraction = 0.4
-        self.sess = tf.InteractiveSession(config=config)
-        self.sess.run(self.init)
-        self.saver = tf.train.Saver([v for v in ae_weights if v.name.startswith('enc_w') or v.name.startswith('dec_w')])
-        self.summary_writer = tf.summary.FileWriter(logs_path, graph=tf.get_default_graph(), flush_secs=20)
 
     # Building the encoder
     def encoder(self, x):
@@ -549,40 +583,11 @@ def thrC(C, ro):
     return Cp
 
 
-def build_aff(C):
-    N = C.shape[0]
-    Cabs = np.abs(C)
-    ind = np.argsort(-Cabs, 0)
-    for i in range(N):
-        Cabs[:, i] = Cabs[:, i] / (Cabs[ind[0, i], i] + 1e-6)
-    Cksym = Cabs + Cabs.T;
-    return Cksym
-
-
-def spectral_cluster(L, n, eps=2.2 * 10 - 8):
-    """
-    L: Laplacian
-    n: number of clusters
-    Translates MATLAB code below:
-    N  = size(L, 1)
-    DN = diag( 1./sqrt(sum(L)+eps) );
-    LapN = speye(N) - DN * L * DN;
-    [~,~,vN] = svd(LapN);
-    kerN = vN(:,N-n+1:N);
-    normN = sum(kerN .^2, 2) .^.5;
-    kerNS = bsxfun(@rdivide, kerN, normN + eps);
-    groups = kmeans(kerNS,n,'maxiter',MAXiter,'replicates',REPlic,'EmptyAction','singleton');
-    """
-    N = L.shape[0]
-    DN = (1. / np.sqrt(L.sum(0) + eps))
-    LapN = np.eye(N) - DN * L * DN
-
-
 def post_proC(C, K, d, alpha):
     # C: coefficient matrix, K: number of clusters, d: dimension of each subspace
     C = 0.5 * (C + C.T)
     r = d * K + 1  # K=38, d=10
-    U, S, _ = svds(C, r, v0=np.ones(C.shape[0]))
+    U, S, _ = svd_backend.svds(C, r)
     # U, S, _ = svd_cuda(C, allocator=mem_pool)
     # take U and S from GPU
     # U = U[:, :r].get()
@@ -592,15 +597,13 @@ def post_proC(C, K, d, alpha):
     S = np.diag(S)
     U = U.dot(S)
     U = normalize(U, norm='l2', axis=1)
-    Z = U.dot(U.T)
-    #Z = Z * (Z > 0)
-    L = np.abs(np.abs(Z) ** alpha)
-    L = L / L.max()
-    L = 0.5 * (L + L.T)
-    spectral = cluster.SpectralClustering(n_clusters=K, eigen_solver='arpack', affinity='precomputed',
-                                          assign_labels='discretize')
-    spectral.fit(L)
-    grp = spectral.fit_predict(L)  # +1
+    kernel = affinity.kernel(alpha)
+    if spectral.settings['landmarks']:
+        # the same affinity, between the samples and the landmarks only
+        grp = spectral.landmark_cluster(U, K, kernel)
+        return grp, None
+    L = affinity.post_affinity(U, kernel)
+    grp = spectral.cluster(L, K)  # +1
     return grp, L
 
 
@@ -611,14 +614,6 @@ def err_rate(gt_s, s):
     return missrate
 
 
-def build_laplacian(C):
-    C = 0.5 * (np.abs(C) + np.abs(C.T))
-    W = np.sum(C, axis=0)
-    W = np.diag(1.0 / W)
-    L = W.dot(C)
-    return L
-
-
 def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
     alpha = args.alpha #max(0.4 - (n_class - 1) / 10 * 0.1, 0.1)
     print
@@ -649,16 +644,18 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
             AE l2 norm   : 29
             Ae recon loss: 13372
         """
+        minibatch_size = 128
+        batches = pipeline.BatchPrefetcher(Img, minibatch_size)  # shuffled mini-batches, prepared in the background
         for epoch in xrange(1, args.pretrain + 1):
-            minibatch_size = 128
-            indices = np.random.permutation(Img.shape[0])[:minibatch_size]
-            minibatch = Img[indices]  # pretrain with random mini-batch
+            minibatch, _, _ = next(batches)
             cost = CAE.partial_fit_pretrain(minibatch, args.lr)
             if epoch % 100 == 0:
                 norm = CAE.get_ae_weight_norm()
                 print 'pretraining epoch {}, cost: {}, norm: {}'.format(epoch, cost / float(minibatch_size), norm)
+        batches.close()
         if args.save:
             CAE.save_model()
+    print('startup: {:.1f}s before the first fine-tune step (graph {})'.format(time.time() - CAE.t_start, CAE.graph_source))
     ###
     ### Stage 2: fine-tune network
     ###
@@ -693,7 +690,8 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
             print("epoch: %.1d" % epoch, "cost: %.8f" % (cost / float(batch_size)))
             Coef = thrC(Coef, alpha)
             t_begin = time.time()
-            y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
+            with CAE.cpu.evaluation():
+                y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
             if len(set(list(np.squeeze(y_x_new)))) == n_class:
                 y_x = y_x_new
             else:
@@ -809,6 +807,11 @@ def prepare_data_coil100(folder):
     return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
 
 
+def prepare_data_synthetic(folder):
+    # K random subspaces, see synthetic.py
+    return synthetic.prepare_data(folder, args)
+
+
 def normalize_data(data):
     data = data - data.mean(axis=0)
     data = data / data.std(axis=0)
@@ -817,6 +820,8 @@ def normalize_data(data):
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    svd_backend.configure(args)
+    spectral.configure(args)
     assert args.name is not None and args.name != '', 'name of experiment must be specified'
 
     # prepare data
@@ -825,7 +830,8 @@ if __name__ == '__main__':
         'yaleb': prepare_data_YaleB,
         'orl': prepare_data_orl,
         'coil20': prepare_data_coil20,
-        'coil100': prepare_data_coil100}
+        'coil100': prepare_data_coil100,
+        'synthetic': prepare_data_synthetic}
     assert args.dataset in preparation_funcs
     Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path = \
             preparation_funcs[args.dataset](folder)
@@ -0,0 +1,927 @@
+"""
+TensorFlow 2 port of ConvAE
+
+The training scripts are TF1 graphs (tf.placeholder, tf.contrib.layers, InteractiveSession and feed_dict)
+that no current TensorFlow runs. This script has the same models written for TF2, with every training
+step a tf.function compiled by XLA (--no-xla runs them as plain graph functions):
+    --model gan5  : ConvAE of dsc_gan5.py, steps pretrain, eqn3, disc and eqn3plus
+    --model resgan: ConvAE of dsc_resgan.py, steps pretrain, eqn3 and step1 to step5
+Variables keep their TF1 names and the losses are the same, including the way the TF1 graphs add the
+list of weight decay terms to a scalar loss, so checkpoints saved by the TF1 scripts (for example
+model-102030-48x42-yaleb.ckpt) restore here and the other way round. Adam is the update rule of
+tf.train.AdamOptimizer, with the learning rate passed to each step.
+
+The per-cluster ops of the TF1 graphs (a tf.where/tf.gather per cluster, a Python loop over pairs of
+subspaces) become one-hot masks and batched matmuls, so the compiled steps have static shapes and do not
+grow with the number of clusters. Random recombinations are drawn from the same distribution, not the
+same numbers. --usebn and --proj-cluster of dsc_gan5.py are not ported.
+"""
+import tensorflow as tf
+import numpy as np
+import scipy.io as sio
+from sklearn.preprocessing import normalize
+from munkres import Munkres
+import os
+import time
+import argparse
+import synthetic
+import pipeline
+import svd_backend
+import spectral
+import affinity
+
+parser = argparse.ArgumentParser()
+parser.add_argument('name')  # name of experiment, used for creating log directory
+parser.add_argument('--model', default='gan5', choices=['gan5', 'resgan'])  # which script's ConvAE to train
+parser.add_argument('--no-xla', action='store_true')  # run the steps without XLA compilation
+
+parser.add_argument('--lambda1', type=float, default=1.0)  # lambda on Coef's f-norm
+parser.add_argument('--lambda2', type=float, default=0.2)  # lambda on self-expressive loss
+parser.add_argument('--lambda3', type=float, default=1.0)  # lambda on score_disc in generator loss
+parser.add_argument('--lambda4', type=float, default=0.1)  # lambda on AE's weights L2 regularization
+parser.add_argument('--lambda5', type=float, default=0.1)  # resgan: lambda on loss_u in ae_loss_combined
+
+parser.add_argument('--lr',  type=float, default=1e-3)  # learning rate
+parser.add_argument('--lr2', type=float, default=2e-4)  # learning rate for discriminator and eqn3plus
+
+parser.add_argument('--pretrain', type=int, default=0)  # number of iterations of pretraining
+parser.add_argument('--epochs', type=int, default=1000)  # number of epochs to train on eqn3 and eqn3plus
+parser.add_argument('--enable-at', type=int, default=300)  # epoch at which to enable eqn3plus
+parser.add_argument('--dataset', type=str, default='yaleb', choices=['yaleb', 'orl', 'coil20', 'coil100', 'synthetic'])
+parser.add_argument('--interval', type=int, default=50)
+parser.add_argument('--interval2', type=int, default=1)
+parser.add_argument('--bound', type=float, default=0.2)  # resgan: discriminator weight clipping limit
+parser.add_argument('--D-init', type=int, default=100)  # gan5: number of discriminators steps before eqn3plus starts
+parser.add_argument('--D-steps', type=int, default=1)
+parser.add_argument('--G-steps', type=int, default=1)
+parser.add_argument('--save', action='store_true')  # save pretrained model
+parser.add_argument('--r', type=int, default=0)  # Nxr rxN, use 0 to default to NxN Coef
+parser.add_argument('--rank', type=int, default=10)  # dimension of the subspaces
+parser.add_argument('--beta2', type=float, default=0.010)  # promote org of subspaces' basis difference
+parser.add_argument('--beta3', type=float, default=0.010)  # promote org of subspaces' basis difference
+
+parser.add_argument('--stop-real', action='store_true')  # gan5: cut z_real path
+parser.add_argument('--submean',        action='store_true')    # subtract mean from each group before proceeding
+parser.add_argument('--no-uni-norm',    action='store_true')    # do not normalize recombination coefficient to norm 1
+parser.add_argument('--one2one',      action='store_true')      # use 1-to-1 matching
+parser.add_argument('--alpha',          type=float, default=0.1)
+parser.add_argument('--m',              type=float,     default=None)   # gan5: hinge on the fake residuals
+
+parser.add_argument('--matfile',        default=None)
+parser.add_argument('--imgmult',        type=float,     default=1.0)
+parser.add_argument('--palpha',         type=float,     default=None)
+parser.add_argument('--kernel-size',    type=int,       nargs='+',  default=None)
+
+parser.add_argument('--k1',             type=int,       default=1)  # resgan: step2 repeats
+parser.add_argument('--k2',             type=int,       default=1)  # resgan: step2&3 outter loop repeats
+synthetic.add_arguments(parser)      # --synth-* options of --dataset synthetic
+svd_backend.add_arguments(parser)    # --svd backend of post_proC, see svd_backend.py
+spectral.add_arguments(parser)       # --spectral clustering of post_proC, see spectral.py
+
+"""
+Example launch commands:
+CUDA_VISIBLE_DEVICES=0 python dsc_tf2.py yaleb_tf2 --model gan5 --epochs 4000 --enable-at 3000 --dataset yaleb
+    restore model-102030-48x42-yaleb.ckpt, train on eqn3 for 3000 epochs, and on eqn3plus for 1000 epochs
+CUDA_VISIBLE_DEVICES=0 python dsc_tf2.py orl_tf2 --model resgan --pretrain 10000 --epochs 4000 --enable-at 2000 --dataset orl
+    pretrain for 10000 iterations first, then train on eqn3 for 2000 epochs, and on steps 1-5 for 2000 epochs
+"""
+
+
+def xavier(shape):
+    # layers.xavier_initializer(_conv2d): uniform, fans counted over the receptive field
+    receptive = int(np.prod(shape[:-2]))
+    limit = np.sqrt(6.0 / (receptive * (shape[-2] + shape[-1])))
+    return tf.random.uniform(shape, -limit, limit)
+
+
+class Adam(object):
+    def __init__(self, var_list, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        """
+        tf.train.AdamOptimizer on a fixed list of variables, the learning rate is an argument of minimize()
+        so one compiled step serves every learning rate
+        """
+        self.var_list = var_list
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.m = [tf.Variable(tf.zeros_like(v), trainable=False) for v in var_list]
+        self.v = [tf.Variable(tf.zeros_like(v), trainable=False) for v in var_list]
+        self.beta1_power = tf.Variable(beta1, dtype=tf.float32, trainable=False)
+        self.beta2_power = tf.Variable(beta2, dtype=tf.float32, trainable=False)
+
+    def reset(self):
+        for slot in self.m + self.v:
+            slot.assign(tf.zeros_like(slot))
+        self.beta1_power.assign(self.beta1)
+        self.beta2_power.assign(self.beta2)
+
+    def minimize(self, tape, loss, lr):
+        grads = tape.gradient(loss, self.var_list)
+        lr_t = lr * tf.sqrt(1 - self.beta2_power) / (1 - self.beta1_power)
+        for var, grad, m, v in zip(self.var_list, grads, self.m, self.v):
+            if grad is None:
+                continue
+            m_t = m.assign(self.beta1 * m + (1 - self.beta1) * grad)
+            v_t = v.assign(self.beta2 * v + (1 - self.beta2) * tf.square(grad))
+            var.assign_sub(lr_t * m_t / (tf.sqrt(v_t) + self.epsilon))
+        self.beta1_power.assign(self.beta1_power * self.beta1)
+        self.beta2_power.assign(self.beta2_power * self.beta2)
+
+
+def is_min(label, sreal):
+    # whether each cluster fits its subspace best among all clusters matched to the same subspace
+    same = tf.equal(label[:, None], label[None, :])
+    best = tf.reduce_min(tf.where(same, sreal[None, :], np.inf), axis=1)
+    return tf.equal(sreal, best)
+
+
+class ConvAE(object):
+    # name of the subspace bases, dsc_resgan.py calls them U{}
+    u_name = 'disc_w{}'
+
+    def __init__(self,
+                 args,
+                 n_input, n_hidden, kernel_size, n_class, n_sample_perclass, disc_size,
+                 lambda1, lambda2, lambda3, batch_size, r=0, rank=10, lambda4=0.1, disc_bound=0.2,
+                 model_path=None, restore_path=None,
+                 logs_path='logs', jit_compile=True):
+        self.args = args
+        self.n_class = n_class
+        self.n_input = n_input
+        self.n_hidden = n_hidden
+        self.kernel_size = kernel_size
+        self.n_sample_perclass = n_sample_perclass
+        self.disc_size = disc_size
+        self.batch_size = batch_size
+        self.lambda1 = lambda1
+        self.lambda2 = lambda2
+        self.lambda3 = lambda3
+        self.lambda4 = lambda4
+        self.disc_bound = disc_bound
+        self.model_path = model_path
+        self.restore_path = restore_path
+        self.rank = rank
+        self.iter = 0
+        self.gen_step = 0
+        self.initializers = []
+        self.optimizers = []
+
+        # encoder and decoder, shapes holds the input shape of each encoder layer
+        n_hidden = [1] + self.n_hidden
+        self.enc_w, self.enc_b, self.shapes = [], [], []
+        h, w = n_input
+        for i, k_size in enumerate(self.kernel_size):
+            self.enc_w.append(self.variable('enc_w{}'.format(i), [k_size, k_size, n_hidden[i], n_hidden[i + 1]], xavier))
+            self.enc_b.append(self.variable('enc_b{}'.format(i), [n_hidden[i + 1]], tf.zeros))
+            self.shapes.append([h, w, n_hidden[i]])
+            h, w = (h + 1) // 2, (w + 1) // 2
+        self.latent_size = h * w * n_hidden[-1]
+        n_hidden = list(reversed(n_hidden))
+        self.dec_w, self.dec_b = [], []
+        for i, k_size in enumerate(reversed(self.kernel_size)):
+            self.dec_w.append(self.variable('dec_w{}'.format(i), [k_size, k_size, n_hidden[i + 1], n_hidden[i]], xavier))
+            self.dec_b.append(self.variable('dec_b{}'.format(i), [n_hidden[i + 1]], tf.zeros))
+        self.ae_weights = self.enc_w + self.enc_b + self.dec_w + self.dec_b
+
+        # self-expressive layer
+        if r == 0:
+            self.Coef_weights = [self.variable('Coef', [batch_size, batch_size], lambda shape: 1.0e-4 * tf.ones(shape))]
+        else:
+            v = (1e-2) / r
+            self.Coef_weights = [self.variable('Coef_L', [batch_size, r], lambda shape: v * tf.ones(shape)),
+                                 self.variable('Coef_R', [r, batch_size], lambda shape: v * tf.ones(shape))]
+        self.eqn3_weights = self.Coef_weights + self.ae_weights
+
+        # subspace bases
+        self.Us = [self.variable(self.u_name.format(j), [self.latent_size, rank], xavier) for j in range(n_class)]
+
+        self.optimizer_pre = self.optimizer(self.ae_weights)
+        self.optimizer_eqn3 = self.optimizer(self.eqn3_weights)
+        self.build_gan()
+
+        compile = lambda step: tf.function(step, jit_compile=jit_compile)
+        self.steps = dict((name, compile(step)) for name, step in self.step_functions().items())
+        self.summary_writer = tf.summary.create_file_writer(logs_path)
+
+    def variable(self, name, shape, initializer):
+        v = tf.Variable(initializer(shape), name=name)
+        self.initializers.append((v, initializer))
+        return v
+
+    def optimizer(self, var_list, beta1=0.9):
+        opt = Adam(var_list, beta1=beta1)
+        self.optimizers.append(opt)
+        return opt
+
+    def build_gan(self):
+        self.optimizer_disc = self.optimizer(self.Us, beta1=0.0)
+        self.optimizer_eqn3plus = self.optimizer(self.eqn3_weights)
+
+    def step_functions(self):
+        return {'pretrain': self.pretrain_step, 'eqn3': self.eqn3_step, 'assign_u': self.assign_u_step,
+                'disc': self.disc_step, 'eqn3plus': self.eqn3plus_step}
+
+    # Building the encoder
+    def encoder(self, x):
+        for w, b in zip(self.enc_w, self.enc_b):
+            x = tf.nn.relu(tf.nn.bias_add(tf.nn.conv2d(x, w, strides=[1, 2, 2, 1], padding='SAME'), b))
+        return x
+
+    # Building the decoder
+    def decoder(self, latent):
+        input = latent
+        n = tf.shape(latent)[0]
+        for i, (w, b, shape) in enumerate(zip(self.dec_w, self.dec_b, reversed(self.shapes))):
+            dec_i = tf.nn.conv2d_transpose(input, w, tf.stack([n, shape[0], shape[1], shape[2]]),
+                                           strides=[1, 2, 2, 1], padding='SAME')
+            dec_i = tf.add(dec_i, b)
+            if i != len(self.n_hidden) - 1:
+                dec_i = tf.nn.relu(dec_i)
+            input = dec_i
+        return input
+
+    def coef(self):
+        if len(self.Coef_weights) == 1:
+            return self.Coef_weights[0]
+        return tf.matmul(self.Coef_weights[0], self.Coef_weights[1])
+
+    def encode(self, x):
+        return tf.reshape(self.encoder(x), [self.batch_size, self.latent_size])
+
+    def eqn3_terms(self, x):
+        """
+        returns z, Coef, the Eqn 3 loss, and its terms for the summaries
+        """
+        latent = self.encoder(x)
+        z = tf.reshape(latent, [self.batch_size, self.latent_size])
+        Coef = self.coef()
+        z_c = tf.matmul(Coef, z)
+        x_r = self.decoder(tf.reshape(z_c, tf.shape(latent)))
+        loss_recon = 0.5 * tf.reduce_sum(tf.square(x_r - x))
+        loss_sparsity = tf.reduce_sum(tf.square(Coef))
+        loss_selfexpress = 0.5 * tf.reduce_sum(tf.square(z_c - z))
+        loss_eqn3 = loss_recon + self.lambda1 * loss_sparsity + self.lambda2 * loss_selfexpress
+        terms = {'loss_recon': loss_recon, 'loss_sparsity': loss_sparsity, 'loss_selfexpress': loss_selfexpress,
+                 'ae_l2_norm': self.ae_weight_norm()}
+        return z, Coef, loss_eqn3, terms
+
+    def weight_decay(self, loss):
+        """
+        loss plus the L2 weight decay of the encoder and decoder kernels, as the TF1 graphs add it: the list of
+        per-kernel terms broadcasts the scalar loss to one copy per kernel, and minimize() sums the copies
+        """
+        decay = [self.lambda4 * tf.nn.l2_loss(w) for w in self.enc_w + self.dec_w]
+        return len(decay) * loss + tf.add_n(decay)
+
+    def ae_weight_norm(self):
+        return tf.sqrt(tf.add_n([tf.reduce_sum(tf.square(v)) for v in self.ae_weights]))
+
+    """
+    Subspaces, for all clusters at once
+    """
+    def groups(self, z, y):
+        """
+        returns z (minus the mean of its cluster with --submean), the one-hot cluster membership N x K and
+        the cluster sizes
+        """
+        onehot = tf.one_hot(y, self.n_class)
+        counts = tf.reduce_sum(onehot, 0)
+        if self.args.submean:
+            z = z - tf.matmul(onehot, tf.matmul(onehot, z, transpose_a=True) / counts[:, None])
+        return z, onehot, counts
+
+    def normalized_Us(self):
+        # K x D x rank, columns of unit norm
+        return tf.nn.l2_normalize(tf.stack(self.Us), axis=1)
+
+    def residual_norms(self, z, Un):
+        # ||z_n - z_n U_i U_i^T||^2 for every point n and subspace i, N x K, without an N x K x D tensor
+        p = tf.einsum('nd,kdr->nkr', z, Un)
+        Gp = tf.einsum('krs,nks->nkr', tf.matmul(Un, Un, transpose_a=True), p)
+        return tf.reduce_sum(tf.square(z), 1, keepdims=True) - 2 * tf.reduce_sum(tf.square(p), 2) + tf.reduce_sum(p * Gp, 2)
+
+    def residuals(self, z, Un, choice):
+        # z_n - z_n U U^T with U the subspace picked by the one-hot row choice_n, N x D
+        p = tf.einsum('nd,kdr->nkr', z, Un) * choice[:, :, None]
+        return z - tf.einsum('nkr,kdr->nd', p, Un)
+
+    def match(self, z, onehot, counts, Un):
+        """
+        for each cluster, the subspace with the smallest mean residual and that residual (match_idx)
+        """
+        sreal = tf.matmul(onehot, self.residual_norms(z, Un), transpose_a=True) / counts[:, None]
+        return tf.argmin(sreal, axis=1, output_type=tf.int32), tf.reduce_min(sreal, axis=1)
+
+    def u_init(self, z, y, counts):
+        """
+        QR basis of the first rank points of each cluster (get_u_init_for_g), K x D x rank; the leading
+        columns of a QR factorization only depend on the leading columns of the matrix
+        """
+        order = tf.argsort(y, stable=True)
+        starts = tf.cumsum(tf.cast(counts, tf.int32), exclusive=True)
+        idx = tf.gather(order, starts[:, None] + tf.range(self.rank)[None, :])
+        q, _ = tf.linalg.qr(tf.transpose(tf.gather(z, idx), [0, 2, 1]))
+        return q
+
+    def recombine(self, g, onehot):
+        # uniform_recombine of every cluster at once: random combinations of points of the same cluster
+        selector = tf.random.uniform([self.batch_size, self.batch_size]) * tf.matmul(onehot, onehot, transpose_b=True)
+        if not self.args.no_uni_norm:
+            selector = selector / tf.reduce_sum(selector, 1, keepdims=True)  # normalize each row to 1
+        return tf.matmul(selector, g)
+
+    def assign_Us(self, Us_new):
+        for i, u in enumerate(self.Us):
+            u.assign(Us_new[i])
+
+    def regularization(self):
+        """
+        regularization1 (overlap of different Us) and regularization2 (Us away from orthonormal)
+        """
+        U = tf.stack(self.Us)
+        overlap = tf.reduce_sum(tf.square(tf.einsum('idr,jds->ijrs', U, U)), [2, 3])
+        regularize1 = tf.reduce_sum(overlap * (1 - tf.eye(self.n_class))) / self.n_class
+        regularize2 = tf.reduce_sum(tf.square(tf.matmul(U, U, transpose_a=True) - tf.eye(self.rank))) / self.n_class
+        return regularize1, regularize2
+
+    def disc_score(self, z, y):
+        """
+        score_disc of compute_disc_loss and the mean real and fake scores; with --one2one the Us of the
+        clusters that lost their subspace to a better fitting cluster are reinitialized first
+        """
+        z, onehot, counts = self.groups(z, y)
+        Un = self.normalized_Us()
+        label, sreal = self.match(z, onehot, counts, Un)
+        if self.args.one2one:
+            Us_new = tf.where(is_min(label, sreal)[:, None, None], tf.gather(Un, label), self.u_init(z, y, counts))
+            self.assign_Us(Us_new)
+            # no gradient through tf.assign in the TF1 graph either
+            Un = tf.stop_gradient(tf.nn.l2_normalize(Us_new, axis=1))
+            choice = onehot
+        else:
+            choice = tf.one_hot(tf.gather(label, y), self.n_class)
+        g = tf.nn.l2_normalize(z, axis=1)
+        g_fake = self.recombine(g, onehot)
+        loss_real = tf.reduce_sum(tf.square(self.residuals(g, Un, choice)), 1)
+        loss_fake = tf.reduce_sum(tf.square(self.residuals(g_fake, Un, choice)), 1)
+        if self.args.m:
+            loss_fake = -tf.nn.relu(self.args.m - loss_fake)
+        loss_real = tf.linalg.matvec(onehot, loss_real, transpose_a=True) / counts
+        loss_fake = tf.linalg.matvec(onehot, loss_fake, transpose_a=True) / counts
+        if self.args.stop_real:
+            loss_real = tf.stop_gradient(loss_real)
+        score_disc = -tf.reduce_mean(loss_real - loss_fake)
+        return score_disc, {'score_disc': score_disc, 'disc_real': tf.reduce_mean(loss_real),
+                            'disc_fake': tf.reduce_mean(loss_fake)}
+
+    """
+    Steps, compiled in __init__
+    """
+    def pretrain_step(self, x, lr):
+        with tf.GradientTape() as tape:
+            x_r = self.decoder(self.encoder(x))
+            loss_recon_pre = 0.5 * tf.reduce_sum(tf.square(x_r - x))
+            loss = self.weight_decay(loss_recon_pre)
+        self.optimizer_pre.minimize(tape, loss, lr)
+        return loss_recon_pre, {'loss_recon_pre': loss_recon_pre / self.batch_size, 'ae_l2_norm': self.ae_weight_norm()}
+
+    def eqn3_step(self, x, lr):
+        with tf.GradientTape() as tape:
+            z, Coef, loss_eqn3, terms = self.eqn3_terms(x)
+            loss = self.weight_decay(loss_eqn3)
+        self.optimizer_eqn3.minimize(tape, loss, lr)
+        return terms['loss_recon'], Coef, terms
+
+    def assign_u_step(self, x, y):
+        z, onehot, counts = self.groups(self.encode(x), y)
+        self.assign_Us(self.u_init(z, y, counts))
+
+    def disc_step(self, x, y, lr):
+        z = self.encode(x)
+        with tf.GradientTape() as tape:
+            score_disc, _ = self.disc_score(z, y)
+            regularize1, regularize2 = self.regularization()
+            loss_disc = self.args.beta2 * regularize1 + self.args.beta3 * regularize2 - score_disc
+        self.optimizer_disc.minimize(tape, loss_disc, lr)
+
+    def eqn3plus_step(self, x, y, lr):
+        with tf.GradientTape() as tape:
+            z, Coef, loss_eqn3, terms = self.eqn3_terms(x)
+            score_disc, scores = self.disc_score(z, y)
+            loss = self.weight_decay(loss_eqn3 + self.lambda3 * score_disc)
+        self.optimizer_eqn3plus.minimize(tape, loss, lr)
+        terms.update(scores)
+        return terms['loss_recon'], Coef, terms
+
+    """
+    Same interface as the TF1 ConvAE
+    """
+    def run(self, name, X, y=None, lr=None):
+        args = [tf.convert_to_tensor(X, tf.float32)]
+        if y is not None:
+            args.append(tf.convert_to_tensor(y, tf.int32))
+        if lr is not None:
+            args.append(tf.constant(lr, tf.float32))  # a tensor, so a new lr doesn't retrace the step
+        return self.steps[name](*args)
+
+    def add_summary(self, summary):
+        with self.summary_writer.as_default():
+            for tag, value in summary.items():
+                tf.summary.scalar(tag, value, step=self.iter)
+
+    def partial_fit_eqn3(self, X, lr):
+        # take a step on Eqn 3/4
+        cost, Coef, summary = self.run('eqn3', X, lr=lr)
+        self.add_summary(summary)
+        self.iter += 1
+        return cost.numpy(), Coef.numpy()
+
+    def assign_u_parameter(self, X, y):
+        self.run('assign_u', X, y)
+
+    def partial_fit_disc(self, X, y_x, lr):
+        self.run('disc', X, y_x, lr)
+
+    def partial_fit_eqn3plus(self, X, y_x, lr):
+        cost, Coef, summary = self.run('eqn3plus', X, y_x, lr)
+        self.gen_step += 1
+        self.add_summary(summary)
+        self.iter += 1
+        return cost.numpy(), Coef.numpy()
+
+    def partial_fit_pretrain(self, X, lr):
+        cost, summary = self.run('pretrain', X, lr=lr)
+        self.add_summary(summary)
+        self.iter += 1
+        return cost.numpy()
+
+    def get_ae_weight_norm(self):
+        return self.ae_weight_norm().numpy()
+
+    def log_accuracy(self, accuracy):
+        self.add_summary({'accuracy': accuracy})
+
+    def initlization(self):
+        for v, initializer in self.initializers:
+            v.assign(initializer(v.shape.as_list()))
+        for opt in self.optimizers:
+            opt.reset()
+        self.gen_step = 0
+
+    def reconstruct(self, X):
+        latent = self.encoder(tf.convert_to_tensor(X, tf.float32))
+        z_c = tf.matmul(self.coef(), tf.reshape(latent, [self.batch_size, self.latent_size]))
+        return self.decoder(tf.reshape(z_c, tf.shape(latent))).numpy()
+
+    def transform(self, X):
+        return self.encode(tf.convert_to_tensor(X, tf.float32)).numpy()
+
+    def saved_weights(self):
+        # what the TF1 tf.train.Saver of the scripts saves
+        return self.enc_w + self.dec_w
+
+    def save_model(self):
+        # a V2 checkpoint bundle under the TF1 names, readable by tf.train.Saver.restore
+        weights = self.saved_weights()
+        tf.raw_ops.SaveV2(prefix=self.model_path, tensor_names=[v.name.split(':')[0] for v in weights],
+                          shape_and_slices=[''] * len(weights), tensors=[v.value() for v in weights])
+        print("model saved in file: %s" % self.model_path)
+
+    def restore(self):
+        reader = tf.train.load_checkpoint(self.restore_path)
+        for v in self.saved_weights():
+            v.assign(reader.get_tensor(v.name.split(':')[0]))
+        print("model restored")
+
+
+class ResConvAE(ConvAE):
+    u_name = 'U{}'
+
+    def build_gan(self):
+        # discriminator on the residuals
+        disc_size = [self.latent_size] + self.disc_size
+        self.disc_weights = []
+        self.disc_layers = []
+        for i in range(len(self.disc_size)):
+            w = self.variable('disc_w{}'.format(i), [disc_size[i], disc_size[i + 1]], xavier)
+            b = None
+            if i != len(self.disc_size) - 1:
+                b = self.variable('disc_b{}'.format(i), [disc_size[i + 1]], tf.zeros)
+            self.disc_layers.append((w, b))
+            self.disc_weights += [w] if b is None else [w, b]
+        self.optimizer_u_combined = self.optimizer(self.Us, beta1=0.0)
+        self.optimizer_ae_combined = self.optimizer(self.eqn3_weights)
+        self.optimizer_disc = self.optimizer(self.disc_weights)
+        self.optimizer_gen = self.optimizer(self.eqn3_weights)
+
+    def step_functions(self):
+        return {'pretrain': self.pretrain_step, 'eqn3': self.eqn3_step, 'assign_u': self.assign_u_step,
+                'step1': self.step1, 'step2': self.step2, 'step3': self.step3, 'step4': self.step4,
+                'step5': self.step5}
+
+    def discriminator(self, zres):
+        input = zres
+        for w, b in self.disc_layers:
+            disc_i = tf.matmul(input, w)
+            if b is not None:
+                disc_i = tf.nn.relu(tf.add(disc_i, b))
+            input = disc_i
+        return input
+
+    def u_loss(self, z, y):
+        """
+        loss_u, and the residuals of the real and the recombined points on their cluster's U (get_u_loss)
+        """
+        z, onehot, counts = self.groups(z, y)
+        Un = self.normalized_Us()
+        resi_real = self.residuals(z, Un, onehot)
+        resi_fake = self.residuals(self.recombine(z, onehot), Un, onehot)
+        loss_real = tf.linalg.matvec(onehot, tf.reduce_sum(tf.square(resi_real), 1), transpose_a=True) / counts
+        return tf.reduce_mean(loss_real), resi_real, resi_fake
+
+    def score_disc(self, resi_real, resi_fake):
+        return tf.reduce_sum(self.discriminator(resi_real)) - tf.reduce_sum(self.discriminator(resi_fake))
+
+    def step1(self, x, y):
+        # set_u_op: match each cluster to a U, clusters that lost theirs to a better fitting cluster get a new one
+        z, onehot, counts = self.groups(self.encode(x), y)
+        Un = self.normalized_Us()
+        label, sreal = self.match(z, onehot, counts, Un)
+        Us_new = tf.gather(Un, label)
+        if self.args.one2one:
+            Us_new = tf.where(is_min(label, sreal)[:, None, None], Us_new, self.u_init(z, y, counts))
+        self.assign_Us(Us_new)
+
+    def step2(self, x, y, lr):
+        z = self.encode(x)
+        with tf.GradientTape() as tape:
+            loss_u, _, _ = self.u_loss(z, y)
+            regularize1, regularize2 = self.regularization()
+            loss_u_combined = loss_u + self.args.beta2 * regularize1 + self.args.beta3 * regularize2
+        self.optimizer_u_combined.minimize(tape, loss_u_combined, lr * 0.0001)
+
+    def step3(self, x, y, lr):
+        with tf.GradientTape() as tape:
+            z, Coef, loss_eqn3, terms = self.eqn3_terms(x)
+            loss_u, _, _ = self.u_loss(z, y)
+            loss_ae_combined = self.weight_decay(loss_eqn3 + self.args.lambda5 * loss_u)
+        self.optimizer_ae_combined.minimize(tape, loss_ae_combined, lr)
+
+    def step4(self, x, y, lr):
+        z = self.encode(x)
+        with tf.GradientTape() as tape:
+            _, resi_real, resi_fake = self.u_loss(z, y)
+            loss_disc = -self.score_disc(resi_real, resi_fake)
+        self.optimizer_disc.minimize(tape, loss_disc, lr)
+        for v in self.disc_weights:
+            v.assign(tf.clip_by_value(v, -self.disc_bound, self.disc_bound))
+
+    def step5(self, x, y, lr):
+        with tf.GradientTape() as tape:
+            z, Coef, loss_eqn3, terms = self.eqn3_terms(x)
+            _, resi_real, resi_fake = self.u_loss(z, y)
+            loss_gen = self.weight_decay(loss_eqn3 + self.lambda3 * self.score_disc(resi_real, resi_fake))
+        self.optimizer_gen.minimize(tape, loss_gen, lr)
+        del terms['ae_l2_norm']
+        return terms['loss_recon'], Coef, terms
+
+    def step1_assign_u(self, X, y):
+        self.run('step1', X, y)
+
+    def step2_optimize_loss_u_combined(self, X, y, lr):
+        self.run('step2', X, y, lr)
+
+    def step3_optimize_loss_ae_combined(self, X, y, lr):
+        self.run('step3', X, y, lr)
+
+    def step4_optimize_loss_disc(self, X, y, lr):
+        self.run('step4', X, y, lr)
+
+    def step5_optimize_loss_gen(self, X, y, lr):
+        cost, Coef, summary = self.run('step5', X, y, lr)
+        self.add_summary(summary)
+        self.iter += 1
+        return cost.numpy(), Coef.numpy()
+
+
+def best_map(L1, L2):
+    # L1 should be the groundtruth labels and L2 should be the clustering labels we got
+    Label1 = np.unique(L1)
+    nClass1 = len(Label1)
+    Label2 = np.unique(L2)
+    nClass2 = len(Label2)
+    nClass = np.maximum(nClass1, nClass2)
+    G = np.zeros((nClass, nClass))
+    for i in range(nClass1):
+        ind_cla1 = L1 == Label1[i]
+        ind_cla1 = ind_cla1.astype(float)
+        for j in range(nClass2):
+            ind_cla2 = L2 == Label2[j]
+            ind_cla2 = ind_cla2.astype(float)
+            G[i, j] = np.sum(ind_cla2 * ind_cla1)
+    m = Munkres()
+    index = m.compute(-G.T)
+    index = np.array(index)
+    c = index[:, 1]
+    newL2 = np.zeros(L2.shape)
+    for i in range(nClass2):
+        newL2[L2 == Label2[i]] = Label1[c[i]]
+    return newL2
+
+
+def thrC(C, ro):
+    if ro < 1:
+        N = C.shape[1]
+        Cp = np.zeros((N, N))
+        S = np.abs(np.sort(-np.abs(C), axis=0))
+        Ind = np.argsort(-np.abs(C), axis=0)
+        for i in range(N):
+            cL1 = np.sum(S[:, i]).astype(float)
+            stop = False
+            csum = 0
+            t = 0
+            while (stop == False):
+                csum = csum + S[t, i]
+                if csum > ro * cL1:
+                    stop = True
+                    Cp[Ind[0:t + 1, i], i] = C[Ind[0:t + 1, i], i]
+                t = t + 1
+    else:
+        Cp = C
+
+    return Cp
+
+
+def post_proC(C, K, d, alpha):
+    # C: coefficient matrix, K: number of clusters, d: dimension of each subspace
+    C = 0.5 * (C + C.T)
+    r = d * K + 1  # K=38, d=10
+    U, S, _ = svd_backend.svds(C, r)
+    U = U[:, ::-1]
+    S = np.sqrt(S[::-1])
+    S = np.diag(S)
+    U = U.dot(S)
+    U = normalize(U, norm='l2', axis=1)
+    kernel = affinity.kernel(alpha)
+    if spectral.settings['landmarks']:
+        # the same affinity, between the samples and the landmarks only
+        grp = spectral.landmark_cluster(U, K, kernel)
+        return grp, None
+    L = affinity.post_affinity(U, kernel)
+    grp = spectral.cluster(L, K)  # +1
+    return grp, L
+
+
+def err_rate(gt_s, s):
+    c_x = best_map(gt_s, s)
+    err_x = np.sum(gt_s[:] != c_x[:])
+    missrate = err_x.astype(float) / (gt_s.shape[0])
+    return missrate
+
+
+def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5):
+    alpha = args.alpha
+
+    if args.epochs is None:
+        num_epochs = 50 + n_class * 25  # 100+n_class*20
+    else:
+        num_epochs = args.epochs
+
+    # init
+    CAE.initlization()
+
+    ###
+    ### Stage 1: pretrain
+    ###
+    # if we skip pretraining, we restore already-trained model
+    if args.pretrain == 0:
+        CAE.restore()
+    # otherwise we pretrain the model first
+    else:
+        print('Pretrain for {} steps'.format(args.pretrain))
+        minibatch_size = 128
+        batches = pipeline.BatchPrefetcher(Img, minibatch_size)  # shuffled mini-batches, prepared in the background
+        for epoch in range(1, args.pretrain + 1):
+            minibatch, _, _ = next(batches)
+            cost = CAE.partial_fit_pretrain(minibatch, args.lr)
+            if epoch % 100 == 0:
+                norm = CAE.get_ae_weight_norm()
+                print('pretraining epoch {}, cost: {}, norm: {}'.format(epoch, cost / float(minibatch_size), norm))
+        batches.close()
+        if args.save:
+            CAE.save_model()
+    ###
+    ### Stage 2: fine-tune network
+    ###
+    print('Finetune for {} steps'.format(num_epochs))
+    acc_x = 0.0
+    cost = 0.0
+    y_x = None  # labels of the last evaluation, the GAN phase trains against them
+    gan_start = args.enable_at + 1 if args.model == 'resgan' else args.enable_at  # first epoch that needs y_x
+    for epoch in range(1, num_epochs + 1):
+        # no evaluation before the GAN phase (--enable-at <= --interval): cluster the current Coef
+        if y_x is None and epoch >= gan_start:
+            Coef = CAE.coef().numpy()
+            y_x, _ = post_proC(thrC(Coef, alpha), n_class, k, post_alpha)
+        # eqn3
+        if epoch < args.enable_at or (args.model == 'resgan' and epoch == args.enable_at):
+            cost, Coef = CAE.partial_fit_eqn3(Img, args.lr)
+            interval = args.interval  # normal interval
+        # overtrain discriminator
+        elif args.model == 'gan5' and epoch == args.enable_at:
+            print('Initialize discriminator for {} steps'.format(args.D_init))
+            CAE.assign_u_parameter(Img, y_x)
+            for i in range(args.D_init):
+                CAE.partial_fit_disc(Img, y_x, args.lr2)
+            interval = args.interval  # normal interval
+        # eqn3plus
+        elif args.model == 'gan5':
+            for i in range(args.D_steps):
+                CAE.partial_fit_disc(Img, y_x, args.lr2)  # discriminator step discriminator
+            for i in range(args.G_steps):
+                cost, Coef = CAE.partial_fit_eqn3plus(Img, y_x, args.lr2)
+            interval = args.interval2  # GAN interval
+        # steps 1-5
+        else:
+            CAE.step1_assign_u(Img, y_x)
+            for i in range(args.k2):
+                for j in range(args.k1):
+                    CAE.step2_optimize_loss_u_combined(Img, y_x, args.lr2)
+                CAE.step3_optimize_loss_ae_combined(Img, y_x, args.lr2)
+            for i in range(args.D_steps):
+                CAE.step4_optimize_loss_disc(Img, y_x, args.lr2)
+            for i in range(args.G_steps):
+                cost, Coef = CAE.step5_optimize_loss_gen(Img, y_x, args.lr2)
+            interval = args.interval2  # GAN interval
+        # every interval epochs, perform clustering and evaluate accuracy
+        if epoch % interval == 0:
+            print("epoch: %.1d" % epoch, "cost: %.8f" % (cost / float(CAE.batch_size)))
+            t_begin = time.time()
+            Coef = thrC(Coef, alpha)
+            y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
+            if len(set(list(np.squeeze(y_x_new)))) == n_class:
+                y_x = y_x_new
+            else:
+                print('================================================')
+                print('Warning: clustering produced empty clusters')
+                print('================================================')
+            missrate_x = err_rate(Label, y_x)
+            t_end = time.time()
+            acc_x = 1 - missrate_x
+            print("accuracy: {}".format(acc_x))
+            print('post processing time: {}'.format(t_end - t_begin))
+            CAE.log_accuracy(acc_x)
+
+    print("{} subjects, accuracy: {}".format(n_class, acc_x))
+
+    return (1 - acc_x), (1 - acc_x)
+
+
+def prepare_data_YaleB(folder):
+    # load face images and labels
+    mat = sio.loadmat(os.path.join(folder, args.matfile or 'YaleBCrop025.mat'))
+    img = mat['Y']
+
+    # Reorganize data a bit, put images into Img, and labels into Label
+    I = []
+    Label = []
+    for i in range(img.shape[2]):  # i-th subject
+        for j in range(img.shape[1]):  # j-th picture of i-th subject
+            temp = np.reshape(img[:, j, i], [42, 48])
+            Label.append(i)
+            I.append(temp)
+    I = np.array(I)
+    Label = np.array(Label[:])
+    Img = np.transpose(I, [0, 2, 1])
+    Img = np.expand_dims(Img[:], 3)
+
+    # constants
+    n_input = [48, 42]
+    n_hidden = [10, 20, 30]
+    kernel_size = [5, 3, 3]
+    n_sample_perclass = 64
+    disc_size = [200, 50, 1]
+    # tunable numbers
+    k = 10
+    post_alpha = 3.5
+
+    all_subjects = [38]  # number of subjects to use in experiment
+    model_path = os.path.join(folder, 'model-102030-48x42-yaleb.ckpt')
+    return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
+
+
+def prepare_data_orl(folder):
+    mat = sio.loadmat(os.path.join(folder, args.matfile or 'ORL2fea.mat'))
+    Label = mat['label'].reshape(400).astype(np.int32)
+    Img = mat['fea'].reshape(400, 32, 32, 1) * 100
+
+    # constants
+    n_input = [32, 32]
+    n_hidden = [5, 3, 3]
+    kernel_size = [5, 3, 3]
+    n_sample_perclass = 10
+    disc_size = [200, 50, 1]
+    # tunable numbers
+    k = 3  # svds parameter
+    post_alpha = 3.5  # Laplacian parameter
+
+    all_subjects = [40]
+    model_path = os.path.join(folder, 'model-533-32x32-orl-ckpt')
+    return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
+
+
+def prepare_data_coil20(folder):
+    mat = sio.loadmat(os.path.join(folder, args.matfile or 'COIL20RRstd.mat'))
+    Label = mat['label'].reshape(-1).astype(np.int32)  # 1440
+    Img = mat['fea'].reshape(-1, 32, 32, 1)
+
+    # constants
+    n_input = [32, 32]
+    n_hidden = [15]
+    kernel_size = args.kernel_size or [3]
+    n_sample_perclass = Img.shape[0] // 20
+    disc_size = [50, 1]
+    # tunable numbers
+    k = 10  # svds parameter
+    post_alpha = 3.5  # Laplacian parameter
+
+    all_subjects = [20]
+    model_path = os.path.join(folder, 'model-3-32x32-coil20-ckpt')
+    return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
+
+
+def prepare_data_coil100(folder):
+    mat = sio.loadmat(os.path.join(folder, args.matfile or 'COLT100fea2fea.mat'))
+    Label = mat['label'].reshape(-1).astype(np.int32)  # 1440
+    Img = mat['fea'].reshape(-1, 32, 32, 1)
+
+    # constants
+    n_input = [32, 32]
+    n_hidden = [50]
+    kernel_size = [5]
+    n_sample_perclass = Img.shape[0] // 100
+    disc_size = [50, 1]
+    # tunable numbers
+    k = 10  # svds parameter
+    post_alpha = 3.5  # Laplacian parameter
+
+    all_subjects = [100]
+    model_path = os.path.join(folder, 'model-5-32x32-coil100-ckpt')
+    return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
+
+
+def prepare_data_synthetic(folder):
+    # K random subspaces, see synthetic.py
+    return synthetic.prepare_data(folder, args)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    svd_backend.configure(args)
+    spectral.configure(args)
+    assert args.name is not None and args.name != '', 'name of experiment must be specified'
+
+    # prepare data
+    folder = os.path.dirname(os.path.abspath(__file__))
+    preparation_funcs = {
+        'yaleb': prepare_data_YaleB,
+        'orl': prepare_data_orl,
+        'coil20': prepare_data_coil20,
+        'coil100': prepare_data_coil100,
+        'synthetic': prepare_data_synthetic}
+    assert args.dataset in preparation_funcs
+    Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path = \
+            preparation_funcs[args.dataset](folder)
+    Img = (Img * args.imgmult).astype(np.float32)
+    post_alpha = args.palpha or post_alpha
+    logs_path = os.path.join(folder, 'logs', args.name)
+    restore_path = model_path
+    Model = ResConvAE if args.model == 'resgan' else ConvAE
+
+    # arrays for logging results
+    avg = []
+    med = []
+
+    # for each experiment setting, perform one loop
+    for n_class in all_subjects:
+        batch_size = n_class * n_sample_perclass
+
+        t_begin = time.time()
+        CAE = Model(
+            args,
+            n_input, n_hidden, kernel_size, n_class, n_sample_perclass, disc_size,
+            args.lambda1, args.lambda2, args.lambda3, batch_size, r=args.r, rank=args.rank,
+            lambda4=args.lambda4, disc_bound=args.bound,
+            model_path=model_path, restore_path=restore_path, logs_path=logs_path, jit_compile=not args.no_xla)
+        print('model built in {:.1f}s, steps are compiled on their first call'.format(time.time() - t_begin))
+
+        # perform optimization
+        avg_i, med_i = reinit_and_optimize(args, Img, Label, CAE, n_class, k=k, post_alpha=post_alpha)
+        # add result to list
+        avg.append(avg_i)
+        med.append(med_i)
+
+    # report results for all experiments
+    for i, n_class in enumerate(all_subjects):
+        print('%d subjects:' % n_class)
+        print('Mean: %.4f%%' % (avg[i] * 100), 'Median: %.4f%%' % (med[i] * 100))
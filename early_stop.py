@@ -0,0 +1,104 @@
+"""
+Early stopping for the fine-tuning loops, without ground truth
+
+The fine-tuning loops run a fixed number of epochs (up to 4000) and cluster every interval epochs.
+EarlyStopping looks at three signals between consecutive evaluations, none of them uses Label:
+    labels: adjusted Rand index between the previous and the current y_x, the clustering has stopped
+            moving when it stays above --es-ari
+    loss  : relative change of the reconstruction cost, a plateau when it stays below --es-loss-tol
+    coef  : ||Coef - previous Coef||_F / ||previous Coef||_F, settled below --es-coef-tol
+An evaluation counts as converged when all the signals in --es-signals agree, and after --es-patience
+converged evaluations in a row the loop moves on: from the self-expression phase to the GAN phase (which
+then starts at the next epoch instead of --enable-at), or out of the GAN phase, ending the run. Every
+evaluation's signals and the reason for each switch or stop are kept and saved as JSON with the logs.
+"""
+import json
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import norm as sparse_norm
+from sklearn.metrics import adjusted_rand_score
+
+
+signal_names = ['labels', 'loss', 'coef']
+
+
+def frobenius(C):
+    # the Coef of --knn is a scipy sparse matrix
+    return sparse_norm(C) if sparse.issparse(C) else np.linalg.norm(C)
+
+
+def add_arguments(parser):
+    # options of EarlyStopping, see the module docstring
+    parser.add_argument('--early-stop',     action='store_true')            # switch phase and stop once the run has converged
+    parser.add_argument('--es-patience',    type=int,   default=3)          # converged evaluations in a row needed
+    parser.add_argument('--es-ari',         type=float, default=0.99)       # ARI between consecutive y_x that counts as stable labels
+    parser.add_argument('--es-loss-tol',    type=float, default=1e-3)       # relative cost change between evaluations that counts as a plateau
+    parser.add_argument('--es-coef-tol',    type=float, default=1e-2)       # relative Frobenius change of Coef that counts as settled
+    parser.add_argument('--es-signals',     nargs='+',  default=signal_names, choices=signal_names)
+
+
+class EarlyStopping(object):
+    def __init__(self, patience=3, ari=0.99, loss_tol=1e-3, coef_tol=1e-2, signals=signal_names):
+        self.patience = patience
+        self.ari = ari
+        self.loss_tol = loss_tol
+        self.coef_tol = coef_tol
+        self.signals = list(signals)
+        self.history = []   # signals of every evaluation
+        self.events = []    # (epoch, 'switch' or 'stop', reason)
+        self.reset()
+
+    def reset(self):
+        # a new phase starts from scratch, its first evaluation has nothing to compare with
+        self.previous = None
+        self.streak = 0
+
+    def update(self, epoch, y_x, cost, Coef):
+        """
+        records the evaluation at epoch, returns True once the last `patience` evaluations converged; never
+        for an evaluation without a previous one to compare with, so patience 0 stops at the first converged one
+        """
+        y_x = np.squeeze(y_x)
+        record = {'epoch': epoch, 'converged': False}
+        if self.previous is not None:
+            y_prev, cost_prev, Coef_prev = self.previous
+            record['ari'] = float(adjusted_rand_score(y_prev, y_x))
+            record['loss_change'] = float(abs(cost - cost_prev) / max(abs(cost_prev), 1e-12))
+            record['coef_change'] = float(frobenius(Coef - Coef_prev) / max(frobenius(Coef_prev), 1e-12))
+            checks = {'labels': record['ari'] >= self.ari,
+                      'loss': record['loss_change'] < self.loss_tol,
+                      'coef': record['coef_change'] < self.coef_tol}
+            record['converged'] = all([checks[s] for s in self.signals])
+        self.streak = self.streak + 1 if record['converged'] else 0
+        self.history.append(record)
+        self.previous = (y_x.copy(), cost, Coef.copy())
+        return record['converged'] and self.streak >= self.patience
+
+    def reason(self):
+        last = self.history[-1]
+        values = {'labels': 'ARI {:.4f}'.format(last['ari']),
+                  'loss': 'cost change {:.2e}'.format(last['loss_change']),
+                  'coef': 'Coef change {:.2e}'.format(last['coef_change'])}
+        return '{} converged evaluations in a row, last {}'.format(
+            self.streak, ', '.join([values[s] for s in self.signals]))
+
+    def record(self, epoch, action):
+        """
+        notes that the loop switches phase ('switch') or stops ('stop') at epoch, returns the reason
+        """
+        reason = self.reason()
+        self.events.append((epoch, action, reason))
+        self.reset()
+        return reason
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'events': [{'epoch': e, 'action': a, 'reason': r} for e, a, r in self.events],
+                       'history': self.history}, f, indent=1)
+
+
+def make_early_stopping(args):
+    # None without --early-stop, the loops then run all their epochs
+    if not args.early_stop:
+        return None
+    return EarlyStopping(args.es_patience, args.es_ari, args.es_loss_tol, args.es_coef_tol, args.es_signals)
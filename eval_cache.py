@@ -0,0 +1,104 @@
+"""
+Evaluation cache for the fine-tuning loops
+
+In the GAN phase the loops cluster every --interval2 epochs (every epoch by default), and post_proC (SVD,
+affinity, spectral clustering) is most of an epoch's time, even when thrC(Coef) has barely moved since
+the last evaluation and the labels come out the same. EvaluationCache.evaluate() sits in front of it:
+    exact hit: the thresholded Coef has the same fingerprint as the one the cached labels were computed
+               from: the same support (nonzero pattern) and the same values after dividing by the largest
+               |entry| and rounding to --cache-decimals decimals. post_proC is invariant to the scale of
+               Coef, so the labels are reused as they are
+    near hit : with --cache-tol t > 0, ||Coef - reference||_F / ||reference||_F < t against the Coef the
+               cached labels were computed from, so a slow drift still re-clusters once it adds up
+    miss     : post_proC runs and its labels and Coef become the new reference
+Hits, near hits, misses and the seconds post_proC took on the misses are kept in `stats`; summary()
+prints them with an estimate of the time saved, and save() writes them as JSON with the logs.
+"""
+import hashlib
+import json
+import time
+import numpy as np
+from scipy import sparse
+from early_stop import frobenius
+
+
+def add_arguments(parser):
+    # options of EvaluationCache, see the module docstring
+    parser.add_argument('--eval-cache',     action='store_true')            # reuse the last labels while thrC(Coef) stays the same
+    parser.add_argument('--cache-decimals', type=int,   default=4)          # decimals of the relative values in the fingerprint
+    parser.add_argument('--cache-tol',      type=float, default=0.0)        # relative Frobenius change still counted as a hit, 0 exact hits only
+
+
+def fingerprint(C, decimals=4):
+    """
+    hash of the support of C (dense or scipy sparse) and of its values relative to the largest |entry|,
+    rounded to `decimals` decimals
+    """
+    digest = hashlib.sha1()
+    if sparse.issparse(C):
+        C = C.tocsr()
+        C.eliminate_zeros()
+        C.sort_indices()
+        digest.update(np.asarray(C.shape, np.int64).tobytes())
+        digest.update(C.indptr.astype(np.int64).tobytes())
+        digest.update(C.indices.astype(np.int64).tobytes())
+        values = C.data
+    else:
+        C = np.asarray(C)
+        support = C != 0
+        digest.update(np.asarray(C.shape, np.int64).tobytes())
+        digest.update(np.packbits(support).tobytes())
+        values = C[support]
+    scale = np.abs(values).max() if values.size else 1.0
+    digest.update(np.round(values / scale * 10 ** decimals).astype(np.int64).tobytes())
+    return digest.hexdigest()
+
+
+class EvaluationCache(object):
+    def __init__(self, decimals=4, tol=0.0):
+        self.decimals = decimals
+        self.tol = tol
+        self.stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'miss_seconds': 0.0, 'lookup_seconds': 0.0}
+        self.key = None         # fingerprint of the reference Coef
+        self.reference = None   # the Coef the cached labels were computed from
+        self.labels = None
+
+    def evaluate(self, Coef, cluster):
+        """
+        labels of the thresholded Coef: the cached ones on a hit, cluster(Coef) otherwise
+        """
+        t_begin = time.time()
+        key = fingerprint(Coef, self.decimals)
+        hit = 'hits' if key == self.key else None
+        if hit is None and self.tol > 0 and self.reference is not None and Coef.shape == self.reference.shape:
+            change = frobenius(Coef - self.reference) / max(frobenius(self.reference), 1e-12)
+            hit = 'near_hits' if change < self.tol else None
+        self.stats['lookup_seconds'] += time.time() - t_begin
+        if hit is not None:
+            self.stats[hit] += 1
+            return self.labels
+        t_begin = time.time()
+        self.labels = cluster(Coef)
+        self.stats['misses'] += 1
+        self.stats['miss_seconds'] += time.time() - t_begin
+        self.key = key
+        self.reference = Coef.copy()
+        return self.labels
+
+    def summary(self):
+        s = self.stats
+        hits = s['hits'] + s['near_hits']
+        saved = hits * s['miss_seconds'] / max(s['misses'], 1)
+        return 'evaluation cache: {} hits ({} exact, {} near), {} misses, ~{:.1f}s of post_proC saved, {:.2f}s in lookups'.format(
+            hits, s['hits'], s['near_hits'], s['misses'], saved, s['lookup_seconds'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.stats, f, indent=1, sort_keys=True)
+
+
+def make_eval_cache(args):
+    # None without --eval-cache, the loops then run post_proC at every evaluation
+    if not args.eval_cache:
+        return None
+    return EvaluationCache(args.cache_decimals, args.cache_tol)
@@ -0,0 +1,103 @@
+"""
+Adaptive evaluation interval for the fine-tuning loops
+
+The loops cluster every --interval epochs in the self-expression phase and every --interval2 epochs in
+the GAN phase, and the README runs use --interval2 1: every GAN epoch pays for post_proC even while the
+labels no longer move. With --adaptive-eval, AdaptiveSchedule decides when the next evaluation is due:
+    - the phase's interval (--interval or --interval2) is the shortest one, and the starting point
+    - after an evaluation whose y_x has an adjusted Rand index of at least --eval-ari to the previous one
+      (the stability signal of early_stop.py) the interval is multiplied by --eval-growth, up to
+      --eval-max-interval; a changing y_x resets it to the phase's interval
+    - --eval-budget b keeps the evaluations at no more than a fraction b of the loop's time: from the
+      mean seconds of an evaluation and of a training epoch so far, the interval is at least the number
+      of epochs that pays for one evaluation within the budget, --eval-max-interval notwithstanding
+    - the last epoch of the run, and the epoch before the GAN phase starts, are always evaluated, so the
+      final accuracy and the labels the discriminator is initialized with are current
+Ground truth accuracy is computed and logged at every evaluation, as before. Every evaluation's epoch,
+ARI, seconds and the interval chosen after it are kept, summary() prints them in short and save() writes
+them as JSON with the logs.
+"""
+import json
+import math
+import time
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+
+def add_arguments(parser):
+    # options of AdaptiveSchedule, see the module docstring
+    parser.add_argument('--adaptive-eval',      action='store_true')            # back off the evaluations while y_x is stable
+    parser.add_argument('--eval-max-interval',  type=int,   default=64)         # longest interval the back-off reaches
+    parser.add_argument('--eval-ari',           type=float, default=0.99)       # ARI between consecutive y_x that counts as stable
+    parser.add_argument('--eval-growth',        type=float, default=2.0)        # factor the interval grows by per stable evaluation
+    parser.add_argument('--eval-budget',        type=float, default=None)       # largest fraction of the loop's time spent evaluating
+
+
+class AdaptiveSchedule(object):
+    def __init__(self, max_interval=64, ari=0.99, growth=2.0, budget=None):
+        self.max_interval = max_interval
+        self.ari = ari
+        self.growth = growth
+        self.budget = budget
+        self.base = None        # interval of the current phase
+        self.interval = None    # epochs between the last evaluation and the next one
+        self.last = 0           # epoch of the last evaluation
+        self.previous = None    # its y_x
+        self.eval_seconds = 0.0
+        self.t_start = None     # the first call of due(), the fine-tuning loop's start
+        self.history = []
+
+    def due(self, epoch, interval, force=False):
+        """
+        True if the loop should evaluate at epoch; interval is the phase's --interval or --interval2, and
+        a new one starts the back-off from scratch. force evaluates regardless
+        """
+        if self.t_start is None:
+            self.t_start = time.time()
+        if interval != self.base:
+            self.base = self.interval = interval
+        return force or epoch - self.last >= self.interval
+
+    def budget_interval(self, epoch):
+        # epochs of training one evaluation needs next to it to stay within the budget
+        if not self.budget or not self.history:
+            return 1
+        eval_mean = self.eval_seconds / len(self.history)
+        epoch_mean = max(time.time() - self.t_start - self.eval_seconds, 1e-6) / max(epoch, 1)
+        return int(math.ceil(eval_mean * (1 - self.budget) / (self.budget * epoch_mean)))
+
+    def update(self, epoch, y_x, seconds):
+        """
+        records the evaluation at epoch, which took seconds and gave y_x, and chooses the next interval
+        """
+        y_x = np.squeeze(y_x)
+        record = {'epoch': epoch, 'seconds': seconds}
+        if self.previous is not None:
+            record['ari'] = float(adjusted_rand_score(self.previous, y_x))
+            if record['ari'] >= self.ari:
+                self.interval = min(int(math.ceil(self.interval * self.growth)), max(self.max_interval, self.base))
+            else:
+                self.interval = self.base
+        self.eval_seconds += seconds
+        self.history.append(record)
+        self.interval = max(self.interval, self.budget_interval(epoch))
+        record['interval'] = self.interval
+        self.last = epoch
+        self.previous = y_x.copy()
+        return self.interval
+
+    def summary(self):
+        total = time.time() - (self.t_start or time.time())
+        return 'adaptive evaluation: {} evaluations, {:.1f}s of {:.1f}s ({:.0%}) spent evaluating, last interval {}'.format(
+            len(self.history), self.eval_seconds, total, self.eval_seconds / max(total, 1e-12), self.interval)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'history': self.history}, f, indent=1)
+
+
+def make_schedule(args):
+    # None without --adaptive-eval, the loops then evaluate every --interval / --interval2 epochs
+    if not args.adaptive_eval:
+        return None
+    return AdaptiveSchedule(args.eval_max_interval, args.eval_ari, args.eval_growth, args.eval_budget)
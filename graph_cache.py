@@ -0,0 +1,127 @@
+"""
+MetaGraph cache for ConvAE
+
+Building the GAN variants of ConvAE for many classes creates thousands of per-class ops and several Adam
+optimizers in Python, which takes minutes at K=100 before the first step. GraphCache exports the built
+graph once as a MetaGraph, under a key hashed from everything that shapes the graph, and later runs
+import it instead of building it. The Python attributes of the model that point into the graph (tensors,
+ops, variables and lists of them, plus plain numbers) are saved in a manifest next to the MetaGraph and
+rebound on load, so the rest of the class works unchanged.
+"""
+import hashlib
+import json
+import os
+import tensorflow as tf
+
+
+# options that only affect the training loop, data or logging, never the graph
+run_only = ['name', 'epochs', 'enable_at', 'interval', 'interval2', 'D_init', 'D_steps', 'G_steps', 'lr', 'lr2',
+            'pretrain', 'save', 'dataset', 'matfile', 'imgmult', 'palpha', 'alpha', 'profile', 'trace_every',
+            'graph_cache', 'k1', 'k2', 'intra_threads', 'inter_threads', 'blas_threads', 'train_cores', 'eval_cores',
+            'early_stop', 'es_patience', 'es_ari', 'es_loss_tol', 'es_coef_tol', 'es_signals']
+
+# plain values the manifest stores as they are, py2's unicode and long included
+try:
+    scalar_types = (bool, int, long, float, str, unicode)
+except NameError:
+    scalar_types = (bool, int, float, str)
+
+
+def config_key(source_path, args, *values):
+    """
+    hash of the script source, the TensorFlow version, the graph-shaping options in args and any further
+    values (layer sizes, batch size, ...) that the graph depends on
+    """
+    if source_path.endswith('.pyc'):
+        source_path = source_path[:-1]
+    with open(source_path, 'rb') as f:
+        source = f.read()
+    options = dict((k, v) for k, v in vars(args).items() if k not in run_only and not k.startswith('synth_'))
+    config = json.dumps([tf.__version__, options, values], sort_keys=True, default=str)
+    digest = hashlib.sha1(source)
+    digest.update(config.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def describe(value):
+    # JSON reference to a graph object (or a list of them), None for anything the manifest can't hold
+    if isinstance(value, tf.Variable):
+        return {'variable': value.name}
+    if isinstance(value, tf.Tensor):
+        return {'tensor': value.name}
+    if isinstance(value, tf.Operation):
+        return {'operation': value.name}
+    if isinstance(value, tf.TensorShape):
+        return {'shape': None if value.ndims is None else value.as_list()}
+    if isinstance(value, (list, tuple)):
+        items = [describe(v) for v in value]
+        if any([item is None for item in items]):
+            return None
+        return {'tuple' if isinstance(value, tuple) else 'list': items}
+    if isinstance(value, scalar_types):
+        return {'value': value}
+    return None
+
+
+def resolve(ref, graph, variables):
+    if 'variable' in ref:
+        return variables[ref['variable']]
+    if 'tensor' in ref:
+        return graph.get_tensor_by_name(ref['tensor'])
+    if 'operation' in ref:
+        return graph.get_operation_by_name(ref['operation'])
+    if 'shape' in ref:
+        return tf.TensorShape(ref['shape'])
+    if 'list' in ref:
+        return [resolve(item, graph, variables) for item in ref['list']]
+    if 'tuple' in ref:
+        return tuple(resolve(item, graph, variables) for item in ref['tuple'])
+    return ref['value']
+
+
+class GraphCache(object):
+    def __init__(self, folder, key):
+        self.path = os.path.join(folder, key)
+        self.meta_path = os.path.join(self.path, 'graph.meta')
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+
+    def exists(self):
+        return os.path.exists(self.meta_path) and os.path.exists(self.manifest_path)
+
+    def save(self, model, exclude=()):
+        """
+        export the default graph and the graph-valued attributes of model, except those named in exclude
+        (the ones set before the graph was built)
+        """
+        manifest = {}
+        skipped = []
+        for name, value in vars(model).items():
+            if name in exclude:
+                continue
+            ref = describe(value)
+            if ref is None:
+                skipped.append(name)
+            else:
+                manifest[name] = ref
+        if skipped:
+            print('graph cache: not caching attributes {}, they will be missing after a load'.format(sorted(skipped)))
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        tf.train.export_meta_graph(filename=self.meta_path + '.tmp', clear_devices=True)
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        # rename last, so an interrupted save never looks like a valid cache entry
+        os.rename(self.meta_path + '.tmp', self.meta_path)
+        os.rename(self.manifest_path + '.tmp', self.manifest_path)
+
+    def load(self, model):
+        # replaces the default graph by the cached one, ops created before (e.g. the regularizer's scale)
+        # would otherwise clash with the imported names; then sets the cached attributes on model
+        tf.reset_default_graph()
+        tf.train.import_meta_graph(self.meta_path, clear_devices=True)
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        graph = tf.get_default_graph()
+        variables = dict((v.name, v) for v in tf.global_variables())
+        for name, ref in manifest.items():
+            setattr(model, name, resolve(ref, graph, variables))
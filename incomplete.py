@@ -2,11 +2,10 @@ import tensorflow as tf
 import numpy as np
 from tensorflow.contrib import layers
 import scipy.io as sio
-from scipy.sparse.linalg import svds
+from scipy import sparse
 # from skcuda.linalg import svd as svd_cuda
 # import pycuda.gpuarray as gpuarray
 # from pycuda.tools import DeviceMemoryPool
-from sklearn import cluster
 from sklearn.preprocessing import normalize
 from munkres import Munkres
 import os
@@ -14,6 +13,14 @@ import time
 import argparse
 from functools import reduce
 import pdb
+import masks
+import pipeline
+import synthetic
+import cpu
+import selfexpress
+import svd_backend
+import spectral
+import affinity
 
 parser = argparse.ArgumentParser()
 parser.add_argument('name')
@@ -23,13 +30,14 @@ parser.add_argument('--lambda2', type=float, default=0.20)  # sparsity cost on C
 parser.add_argument('--lambda3', type=float, default=1.0)   # lambda on k-means
 parser.add_argument('--lambda4', type=float, default=0.000001)# lambda on AE L2 regularization
 parser.add_argument('--hardness',type=float, default=1.0)   # hardness on k-means
+parser.add_argument('--kmeans-init', type=str, default='labels', choices=['labels', 'kmeans++'])  # k-means centroid seeding
 
 parser.add_argument('--lr',  type=float, default=1e-3)  # learning rate
 
 parser.add_argument('--pretrain', type=int, default=0)  # number of iterations of pretraining
 parser.add_argument('--epochs', type=int, default=500)  # number of epochs to train on eqn3 and eqn3
 parser.add_argument('--epochs2',type=int, default=500)  # number of epochs to train on eqn3 and eqn3plus
-parser.add_argument('--dataset', type=str, default='orl', choices=['yaleb', 'orl', 'coil20', 'coil100'])
+parser.add_argument('--dataset', type=str, default='orl', choices=['yaleb', 'orl', 'coil20', 'coil100', 'synthetic'])
 parser.add_argument('--interval', type=int, default=100)
 parser.add_argument('--save', action='store_true')  # save pretrained model
 
@@ -42,6 +50,17 @@ parser.add_argument('--imgmult',        type=float,     default=1.0)
 parser.add_argument('--palpha',         type=float,     default=None)
 parser.add_argument('--kernel-size',    type=int,       nargs='+',  default=None)
 
+parser.add_argument('--occlusion',      type=str,       default='pixel', choices=sorted(masks.occlusion_funcs))
+parser.add_argument('--missing-rate',   type=float,     nargs='+',  default=[0.01])  # several values run a sweep
+parser.add_argument('--mask-seed',      type=int,       default=0)
+parser.add_argument('--coef-prox',      action='store_true')            # proximal L1 steps on Coef, soft thresholding sets entries to exactly 0
+parser.add_argument('--prox-step',      type=float,     default=0.01)   # --coef-prox step size, relative to 1/(lambda2 ||z||_F^2)
+parser.add_argument('--prox-settle',    type=int,       default=20)     # steps without a change of Coef's zero pattern before it is returned sparse
+synthetic.add_arguments(parser)      # --synth-* options of --dataset synthetic
+cpu.add_arguments(parser)            # --*-threads and --*-cores of the CPU execution profile
+svd_backend.add_arguments(parser)    # --svd backend of post_proC, see svd_backend.py
+spectral.add_arguments(parser)       # --spectral clustering of post_proC, see spectral.py
+
 
 
 """
@@ -58,7 +77,7 @@ class ConvAE(object):
                  args,
                  n_input, n_hidden, kernel_size, n_class, n_sample_perclass, 
                  lambda1, lambda2, lambda3, batch_size, hardness,
-                 reg=None,
+                 reg=None, mask_mode='missing',
                  model_path=None, restore_path=None,
                  logs_path='logs'):
         self.args = args
@@ -71,18 +90,28 @@ class ConvAE(object):
         self.reg = reg
         self.model_path = model_path
         self.restore_path = restore_path
+        self.mask_mode = mask_mode
         self.iter = 0
+        self.train_time = 0.0
+        self.coef_prox = args.coef_prox
+        self.prox_settle = args.prox_settle
+        self.settled = 0            # --coef-prox steps since the zero pattern of Coef last changed
+        self.coef_index = None      # nonzero (row, col) of Coef once the pattern has settled, see fit_prox
 
         """
         Shared
 
         x           spatial input
-        mask        spatial mask
+        mask_idx    flat indices into x of the missing (or observed, see mask_mode) entries
         latent      spatial code
         """
         # input required to be fed
         self.x    = tf.placeholder(tf.float32, [None, n_input[0], n_input[1], 1], name='X')
-        self.mask = tf.placeholder(tf.float32, self.x.shape, name='mask')
+        # indices for the full batch live in the graph and are set once by set_mask, mini-batches feed their own
+        self.mask_idx_full = tf.Variable(tf.zeros([0], tf.int32), trainable=False, validate_shape=False, name='mask_idx')
+        self.mask_idx_init = tf.placeholder(tf.int32, [None])
+        self.mask_idx_assign = tf.assign(self.mask_idx_full, self.mask_idx_init, validate_shape=False)
+        self.mask_idx = tf.placeholder_with_default(self.mask_idx_full.read_value(), [None], name='mask_idx_batch')
         self.learning_rate = tf.placeholder(tf.float32, [])
 
         # run input through encoder, latent is the output, shape is the shape of encoder
@@ -97,7 +126,7 @@ class ConvAE(object):
         # create decoder with latent
         self.x_r_pre = self.decoder(latent, shape, reuse=False)
         diff_pre = tf.subtract(self.x_r_pre, self.x)
-        self.loss_recon_pre = 0.5 * tf.reduce_sum(tf.pow(diff_pre * self.mask, 2.0))
+        self.loss_recon_pre = self.masked_loss(diff_pre)
 
         ae_weights = [v for v in tf.trainable_variables() if (v.name.startswith('enc') or v.name.startswith('dec'))]
 
@@ -137,12 +166,21 @@ class ConvAE(object):
         Eqn3
         """
         diff = tf.subtract(self.x_r, self.x)
-        self.loss_recon = 0.5 * tf.reduce_sum(tf.pow(diff * self.mask, 2.0))
+        self.loss_recon = self.masked_loss(diff)
         self.loss_sparsity = tf.reduce_sum(tf.abs(self.Coef))
         self.loss_selfexpress = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0))
         self.loss_eqn3 = self.loss_recon + lambda1 * self.loss_sparsity + lambda2 * self.loss_selfexpress + self.loss_aereg
+        if args.coef_prox:
+            # everything but the L1 term, which the proximal step on Coef handles
+            self.loss_eqn3_smooth = self.loss_recon + lambda2 * self.loss_selfexpress + self.loss_aereg
+            self.coef_support = tf.Variable(tf.ones([batch_size, batch_size], tf.bool), trainable=False, name='support')
+            self.coef_index_feed = tf.placeholder(tf.int64, [None, 2])
+            self.coef_values = tf.gather_nd(Coef, self.coef_index_feed)
         with tf.variable_scope('optimizer_eqn3'):
-            self.optimizer_eqn3 = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss_eqn3, var_list=eqn3_weights)
+            if args.coef_prox:
+                self.optimizer_eqn3, self.changes_eqn3 = self.proximal_optimizer(self.loss_eqn3_smooth, ae_weights, z, lambda1, lambda2)
+            else:
+                self.optimizer_eqn3 = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss_eqn3, var_list=eqn3_weights)
 
         """
         Eqn3+
@@ -155,7 +193,11 @@ class ConvAE(object):
         self.loss_eqn3plus = self.loss_eqn3 + lambda3 * self.loss_kmeans
         eqn3plus_weights = eqn3_weights + [kmeans_weight]
         with tf.variable_scope('optimizer_eqn3plus'):
-            self.optimizer_eqn3plus = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss_eqn3plus, var_list=eqn3plus_weights)
+            if args.coef_prox:
+                self.optimizer_eqn3plus, self.changes_eqn3plus = self.proximal_optimizer(
+                    self.loss_eqn3_smooth + lambda3 * self.loss_kmeans, ae_weights + [kmeans_weight], z, lambda1, lambda2)
+            else:
+                self.optimizer_eqn3plus = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss_eqn3plus, var_list=eqn3plus_weights)
 
         # finalize stuffs
         self.ae_weight_norm = tf.sqrt(sum([tf.norm(v, 2) ** 2 for v in ae_weights]))
@@ -172,11 +214,25 @@ class ConvAE(object):
         config = tf.ConfigProto()
         #config.gpu_options.allow_growth = True  # stop TF from eating up all GPU RAM
         #config.gpu_options.per_process_gpu_memory_fraction = 0.4
+        self.cpu = cpu.CPUProfile(args)  # thread pools and cores of the session and of post_proC
+        self.cpu.configure(config)
         self.sess = tf.InteractiveSession(config=config)
         self.sess.run(self.init)
         self.saver = tf.train.Saver([v for v in ae_weights if v.name.startswith('enc_w') or v.name.startswith('dec_w')])
         self.summary_writer = tf.summary.FileWriter(logs_path, graph=tf.get_default_graph(), flush_secs=20)
 
+    def proximal_optimizer(self, loss_smooth, weights, z, lambda1, lambda2):
+        """
+        --coef-prox: Adam on weights and a proximal L1 step on Coef, both from the gradients of loss_smooth
+        at the same point; returns the training op and the count of Coef entries whose zero pattern changed
+        """
+        grads = tf.gradients(loss_smooth, [self.Coef] + weights)
+        with tf.control_dependencies(grads):
+            adam = tf.train.AdamOptimizer(learning_rate=self.learning_rate).apply_gradients(zip(grads[1:], weights))
+            prox, changes = selfexpress.proximal_l1_step(self.Coef, self.coef_support, grads[0], z, lambda1, lambda2,
+                                                         self.args.prox_step)
+        return tf.group(adam, prox), changes
+
     # Building the encoder
     def encoder(self, x):
         shapes = []
@@ -213,46 +269,103 @@ class ConvAE(object):
                 input = dec_i
         return input
 
+    def masked_loss(self, diff):
+        # 0.5 * squared error over the observed entries, gathering only the shorter of the two index lists
+        sqr = tf.pow(diff, 2.0)
+        picked = tf.reduce_sum(tf.gather(tf.reshape(sqr, [-1]), self.mask_idx))
+        if self.mask_mode == 'observed':
+            return 0.5 * picked
+        return 0.5 * (tf.reduce_sum(sqr) - picked)
+
+    def set_mask(self, mask_idx):
+        # mask_idx: flat indices for the full batch, as returned by masks.MaskSet.index()
+        self.sess.run(self.mask_idx_assign, feed_dict={self.mask_idx_init: mask_idx})
+
     def kmeans(self, z, Coef, hardness):
         with tf.variable_scope('kmeans'):
             kmeans_weight = tf.get_variable('centroids', shape=[self.n_class, self.batch_size])
         self.kmeans_weight = kmeans_weight
-        ez = tf.expand_dims(Coef, 1)            # N, 1, N
-        ek = tf.expand_dims(kmeans_weight, 0)  # 1, K, N
-        diff = tf.pow(ez - ek, 2)               # N, K, N
-        sumdiff = tf.reduce_sum(diff, 2)        # N, K
+        # ||c - k||^2 = ||c||^2 - 2 c.k + ||k||^2, avoids materializing the N, K, N difference tensor
+        cc = tf.reduce_sum(tf.pow(Coef, 2), 1, keep_dims=True)                  # N, 1
+        kk = tf.reduce_sum(tf.pow(kmeans_weight, 2), 1)                         # K
+        ck = tf.matmul(Coef, kmeans_weight, transpose_b=True, name='matmul_Ck') # N, K
+        sumdiff = cc - 2.0 * ck + kk                                            # N, K
         membership = tf.nn.softmax(-sumdiff * hardness)
         return kmeans_weight, sumdiff, membership
 
-    def initialize_kmeans(self, Coef, y_x):
-        initval = np.zeros([self.n_class, self.batch_size])
-        for k in xrange(self.n_class):
-            indices = np.argwhere(y_x==k)
-            rows = Coef[indices]
-            print rows.shape
-            initval[k] = rows.mean(0)
+    def initialize_kmeans(self, Coef, y_x, seeding='labels'):
+        """
+        Coef   : N x N affinity, each row is a point to be clustered
+        y_x    : N vector of 0-based cluster labels, used when seeding='labels'
+        seeding: 'labels' takes the per-cluster mean of Coef rows, 'kmeans++' ignores y_x
+        """
+        if sparse.issparse(Coef):
+            Coef = Coef.toarray()  # from --coef-prox, the centroids are dense
+        if seeding == 'kmeans++':
+            initval = kmeans_pp_init(Coef, self.n_class)
+        else:
+            # one sparse KxN one-hot matrix times Coef sums the rows of each cluster in one pass
+            N = Coef.shape[0]
+            onehot = sparse.csr_matrix((np.ones(N), (y_x, np.arange(N))), shape=[self.n_class, N])
+            counts = np.asarray(onehot.sum(1))                      # K, 1
+            initval = onehot.dot(Coef) / np.maximum(counts, 1)      # empty clusters stay at 0
         self.sess.run([self.kmeans_assign_op], feed_dict={self.kmeans_init_weight: initval})
 
-    def partial_fit_eqn3(self, X, mask, lr):
-        # take a step on Eqn 3/4
-        cost, Coef, summary, _ = self.sess.run((self.loss_recon, self.Coef, self.summaryop_eqn3, self.optimizer_eqn3),
-                                               feed_dict={self.x: X, self.mask:mask, self.learning_rate: lr})
+    def fit_prox(self, X, lr, optimizer, changes, summaryop):
+        """
+        a --coef-prox step; Coef is returned dense until its zero pattern has not changed for prox_settle
+        steps, from then on as a sparse CSR matrix and only its entries on the pattern are fetched
+        """
+        cost, n_changed, summary, _ = self.sess.run([self.loss_recon, changes, summaryop, optimizer],
+                                                    feed_dict={self.x: X, self.learning_rate: lr})
+        self.settled = 0 if n_changed else self.settled + 1
+        if n_changed and self.coef_index is not None:
+            print('Coef zero pattern changed in {} entries, dense again'.format(n_changed))
+            self.coef_index = None
+        if self.coef_index is None:
+            Coef = self.sess.run(self.Coef)
+            # CSR only pays off for a sparse enough pattern, half the entries or less
+            if self.settled < self.prox_settle or np.count_nonzero(Coef) > Coef.size // 2:
+                return cost, Coef, summary
+            self.coef_index = np.argwhere(Coef != 0)
+            print('Coef zero pattern settled, {} nonzeros ({:.2%})'.format(len(self.coef_index), len(self.coef_index) / float(Coef.size)))
+        values = self.sess.run(self.coef_values, feed_dict={self.coef_index_feed: self.coef_index})
+        Coef = sparse.csr_matrix((values, (self.coef_index[:, 0], self.coef_index[:, 1])), shape=[self.batch_size] * 2)
+        return cost, Coef, summary
+
+    def partial_fit_eqn3(self, X, lr):
+        # take a step on Eqn 3/4, masked by the indices given to set_mask
+        t_begin = time.time()
+        if self.coef_prox:
+            cost, Coef, summary = self.fit_prox(X, lr, self.optimizer_eqn3, self.changes_eqn3, self.summaryop_eqn3)
+        else:
+            cost, Coef, summary, _ = self.sess.run((self.loss_recon, self.Coef, self.summaryop_eqn3, self.optimizer_eqn3),
+                                                   feed_dict={self.x: X, self.learning_rate: lr})
+        self.train_time += time.time() - t_begin
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
         return cost, Coef
 
-    def partial_fit_eqn3plus(self, X, mask, lr):
+    def partial_fit_eqn3plus(self, X, lr):
         # assert y_x.min() == 0, 'y_x is 0-based'
-        cost, Coef, summary, _ = self.sess.run(
-            [self.loss_recon, self.Coef, self.summaryop_eqn3plus, self.optimizer_eqn3plus],
-            feed_dict={self.x: X, self.mask:mask, self.learning_rate: lr})
+        t_begin = time.time()
+        if self.coef_prox:
+            cost, Coef, summary = self.fit_prox(X, lr, self.optimizer_eqn3plus, self.changes_eqn3plus, self.summaryop_eqn3plus)
+        else:
+            cost, Coef, summary, _ = self.sess.run(
+                [self.loss_recon, self.Coef, self.summaryop_eqn3plus, self.optimizer_eqn3plus],
+                feed_dict={self.x: X, self.learning_rate: lr})
+        self.train_time += time.time() - t_begin
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
         return cost, Coef
 
-    def partial_fit_pretrain(self, X, mask, lr):
+    def partial_fit_pretrain(self, X, mask_idx, lr):
+        # mask_idx: flat indices into the mini-batch X, see masks.MaskSet.index(rows)
+        t_begin = time.time()
         cost, summary, _ = self.sess.run([self.loss_recon_pre, self.summaryop_pretrain, self.optimizer_pre],
-                feed_dict={self.x: X, self.mask:mask, self.learning_rate: lr})
+                feed_dict={self.x: X, self.mask_idx: mask_idx, self.learning_rate: lr})
+        self.train_time += time.time() - t_begin
         self.summary_writer.add_summary(summary, self.iter)
         self.iter += 1
         return cost
@@ -291,6 +404,25 @@ class ConvAE(object):
         return z
 
 
+def kmeans_pp_init(X, n_class, seed=None):
+    # k-means++ seeding over the rows of X, tracking each row's distance to its closest centroid
+    rng = np.random.RandomState(seed)
+    N = X.shape[0]
+    sqnorm = np.sum(X ** 2, 1)
+    centers = [rng.randint(N)]
+    mindist = np.maximum(sqnorm - 2 * X.dot(X[centers[0]]) + sqnorm[centers[0]], 0)
+    for _ in xrange(1, n_class):
+        total = mindist.sum()
+        if total > 0:
+            c = rng.choice(N, p=mindist / total)
+        else:
+            c = rng.randint(N)  # all points coincide with a centroid
+        centers.append(c)
+        dist = np.maximum(sqnorm - 2 * X.dot(X[c]) + sqnorm[c], 0)
+        mindist = np.minimum(mindist, dist)
+    return X[centers]
+
+
 def best_map(L1, L2):
     # L1 should be the groundtruth labels and L2 should be the clustering labels we got
     Label1 = np.unique(L1)
@@ -317,6 +449,8 @@ def best_map(L1, L2):
 
 
 def thrC(C, ro):
+    if sparse.issparse(C):
+        return affinity.thrC_sparse(C, ro)
     if ro < 1:
         N = C.shape[1]
         Cp = np.zeros((N, N))
@@ -324,6 +458,8 @@ def thrC(C, ro):
         Ind = np.argsort(-np.abs(C), axis=0)
         for i in range(N):
             cL1 = np.sum(S[:, i]).astype(float)
+            if cL1 == 0:
+                continue  # an all-zero column, e.g. from --coef-prox, stays zero
             stop = False
             csum = 0
             t = 0
@@ -339,40 +475,11 @@ def thrC(C, ro):
     return Cp
 
 
-def build_aff(C):
-    N = C.shape[0]
-    Cabs = np.abs(C)
-    ind = np.argsort(-Cabs, 0)
-    for i in range(N):
-        Cabs[:, i] = Cabs[:, i] / (Cabs[ind[0, i], i] + 1e-6)
-    Cksym = Cabs + Cabs.T;
-    return Cksym
-
-
-def spectral_cluster(L, n, eps=2.2 * 10 - 8):
-    """
-    L: Laplacian
-    n: number of clusters
-    Translates MATLAB code below:
-    N  = size(L, 1)
-    DN = diag( 1./sqrt(sum(L)+eps) );
-    LapN = speye(N) - DN * L * DN;
-    [~,~,vN] = svd(LapN);
-    kerN = vN(:,N-n+1:N);
-    normN = sum(kerN .^2, 2) .^.5;
-    kerNS = bsxfun(@rdivide, kerN, normN + eps);
-    groups = kmeans(kerNS,n,'maxiter',MAXiter,'replicates',REPlic,'EmptyAction','singleton');
-    """
-    N = L.shape[0]
-    DN = (1. / np.sqrt(L.sum(0) + eps))
-    LapN = np.eye(N) - DN * L * DN
-
-
 def post_proC(C, K, d, alpha):
     # C: coefficient matrix, K: number of clusters, d: dimension of each subspace
     C = 0.5 * (C + C.T)
     r = d * K + 1  # K=38, d=10
-    U, S, _ = svds(C, r, v0=np.ones(C.shape[0]))
+    U, S, _ = svd_backend.svds(C, r)
     # U, S, _ = svd_cuda(C, allocator=mem_pool)
     # take U and S from GPU
     # U = U[:, :r].get()
@@ -382,15 +489,13 @@ def post_proC(C, K, d, alpha):
     S = np.diag(S)
     U = U.dot(S)
     U = normalize(U, norm='l2', axis=1)
-    Z = U.dot(U.T)
-    #Z = Z * (Z > 0)
-    L = np.abs(np.abs(Z) ** alpha)
-    L = L / L.max()
-    L = 0.5 * (L + L.T)
-    spectral = cluster.SpectralClustering(n_clusters=K, eigen_solver='arpack', affinity='precomputed',
-                                          assign_labels='discretize')
-    spectral.fit(L)
-    grp = spectral.fit_predict(L)  # +1
+    kernel = affinity.kernel(alpha)
+    if spectral.settings['landmarks']:
+        # the same affinity, between the samples and the landmarks only
+        grp = spectral.landmark_cluster(U, K, kernel)
+        return grp, None
+    L = affinity.post_affinity(U, kernel)
+    grp = spectral.cluster(L, K)  # +1
     return grp, L
 
 
@@ -401,16 +506,11 @@ def err_rate(gt_s, s):
     return missrate
 
 
-def build_laplacian(C):
-    C = 0.5 * (np.abs(C) + np.abs(C.T))
-    W = np.sum(C, axis=0)
-    W = np.diag(1.0 / W)
-    L = W.dot(C)
-    return L
-
-
-def reinit_and_optimize(args, Img, Mask, Label, CAE, n_class, k=10, post_alpha=3.5, alpha = 0.1):
+def reinit_and_optimize(args, Img, Masks, Label, CAE, n_class, k=10, post_alpha=3.5, alpha = 0.1):
     """
+    Img  : images with their missing pixels already zeroed, see masks.MaskSet.apply
+    Masks: masks.MaskSet for Img
+
     1. pretrain
     2. train on eqn3
     3. initialize K-means
@@ -433,6 +533,7 @@ def reinit_and_optimize(args, Img, Mask, Label, CAE, n_class, k=10, post_alpha=3
 
     # init
     CAE.initlization()
+    CAE.set_mask(Masks.index(mode=CAE.mask_mode))
     bn=15
 
     ###
@@ -451,15 +552,17 @@ def reinit_and_optimize(args, Img, Mask, Label, CAE, n_class, k=10, post_alpha=3
             AE l2 norm   : 29
             Ae recon loss: 13372
         """
+        minibatch_size = 128
+        # shuffled mini-batches, with their mask indices, prepared in the background
+        batches = pipeline.BatchPrefetcher(Img, minibatch_size,
+                                           extra=lambda rows: Masks.index(rows, mode=CAE.mask_mode))
         for epoch in range(1, args.pretrain + 1):
-            minibatch_size = 128
-            indices = np.random.permutation(Img.shape[0])[:minibatch_size]
-            minibatch = Img[indices]  # pretrain with random mini-batch
-            mask      = Mask[indices]
-            cost = CAE.partial_fit_pretrain(minibatch, mask, args.lr) # FIXME provide mask
+            minibatch, _, mask_idx = next(batches)
+            cost = CAE.partial_fit_pretrain(minibatch, mask_idx, args.lr)
             if epoch % 100 == 0:
                 norm = CAE.get_ae_weight_norm()
                 print('pretraining epoch {}, cost: {}, norm: {}'.format(epoch, cost / float(minibatch_size), norm))
+        batches.close()
         if args.save:
             CAE.save_model()
     ###
@@ -469,11 +572,12 @@ def reinit_and_optimize(args, Img, Mask, Label, CAE, n_class, k=10, post_alpha=3
     acc_x = 0.0
     y_x_mode = 'svd'
     for epoch in range(1, num_epochs + 1):
-        cost, Coef = CAE.partial_fit_eqn3(Img, Mask, args.lr) # FIXME provide mask
+        cost, Coef = CAE.partial_fit_eqn3(Img, args.lr)
         if epoch % args.interval == 0:
             print "epoch: %.1d" % epoch, "cost: %.8f" % (cost/float(batch_size))
             Coef = thrC(Coef,alpha)
-            y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
+            with CAE.cpu.evaluation():
+                y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
             if len(set(list(np.squeeze(y_x_new)))) == n_class:
                 y_x = y_x_new
             else:
@@ -488,7 +592,7 @@ def reinit_and_optimize(args, Img, Mask, Label, CAE, n_class, k=10, post_alpha=3
     ###
     ### Stage 3: initialize k-means
     ###
-    CAE.initialize_kmeans(Coef, y_x)
+    CAE.initialize_kmeans(Coef, y_x, seeding=args.kmeans_init)
 
     ###
     ### Stage 4: train on eqn3+
@@ -498,11 +602,12 @@ def reinit_and_optimize(args, Img, Mask, Label, CAE, n_class, k=10, post_alpha=3
 
 
     for epoch in range(1, args.epochs2+1):
-        cost, Coef = CAE.partial_fit_eqn3plus(Img, Mask, args.lr)
+        cost, Coef = CAE.partial_fit_eqn3plus(Img, args.lr)
         if epoch % args.interval == 0:
             print 'epoch {}, cost {:.2f}'.format(epoch, cost)
             Coef = thrC(Coef,alpha)
-            y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
+            with CAE.cpu.evaluation():
+                y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
             if len(set(list(np.squeeze(y_x_new)))) == n_class:
                 y_x = y_x_new
             else:
@@ -637,6 +742,12 @@ def prepare_data_coil100(folder):
     return alpha, Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
 
 
+def prepare_data_synthetic(folder):
+    # K random subspaces, see synthetic.py
+    alpha = 0.1
+    return (alpha,) + synthetic.prepare_data(folder, args)
+
+
 def normalize_data(data):
     data = data - data.mean(axis=0)
     data = data / data.std(axis=0)
@@ -645,6 +756,8 @@ def normalize_data(data):
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    svd_backend.configure(args)
+    spectral.configure(args)
     assert args.name is not None and args.name != '', 'name of experiment must be specified'
 
     # prepare data
@@ -653,12 +766,12 @@ if __name__ == '__main__':
         'yaleb': prepare_data_YaleB,
         'orl': prepare_data_orl,
         'coil20': prepare_data_coil20,
-        'coil100': prepare_data_coil100}
+        'coil100': prepare_data_coil100,
+        'synthetic': prepare_data_synthetic}
     assert args.dataset in preparation_funcs
     alpha, Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path = \
             preparation_funcs[args.dataset](folder)
     Img = Img*args.imgmult
-    Mask = np.random.binomial(1, 0.99, Img.shape)
     post_alpha = args.palpha or post_alpha
     logs_path = os.path.join(folder, 'logs', args.name)
     restore_path = model_path
@@ -666,11 +779,17 @@ if __name__ == '__main__':
     # arrays for logging results
     avg = []
     med = []
+    sweep = []
 
-    # for each experiment setting, perform one loop
-    for n_class in all_subjects:
+    # for each missing rate and experiment setting, perform one loop
+    for missing_rate, n_class in [(m, n) for m in args.missing_rate for n in all_subjects]:
         batch_size = n_class * n_sample_perclass
 
+        # occlude the data, the same seed gives the same masks for every setting
+        Masks = masks.make_masks(args.occlusion, Img.shape, missing_rate, seed=args.mask_seed)
+        Img_observed = Masks.apply(Img)
+        print('{} occlusion, missing rate {:.4f}'.format(args.occlusion, Masks.missing_rate))
+
         lambda1 = args.lambda1  # L2 sparsity on C
         lambda2 = args.lambda2  # 0.2 # 1.0 * 10 ** (n_class / 10.0 - 3.0)    # self-expressivity
         lambda3 = args.lambda3  # k-means weight
@@ -681,18 +800,24 @@ if __name__ == '__main__':
             args,
             n_input, n_hidden, kernel_size, n_class, n_sample_perclass, 
             lambda1, lambda2, lambda3, batch_size, args.hardness,
-            reg=tf.contrib.layers.l2_regularizer(tf.ones(1) * args.lambda4), 
+            reg=tf.contrib.layers.l2_regularizer(tf.ones(1) * args.lambda4), mask_mode=Masks.mode,
             model_path=model_path, restore_path=restore_path, logs_path=logs_path)
 
         # perform optimization
-        avg_i, med_i, best_epoch, best_acc, best_alpha, best_postalpha = reinit_and_optimize(args, Img, Mask, Label, CAE, n_class, k=k, post_alpha=post_alpha, alpha = alpha)
+        avg_i, med_i, best_epoch, best_acc, best_alpha, best_postalpha = reinit_and_optimize(args, Img_observed, Masks, Label, CAE, n_class, k=k, post_alpha=post_alpha, alpha = alpha)
         # add result to list
         avg.append(avg_i)
         med.append(med_i)
+        sweep.append((Masks.missing_rate, n_class, 1 - avg_i, CAE.iter / max(CAE.train_time, 1e-9)))
 
     # report results for all experiments
-    for i, n_class in enumerate(all_subjects):
-        print('%d subjects:' % n_class)
+    for i, (missing_rate, n_class, _, _) in enumerate(sweep):
+        print('%d subjects, missing rate %.4f:' % (n_class, missing_rate))
         print('Mean: %.4f%%' % (avg[i] * 100), 'Median: %.4f%%' % (med[i] * 100))
 
         print( best_epoch , best_acc, best_alpha, best_postalpha)
+
+    # accuracy and training throughput against missing rate
+    print('missing_rate  subjects  accuracy  steps/s')
+    for missing_rate, n_class, acc, throughput in sweep:
+        print('%12.4f  %8d  %8.4f  %7.2f' % (missing_rate, n_class, acc, throughput))
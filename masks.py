@@ -0,0 +1,100 @@
+"""
+Missing-data masks for incomplete.py
+
+A mask marks every pixel of every image as observed (1) or missing (0). Masks are kept as packed
+bitmaps, one bit per pixel and one row of bytes per image, so a YaleB-sized mask takes 600KB instead
+of the 20MB of a float mask. The training graph never sees a dense mask: it gets a flat list of
+indices into the batch, either of the missing entries (when they are the minority) or of the
+observed ones.
+"""
+import numpy as np
+
+
+class MaskSet(object):
+    def __init__(self, packed, shape):
+        """
+        packed: N x ceil(P/8) uint8 array, bit=1 means observed, P = number of pixels per image
+        shape : shape of the image array the mask belongs to, e.g. [N, 48, 42, 1]
+        """
+        self.packed = packed
+        self.shape = list(shape)
+        self.n_pixel = int(np.prod(self.shape[1:]))
+        self.n_missing = self.n_pixel * self.shape[0] - int(np.unpackbits(packed, axis=1)[:, :self.n_pixel].sum())
+
+    @classmethod
+    def from_dense(cls, mask):
+        mask = np.asarray(mask)
+        packed = np.packbits(mask.reshape(mask.shape[0], -1) != 0, axis=1)
+        return cls(packed, mask.shape)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['packed'], data['shape'])
+
+    def save(self, path):
+        np.savez(path, packed=self.packed, shape=np.array(self.shape))
+
+    @property
+    def missing_rate(self):
+        return self.n_missing / float(self.n_pixel * self.shape[0])
+
+    @property
+    def mode(self):
+        # which of the two index lists is shorter, and so which one the graph should gather
+        return 'missing' if self.missing_rate <= 0.5 else 'observed'
+
+    def unpack(self, rows=None):
+        packed = self.packed if rows is None else self.packed[rows]
+        bits = np.unpackbits(packed, axis=1)[:, :self.n_pixel]
+        return bits.reshape([bits.shape[0]] + self.shape[1:])
+
+    def index(self, rows=None, mode=None):
+        """
+        flat int32 indices into the (len(rows) x P) batch built from `rows`, of the entries that are
+        missing (mode='missing') or observed (mode='observed')
+        """
+        mode = mode or self.mode
+        bits = self.unpack(rows).reshape(-1)
+        if mode == 'missing':
+            return np.flatnonzero(bits == 0).astype(np.int32)
+        return np.flatnonzero(bits).astype(np.int32)
+
+    def apply(self, Img):
+        # zero out the missing pixels so they carry no information into the encoder
+        return Img * self.unpack()
+
+
+def random_pixels(shape, rate, seed=None):
+    # each pixel goes missing independently with probability `rate`
+    rng = np.random.RandomState(seed)
+    N = shape[0]
+    P = int(np.prod(shape[1:]))
+    observed = rng.random_sample([N, P]) >= rate
+    return MaskSet(np.packbits(observed, axis=1), shape)
+
+
+def random_blocks(shape, rate, seed=None):
+    # each image loses one square patch at a random position, covering about `rate` of its area
+    rng = np.random.RandomState(seed)
+    N, H, W = shape[0], shape[1], shape[2]
+    side = int(round(np.sqrt(rate * H * W)))
+    side = min(side, H, W)
+    observed = np.ones([N, H, W], dtype=bool)
+    if side > 0:
+        top = rng.randint(0, H - side + 1, N)
+        left = rng.randint(0, W - side + 1, N)
+        for i in range(N):
+            observed[i, top[i]:top[i] + side, left[i]:left[i] + side] = False
+    observed = np.repeat(observed.reshape(N, H * W, 1), int(np.prod(shape[3:])), axis=2)
+    return MaskSet(np.packbits(observed.reshape(N, -1), axis=1), shape)
+
+
+occlusion_funcs = {
+    'pixel': random_pixels,
+    'block': random_blocks}
+
+
+def make_masks(kind, shape, rate, seed=None):
+    assert kind in occlusion_funcs, 'unknown occlusion pattern {}'.format(kind)
+    return occlusion_funcs[kind](shape, rate, seed=seed)
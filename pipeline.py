@@ -0,0 +1,95 @@
+"""
+Input pipeline for the training loops
+
+BatchPrefetcher replaces the per-step `np.random.permutation(N)[:128]` of the pretraining loops: it
+shuffles the data once per epoch, hands out contiguous slices of the shuffled copy, and prepares the
+next batches on a background thread while the session runs the current step. Optional Gaussian noise
+on the reconstruction target (the --noisestd denoising of dsc_gan2.py) is added on that thread too.
+"""
+import threading
+import numpy as np
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class BatchPrefetcher(object):
+    def __init__(self, data, batch_size, noise_std=0.0, shuffle=True, extra=None, prefetch=2, seed=None):
+        """
+        data      : N x ... array, first axis indexes samples
+        batch_size: number of samples per batch, clipped to N; the last N % batch_size samples of each
+                    shuffled epoch are skipped so every batch has the same shape
+        noise_std : std of the Gaussian noise added to the target, 0 gives target = batch
+        shuffle   : reshuffle every epoch, otherwise batches are taken in order
+        extra     : optional function of the batch's row indices, its result is returned with the batch
+        prefetch  : number of batches prepared ahead
+        """
+        self.data = data
+        self.batch_size = min(batch_size, data.shape[0])
+        self.noise_std = noise_std
+        self.shuffle = shuffle
+        self.extra = extra
+        self.rng = np.random.RandomState(seed)
+        self.epoch = 0
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _batches(self):
+        N = self.data.shape[0]
+        n_batch = N // self.batch_size
+        while True:
+            if self.shuffle:
+                order = self.rng.permutation(N)
+                epoch_data = self.data[order]  # one copy per epoch, batches below are views into it
+            else:
+                order = np.arange(N)
+                epoch_data = self.data
+            for b in range(n_batch):
+                rows = order[b * self.batch_size:(b + 1) * self.batch_size]
+                batch = epoch_data[b * self.batch_size:(b + 1) * self.batch_size]
+                if self.noise_std > 0:
+                    target = batch + self.rng.normal(0, self.noise_std, batch.shape).astype(batch.dtype)
+                else:
+                    target = batch
+                extra = self.extra(rows) if self.extra is not None else None
+                yield batch, target, extra
+            self.epoch += 1
+
+    def _produce(self):
+        try:
+            for item in self._batches():
+                if not self._put(item):
+                    return
+        except Exception as e:
+            self._put(e)  # re-raised by __next__ in the training thread
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        returns (batch, target, extra), target is batch plus noise and extra is extra(rows) or None
+        """
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    next = __next__  # python 2
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
@@ -0,0 +1,192 @@
+"""
+Timing and profiling for the training loops
+
+The training code calls profiler.run(sess, fetches, feed_dict, name) instead of sess.run, and wraps the
+stages of reinit_and_optimize in `with profiler.phase(name):`. Profiler records
+    - wall time of every phase and every named run
+    - bytes fed to and fetched from the session by every named run
+    - every trace_every-th call of each named run with a full RunMetadata trace, giving per-op device time
+      and the peak memory of each allocator
+and writes them as a Chrome trace (chrome://tracing, or https://ui.perfetto.dev) and a summary table.
+NullProfiler has the same interface and just calls sess.run, so leaving profiling off costs nothing.
+"""
+import contextlib
+import json
+import time
+import numpy as np
+import tensorflow as tf
+
+
+def nbytes(value):
+    # size of a feed or fetch value: numpy arrays, python scalars and (nested) lists of them
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum([nbytes(v) for v in value])
+    if isinstance(value, dict):
+        return sum([nbytes(v) for v in value.values()])
+    if value is None or isinstance(value, (bytes, str)):
+        return 0
+    return np.asarray(value).nbytes
+
+
+class NullProfiler(object):
+    enabled = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        yield
+
+    def run(self, sess, fetches, feed_dict=None, name=None):
+        return sess.run(fetches, feed_dict=feed_dict)
+
+    def summary(self, sess=None):
+        return ''
+
+    def save_trace(self, path):
+        pass
+
+
+class Stat(object):
+    def __init__(self):
+        self.calls = 0          # untraced calls, the ones the timings and byte counts cover
+        self.seen = 0           # all calls, traced ones included, for the trace cadence
+        self.seconds = 0.0
+        self.feed_bytes = 0
+        self.fetch_bytes = 0
+
+
+class Profiler(object):
+    enabled = True
+
+    def __init__(self, trace_every=0):
+        """
+        trace_every: run every trace_every-th call of each named run with a full RunMetadata trace,
+                     0 never traces. Traced calls are slower and are not counted in the run timings.
+        """
+        self.trace_every = trace_every
+        self.phases = {}
+        self.runs = {}
+        self.ops = {}          # node name -> [calls, device microseconds], from the traced runs
+        self.peak_bytes = {}   # allocator -> peak bytes seen in the traced runs
+        self.events = []
+        self.device_events = []
+        self.phase_stack = []
+        self.t_start = time.time()
+
+    def _event(self, name, category, t_begin, t_end, tid, args=None):
+        self.events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': 0, 'tid': tid,
+                            'ts': t_begin * 1e6, 'dur': (t_end - t_begin) * 1e6, 'args': args or {}})
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # phases nest, 'gan/disc' inside 'gan' is reported separately from 'gan'
+        self.phase_stack.append(name)
+        key = '/'.join(self.phase_stack)
+        t_begin = time.time()
+        try:
+            yield
+        finally:
+            t_end = time.time()
+            self.phase_stack.pop()
+            stat = self.phases.setdefault(key, Stat())
+            stat.calls += 1
+            stat.seconds += t_end - t_begin
+            self._event(key, 'phase', t_begin, t_end, tid=len(self.phase_stack))
+
+    def run(self, sess, fetches, feed_dict=None, name=None):
+        name = name or 'run'
+        stat = self.runs.setdefault(name, Stat())
+        stat.seen += 1
+        traced = self.trace_every > 0 and stat.seen % self.trace_every == 0
+        feed_bytes = nbytes(feed_dict)
+        t_begin = time.time()
+        if traced:
+            options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            metadata = tf.RunMetadata()
+            result = sess.run(fetches, feed_dict=feed_dict, options=options, run_metadata=metadata)
+        else:
+            result = sess.run(fetches, feed_dict=feed_dict)
+        t_end = time.time()
+        fetch_bytes = nbytes(result)
+        if traced:
+            self._add_metadata(metadata)
+        else:
+            stat.calls += 1
+            stat.seconds += t_end - t_begin
+            stat.feed_bytes += feed_bytes
+            stat.fetch_bytes += fetch_bytes
+        self._event(name, 'run', t_begin, t_end, tid=10,
+                    args={'feed_bytes': feed_bytes, 'fetch_bytes': fetch_bytes, 'traced': traced})
+        return result
+
+    def _add_metadata(self, metadata):
+        from tensorflow.python.client import timeline
+        for dev_stats in metadata.step_stats.dev_stats:
+            for node in dev_stats.node_stats:
+                op = self.ops.setdefault(node.node_name, [0, 0])
+                op[0] += 1
+                op[1] += node.all_end_rel_micros
+                for memory in node.memory:
+                    peak = max(getattr(memory, 'peak_bytes', 0), memory.total_bytes)
+                    self.peak_bytes[memory.allocator_name] = max(self.peak_bytes.get(memory.allocator_name, 0), peak)
+        # device timelines use absolute microseconds too, keep their pids clear of the host's 0
+        trace = json.loads(timeline.Timeline(metadata.step_stats).generate_chrome_trace_format())
+        for event in trace['traceEvents']:
+            if 'pid' in event:
+                event['pid'] += 1
+            self.device_events.append(event)
+
+    def summary(self, sess=None, top=15):
+        """
+        table of phases, named runs, the slowest ops of the traced runs, and peak memory; sess is used to
+        ask the GPU allocator for its peak when tf.contrib.memory_stats is available
+        """
+        lines = []
+        total = max(time.time() - self.t_start, 1e-9)
+        lines.append('{:<40} {:>8} {:>12} {:>12} {:>7}'.format('phase', 'calls', 'total(s)', 'mean(ms)', '%'))
+        for key in sorted(self.phases, key=lambda k: -self.phases[k].seconds):
+            stat = self.phases[key]
+            lines.append('{:<40} {:>8} {:>12.3f} {:>12.3f} {:>7.1f}'.format(
+                key, stat.calls, stat.seconds, 1e3 * stat.seconds / stat.calls, 100 * stat.seconds / total))
+        lines.append('')
+        lines.append('{:<40} {:>8} {:>12} {:>12} {:>12} {:>12}'.format('run', 'calls', 'total(s)', 'mean(ms)', 'feed(MB)', 'fetch(MB)'))
+        for name in sorted(self.runs, key=lambda k: -self.runs[k].seconds):
+            stat = self.runs[name]
+            lines.append('{:<40} {:>8} {:>12.3f} {:>12.3f} {:>12.2f} {:>12.2f}'.format(
+                name, stat.calls, stat.seconds, 1e3 * stat.seconds / max(stat.calls, 1),
+                stat.feed_bytes / 2.0 ** 20, stat.fetch_bytes / 2.0 ** 20))
+        if self.ops:
+            lines.append('')
+            lines.append('{:<60} {:>8} {:>12}'.format('op (traced runs)', 'calls', 'mean(ms)'))
+            for name in sorted(self.ops, key=lambda k: -self.ops[k][1])[:top]:
+                calls, micros = self.ops[name]
+                lines.append('{:<60} {:>8} {:>12.3f}'.format(name[-60:], calls, 1e-3 * micros / calls))
+        peak = dict(self.peak_bytes)
+        try:
+            import resource
+            # ru_maxrss is in KB on linux
+            peak['host (max rss)'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            pass
+        if sess is not None:
+            try:
+                from tensorflow.contrib.memory_stats import MaxBytesInUse
+                peak['device (max in use)'] = sess.run(MaxBytesInUse())
+            except Exception:
+                pass
+        if peak:
+            lines.append('')
+            lines.append('{:<40} {:>12}'.format('memory', 'peak(MB)'))
+            for name in sorted(peak):
+                lines.append('{:<40} {:>12.1f}'.format(name, peak[name] / 2.0 ** 20))
+        return '\n'.join(lines)
+
+    def save_trace(self, path):
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': 0, 'args': {'name': 'host'}}]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': metadata + self.events + self.device_events}, f)
+
+
+def make_profiler(enabled, trace_every=0):
+    return Profiler(trace_every) if enabled else NullProfiler()
@@ -0,0 +1,149 @@
+"""
+Scheduler for independent experiments
+
+The training scripts run their experiment settings one after the other in a single process: the
+all_subjects loop, and in DSC-Net-L2-EYaleB.py the 39-K subsets of K subjects for every K. The runs
+don't depend on each other, so run_jobs() hands them to a pool of worker processes instead:
+    - the number of workers is capped by a CPU budget (cores_per_worker cores each, a disjoint set per
+      worker pinned with cpu.py) and a memory budget (memory_per_worker GB each)
+    - every worker calls setup() once for the state it keeps across its jobs, e.g. a built model and the
+      pretrained weights read from the checkpoint, then run(state, job) for each job it is given
+    - results come back as soon as a job finishes, in completion order; Report writes them as JSON lines
+      while the run goes on, and groups them for the summary at the end
+Jobs are started largest first (by size(job)), so the long ones don't end up running alone at the end.
+
+The workers are forked, so the parent must not have created a TensorFlow session before run_jobs().
+"""
+import argparse
+import json
+import multiprocessing
+import time
+import traceback
+import cpu
+
+
+def add_arguments(parser):
+    # options of run_jobs, see the module docstring
+    parser.add_argument('--workers',           type=int,   default=1)      # worker processes, 1 runs everything in this process, 0 as many as the budgets allow
+    parser.add_argument('--cores-per-worker',  type=int,   default=1)      # cores each worker is pinned to, 0 leaves them unpinned
+    parser.add_argument('--memory-budget',     type=float, default=None)   # GB for all workers together
+    parser.add_argument('--memory-per-worker', type=float, default=2.0)    # GB one worker is expected to use at its largest job
+    parser.add_argument('--report',            default=None)               # JSON lines file every result is appended to when it finishes
+
+
+def peak_memory():
+    # peak resident memory of this process in GB, ru_maxrss is in KB on linux
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2.0 ** 20
+
+
+def available_cores():
+    return cpu.get_affinity() or list(range(multiprocessing.cpu_count()))
+
+
+def plan_workers(workers, cores_per_worker=1, memory_budget=None, memory_per_worker=None):
+    """
+    number of worker processes: workers, or as many as the budgets allow for 0, but never more than
+    the available cores // cores_per_worker or memory_budget // memory_per_worker, and at least 1
+    """
+    limit = len(available_cores()) // max(cores_per_worker, 1)
+    if memory_budget and memory_per_worker:
+        limit = min(limit, int(memory_budget // memory_per_worker))
+    limit = max(limit, 1)
+    return min(workers, limit) if workers > 0 else limit
+
+
+def worker_profile(slot, cores_per_worker):
+    """
+    the CPU profile of worker number slot: cores_per_worker cores of its own for the session and the
+    evaluation, and as many BLAS threads; a profile that changes nothing for unpinned workers
+    """
+    if not cores_per_worker:
+        return cpu.CPUProfile(None)
+    cores = available_cores()
+    first = slot * cores_per_worker % len(cores)
+    spec = cpu.format_cores(cores[first:first + cores_per_worker])
+    return cpu.CPUProfile(argparse.Namespace(train_cores=spec, eval_cores=spec))
+
+
+# state of the worker process, set up once by init_worker
+worker = {}
+
+
+def init_worker(slots, setup, run, setup_args, cores_per_worker):
+    worker['slot'] = slots.get()
+    worker['run'] = run
+    worker['profile'] = worker_profile(worker['slot'], cores_per_worker)
+    worker['state'] = setup(worker['profile'], *setup_args)
+
+
+def run_job(job):
+    # a failed job is reported with its traceback instead of stopping the other workers
+    t_begin = time.time()
+    try:
+        result, error = worker['run'](worker['state'], job), None
+    except Exception:
+        result, error = None, traceback.format_exc()
+    return {'job': job, 'result': result, 'error': error, 'seconds': time.time() - t_begin,
+            'worker': worker['slot'], 'peak_memory': peak_memory()}
+
+
+def run_jobs(jobs, setup, run, workers, setup_args=(), cores_per_worker=0, size=None):
+    """
+    runs run(state, job) for every job on `workers` processes, with state = setup(profile, *setup_args)
+    once per process (profile is the worker's cpu.CPUProfile), and yields a dict per finished
+    job: job, result (what run returned), error (traceback or None), seconds, worker, peak_memory (GB)
+    """
+    jobs = sorted(jobs, key=size, reverse=True) if size is not None else list(jobs)
+    slots = multiprocessing.Queue()
+    for slot in range(workers):
+        slots.put(slot)
+    pool = multiprocessing.Pool(workers, init_worker, (slots, setup, run, setup_args, cores_per_worker))
+    try:
+        for row in pool.imap_unordered(run_job, jobs):
+            yield row
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class Report(object):
+    def __init__(self, path=None, memory_per_worker=None):
+        """
+        path             : JSON lines file the rows are appended to, one line per finished job
+        memory_per_worker: warn when a worker's peak memory goes above this (GB), the budget assumed it
+        """
+        self.rows = []
+        self.file = open(path, 'a') if path else None
+        self.memory_per_worker = memory_per_worker
+        self.t_start = time.time()
+
+    def add(self, row, n_jobs=None):
+        self.rows.append(row)
+        if self.file is not None:
+            self.file.write(json.dumps(row, sort_keys=True) + '\n')
+            self.file.flush()
+        if row['error'] is not None:
+            print('job {} failed on worker {}:\n{}'.format(row['job'], row['worker'], row['error']))
+        if self.memory_per_worker and row['peak_memory'] > self.memory_per_worker:
+            print('worker {} peaked at {:.1f} GB, more than --memory-per-worker {} GB'.format(
+                row['worker'], row['peak_memory'], self.memory_per_worker))
+        print('[{}/{}, {:.0f}s] job {} took {:.1f}s on worker {}'.format(
+            len(self.rows), n_jobs or '?', time.time() - self.t_start, row['job'], row['seconds'], row['worker']))
+
+    def groups(self, key):
+        """
+        results of the successful jobs, grouped by key(job)
+        """
+        grouped = {}
+        for row in self.rows:
+            if row['error'] is None:
+                grouped.setdefault(key(row['job']), []).append(row['result'])
+        return grouped
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
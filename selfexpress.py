@@ -0,0 +1,107 @@
+"""
+Variants of the self-expressive layer
+
+The fine-tuning loss of Eqn 3 is quadratic in Coef once the latent codes z (N x D) are fixed:
+    lambda1 ||C||_F^2 + lambda2 / 2 ||C z - z||_F^2
+and its minimizer is C = Z Z^T (a I_N + Z Z^T)^-1 with a = 2 lambda1 / lambda2. By the push-through
+identity this is also C = Z (a I_D + Z^T Z)^-1 Z^T, and the latent size D of the conv autoencoders
+(a few hundred) is much smaller than the number of images N (up to 2432 for YaleB), so the solve is a
+D x D Cholesky factorization instead of an N x N one.
+
+closed_form_coef() builds that solution for the current batch. With --coef-closed the training scripts
+use it instead of the Coef variable and its Adam steps: every step solves C exactly for the current z,
+held fixed (stop_gradient), and Adam only updates the autoencoder through z_c = C z. C z and ||C||_F^2
+are computed from the D x D factors, so the N x N matrix is only formed when Coef itself is fetched,
+which the loops do at the evaluation epochs.
+
+With an L1 sparsity term (incomplete.py) Adam only ever takes subgradient steps on Coef, its entries
+hover around zero instead of reaching it and thrC has to prune them. proximal_l1_step() is the ISTA update
+instead: a gradient step on the smooth part of the loss, then soft thresholding, which sets entries to
+exactly zero. It also counts the entries whose zero pattern changed, so the caller can tell when the
+pattern has settled and switch to a sparse Coef.
+
+thrC keeps only a few large entries per column of the dense Coef anyway. knn_self_expression() never has
+the others: every sample is expressed over its k nearest neighbours in the pretrained latent space
+(nearest_neighbours()), so Coef is an [N, k] value tensor next to an [N, k] index tensor, and C z is a
+gather plus a batched dot product, O(N k D) in time and memory instead of O(N^2 D).
+"""
+import numpy as np
+import tensorflow as tf
+
+
+def closed_form_coef(z, lambda1, lambda2):
+    """
+    z: [N, D] latent codes with static shape, returns (Coef, z_c, loss_sparsity) for the exact minimizer
+    of lambda1 ||C||^2 + lambda2 / 2 ||C z - z||^2 over C given z, with z_c = C z differentiable in z
+    """
+    n, d = [int(s) for s in z.shape]
+    a = 2.0 * lambda1 / lambda2
+    z0 = tf.stop_gradient(z)
+    if d < n:
+        # C = Z0 W Z0^T, W = (a I_D + G)^-1, G = Z0^T Z0
+        gram = tf.matmul(z0, z0, transpose_a=True)
+        chol = tf.cholesky(gram + a * tf.eye(d))
+        z_c = tf.matmul(z0, tf.cholesky_solve(chol, tf.matmul(z0, z, transpose_a=True)), name='matmul_Cz')
+        Coef = tf.matmul(z0, tf.cholesky_solve(chol, tf.transpose(z0)), name='Coef_closed')
+        # ||C||^2 = tr(W G W G) = ||P||^2 for the symmetric P = G^1/2 W G^1/2, computed as tr(M M), M = W G
+        m = tf.cholesky_solve(chol, gram)
+        loss_sparsity = tf.reduce_sum(m * tf.transpose(m))
+    else:
+        # fewer images than latent dimensions, C = (a I_N + K)^-1 K with K = Z0 Z0^T
+        kernel = tf.matmul(z0, z0, transpose_b=True)
+        Coef = tf.cholesky_solve(tf.cholesky(kernel + a * tf.eye(n)), kernel, name='Coef_closed')
+        z_c = tf.matmul(Coef, z, name='matmul_Cz')
+        loss_sparsity = tf.reduce_sum(tf.pow(Coef, 2.0))
+    return Coef, z_c, loss_sparsity
+
+
+def knn_self_expression(z, cols, values):
+    """
+    z: [N, D], cols: [N, k] neighbour indices, values: [N, k] their coefficients, returns (z_c, loss_sparsity)
+    with z_c[i] = sum_j values[i, j] z[cols[i, j]]
+    """
+    neighbours = tf.gather(z, cols)  # N, k, D
+    z_c = tf.squeeze(tf.matmul(tf.expand_dims(values, 1), neighbours), [1], name='matmul_Cz')
+    return z_c, tf.reduce_sum(tf.pow(values, 2.0))
+
+
+def nearest_neighbours(Z, k, chunk=1024):
+    """
+    [N, k] indices of the k rows of Z with the largest |cosine| to each row, the row itself excluded and
+    the nearest first; samples of a subspace can point either way, hence the absolute value. chunk rows
+    are compared at a time, so memory stays O(chunk N)
+    """
+    Z = Z / np.maximum(np.linalg.norm(Z, axis=1, keepdims=True), 1e-12)
+    N = Z.shape[0]
+    assert k < N, 'k={} neighbours out of {} samples'.format(k, N)
+    cols = np.empty([N, k], np.int32)
+    for begin in range(0, N, chunk):
+        end = min(begin + chunk, N)
+        rows = np.arange(end - begin)[:, None]
+        sim = np.abs(Z[begin:end].dot(Z.T))
+        sim[rows[:, 0], np.arange(begin, end)] = -1.0
+        nearest = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        cols[begin:end] = nearest[rows, np.argsort(-sim[rows, nearest], axis=1)]
+    return cols
+
+
+def soft_threshold(x, t):
+    # proximal operator of t ||x||_1
+    return tf.sign(x) * tf.nn.relu(tf.abs(x) - t)
+
+
+def proximal_l1_step(Coef, support, grad, z, lambda1, lambda2, step=1.0):
+    """
+    one proximal gradient step on lambda1 ||Coef||_1 + f(Coef), with grad the gradient of the smooth part
+    f at Coef, and support a boolean variable of Coef's shape holding its nonzero pattern.
+    The step size is step / (lambda2 ||z||_F^2), which is at most 1 / the Lipschitz constant of the
+    self-expression term lambda2 / 2 ||Coef z - z||^2. Returns the update op and the number of entries
+    whose zero pattern it changes.
+    """
+    eta = step / (lambda2 * tf.reduce_sum(tf.square(tf.stop_gradient(z))) + 1e-12)
+    new = soft_threshold(Coef - eta * grad, eta * lambda1)
+    new_support = tf.not_equal(new, 0.0)
+    changes = tf.reduce_sum(tf.cast(tf.not_equal(new_support, support), tf.int32))
+    with tf.control_dependencies([changes]):
+        update = tf.group(Coef.assign(new), support.assign(new_support))
+    return update, changes
@@ -0,0 +1,189 @@
+"""
+Spectral clustering of the post_proC affinity
+
+post_proC ended in sklearn's SpectralClustering, called as fit(L) and then fit_predict(L), so every
+evaluation computed the spectral embedding (an ARPACK eigensolve) and the label assignment twice and
+kept the second result. spectral_cluster() finishes the MATLAB pipeline the scripts' stub of the same
+name translated, and computes the embedding once:
+    - the n leading eigenvectors of D^-1/2 L D^-1/2, which are the n trailing ones of the normalized
+      Laplacian I - D^-1/2 L D^-1/2; a partial dense eigh up to --spectral-dense-max samples, ARPACK's
+      eigsh above
+    - rows normalized to unit length
+    - k-means with --spectral-replicates random restarts of at most --spectral-max-iter iterations each,
+      the one with the lowest inertia wins; the restarts run on --spectral-jobs threads (sklearn's k-means
+      releases the GIL), so nothing is forked next to the TensorFlow session
+The stub's eps=2.2*10-8 evaluated to 14 and was added to every degree; eps is the machine epsilon
+MATLAB's eps stands for. --spectral sklearn keeps SpectralClustering (a single fit_predict now) for
+comparison. cluster() returns labels 0..n-1 like fit_predict.
+
+The affinity itself is N x N, and so is Z = U U^T post_proC builds it from (U the N x r embedding of
+Coef). With --landmarks m, landmark_cluster() clusters from U instead: m landmark rows of U are drawn at
+random, and every sample is compared with the landmarks only, in chunks, keeping its
+--landmark-neighbours largest affinities (the sparse N x m matrix A, rows summing to 1). Then with
+--landmark-extend
+    nystrom: the n leading eigenvectors of the m x m landmark affinity A^T A (columns of A scaled by
+             their sums^-1/2) are extended to all samples through A, the Nystrom extension, and k-means
+             runs on the row-normalized result (landmark-based spectral clustering, Chen & Cai 2011)
+    nearest: spectral_cluster() runs on the m x m affinity between the landmarks, and every sample takes
+             the label of its most similar landmark
+Both are O(N m r) in time and O(N s + m^2) in memory, nothing N x N is formed after the SVD.
+"""
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import scipy.linalg
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+from sklearn.cluster import KMeans, SpectralClustering
+
+
+methods = ['native', 'sklearn']
+extensions = ['nystrom', 'nearest']
+
+
+def add_arguments(parser):
+    # options of cluster(), see the module docstring
+    parser.add_argument('--spectral',               default='native', choices=methods)  # spectral clustering of post_proC
+    parser.add_argument('--spectral-replicates',    type=int, default=10)     # k-means restarts on the embedding
+    parser.add_argument('--spectral-max-iter',      type=int, default=1000)   # k-means iterations per restart, MAXiter of the MATLAB code
+    parser.add_argument('--spectral-jobs',          type=int, default=1)      # threads running the restarts, 0 one per core
+    parser.add_argument('--spectral-dense-max',     type=int, default=500)    # largest N whose embedding uses the dense eigh
+    parser.add_argument('--landmarks',              type=int, default=0)      # m, cluster through m landmarks instead of the N x N affinity, 0 exactly
+    parser.add_argument('--landmark-extend',        default='nystrom', choices=extensions)  # how the labels reach the other samples
+    parser.add_argument('--landmark-neighbours',    type=int, default=5)      # landmarks each sample keeps an affinity to
+
+
+# what cluster() uses unless told otherwise, configure() sets them from the command line
+settings = {'method': 'native', 'replicates': 10, 'max_iter': 1000, 'jobs': 1, 'dense_max': 500, 'seed': 0,
+            'landmarks': 0, 'extend': 'nystrom', 'neighbours': 5}
+
+eps = np.finfo(np.float64).eps
+
+
+def configure(args):
+    settings.update(method=args.spectral, replicates=args.spectral_replicates, max_iter=args.spectral_max_iter,
+                    jobs=args.spectral_jobs, dense_max=args.spectral_dense_max, landmarks=args.landmarks,
+                    extend=args.landmark_extend, neighbours=args.landmark_neighbours)
+
+
+def leading_eigenvectors(M, n):
+    # the n largest eigenvalues of the symmetric M in ascending order, and their eigenvectors
+    N = M.shape[0]
+    if N <= settings['dense_max']:
+        M = M.toarray() if sparse.issparse(M) else M
+        try:
+            return scipy.linalg.eigh(M, subset_by_index=[N - n, N - 1])
+        except TypeError:
+            # scipy before 1.5 calls it eigvals
+            return scipy.linalg.eigh(M, eigvals=(N - n, N - 1))
+    return eigsh(M, n, which='LA', v0=np.ones(N))
+
+
+def embedding(L, n):
+    """
+    L: [N, N] symmetric nonnegative affinity, dense or scipy sparse, returns the [N, n] row-normalized
+    spectral embedding kerNS of the MATLAB code
+    """
+    DN = 1. / np.sqrt(np.asarray(L.sum(0)).ravel() + eps)
+    if sparse.issparse(L):
+        M = sparse.diags(DN).dot(L).dot(sparse.diags(DN))
+    else:
+        M = DN[:, None] * L * DN[None, :]
+    _, ker = leading_eigenvectors(M, n)
+    return normalize_rows(ker)
+
+
+def normalize_rows(X):
+    return X / (np.sqrt(np.sum(X ** 2, 1, keepdims=True)) + eps)
+
+
+def kmeans(X, n, replicates=10, max_iter=1000, jobs=1, seed=0):
+    """
+    labels of the best of `replicates` k-means runs on the rows of X, run on `jobs` threads
+    """
+    def replicate(i):
+        km = KMeans(n_clusters=n, n_init=1, max_iter=max_iter, random_state=seed + i).fit(X)
+        return km.inertia_, km.labels_
+    jobs = min(jobs or multiprocessing.cpu_count(), replicates)
+    if jobs > 1:
+        pool = ThreadPool(jobs)
+        try:
+            results = pool.map(replicate, range(replicates))
+        finally:
+            pool.close()
+    else:
+        results = [replicate(i) for i in range(replicates)]
+    return min(results, key=lambda result: result[0])[1]
+
+
+def spectral_cluster(L, n):
+    """
+    L: affinity, n: number of clusters
+    Translates MATLAB code below:
+    N  = size(L, 1)
+    DN = diag( 1./sqrt(sum(L)+eps) );
+    LapN = speye(N) - DN * L * DN;
+    [~,~,vN] = svd(LapN);
+    kerN = vN(:,N-n+1:N);
+    normN = sum(kerN .^2, 2) .^.5;
+    kerNS = bsxfun(@rdivide, kerN, normN + eps);
+    groups = kmeans(kerNS,n,'maxiter',MAXiter,'replicates',REPlic,'EmptyAction','singleton');
+    """
+    return kmeans(embedding(L, n), n, settings['replicates'], settings['max_iter'], settings['jobs'],
+                  settings['seed'])
+
+
+def cluster(L, n, method=None):
+    """
+    labels 0..n-1 of the affinity L with the configured (or the given) method
+    """
+    method = method or settings['method']
+    if method == 'sklearn':
+        return SpectralClustering(n_clusters=n, eigen_solver='arpack', affinity='precomputed',
+                                  assign_labels='discretize').fit_predict(L)
+    return spectral_cluster(L, n)
+
+
+def landmark_affinity(U, landmarks, kernel, s, chunk=4096):
+    """
+    [N, m] scipy sparse affinity between the rows of U and the landmark rows U[landmarks], kernel(X, Y)
+    giving the dense affinity block between the rows of X and Y; every row keeps its s largest entries
+    and is scaled to sum to 1
+    """
+    Um = U[landmarks]
+    N, m = U.shape[0], len(landmarks)
+    s = min(s, m)
+    cols = np.empty([N, s], np.int64)
+    values = np.empty([N, s])
+    for begin in range(0, N, chunk):
+        end = min(begin + chunk, N)
+        block = kernel(U[begin:end], Um)
+        nearest = np.argpartition(-block, s - 1, axis=1)[:, :s]
+        cols[begin:end] = nearest
+        values[begin:end] = block[np.arange(end - begin)[:, None], nearest]
+    values /= values.sum(1, keepdims=True) + eps
+    return sparse.csr_matrix((values.ravel(), cols.ravel(), np.arange(0, N * s + 1, s)), shape=(N, m))
+
+
+def landmark_cluster(U, n, kernel, m=None, extend=None):
+    """
+    U: [N, r] embedding, n: number of clusters, kernel(X, Y): affinity block between the rows of X and Y,
+    the one post_proC builds from Z = U U^T. Labels 0..n-1 of all N samples through m landmarks, see the
+    module docstring
+    """
+    N = U.shape[0]
+    m = min(m or settings['landmarks'], N)
+    extend = extend or settings['extend']
+    landmarks = np.sort(np.random.RandomState(settings['seed']).choice(N, m, replace=False))
+    A = landmark_affinity(U, landmarks, kernel, settings['neighbours'])
+    if extend == 'nearest':
+        W = kernel(U[landmarks], U[landmarks])
+        y_landmarks = spectral_cluster(0.5 * (W + W.T), n)
+        # the largest entry of every row of A, a landmark's own row included
+        return y_landmarks[np.asarray(A.argmax(1)).ravel()]
+    A = A.dot(sparse.diags(1. / np.sqrt(np.asarray(A.sum(0)).ravel() + eps)))
+    w, V = leading_eigenvectors(A.T.dot(A).toarray(), n)
+    # left singular vectors of A from the right ones, A V w^-1/2
+    ker = A.dot(V) / np.sqrt(np.maximum(w, eps))
+    return kmeans(normalize_rows(ker), n, settings['replicates'], settings['max_iter'], settings['jobs'],
+                  settings['seed'])
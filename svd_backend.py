@@ -0,0 +1,131 @@
+"""
+SVD backends for post_proC
+
+post_proC needs the r = d*K+1 leading singular vectors of the symmetrized Coef. ARPACK (scipy's svds)
+gets slow and sometimes fails to converge when r is a large part of N, e.g. r=1201 for COIL100's
+N=7200. svds() below picks one of these instead:
+    lapack    : exact, dense eigh (symmetric C) or gesdd, best for small N or when r is a large part of N
+    arpack    : scipy.sparse.linalg.svds with v0=ones, what post_proC always used
+    randomized: range finder with oversampling and power iterations (Halko et al.), a few passes over C
+    krylov    : block Krylov subspace of the same passes (Musco & Musco), more accurate per pass when the
+                spectrum decays slowly, at (power_iters+1) times the memory
+The default stays arpack, so results don't change unless --svd is given. 'auto' is opt-in: it takes
+lapack for N <= --svd-lapack-max or when r + oversampling is at least half of N, randomized otherwise.
+All of them return (U, s, Vt) in svds' ascending order, and record the relative residual
+||C - U diag(s) Vt||_F / ||C||_F of the rank-r approximation in `last`, printed with --svd-report.
+Another backend, e.g. on the GPU, is a function (C, r) -> (U, s, Vt) in descending order added to
+`backends`.
+"""
+import time
+import numpy as np
+import scipy.linalg
+from scipy import sparse
+from scipy.sparse.linalg import svds as arpack_svds
+
+
+methods = ['auto', 'lapack', 'arpack', 'randomized', 'krylov']
+
+
+def add_arguments(parser):
+    # options of svds(), see the module docstring
+    parser.add_argument('--svd',                default='arpack', choices=methods) # SVD backend of post_proC
+    parser.add_argument('--svd-oversample',     type=int,   default=10)     # extra columns of the randomized and Krylov range finders
+    parser.add_argument('--svd-power-iters',    type=int,   default=2)      # power iterations (randomized) or Krylov blocks beyond the first
+    parser.add_argument('--svd-lapack-max',     type=int,   default=2000)   # largest N 'auto' decomposes exactly
+    parser.add_argument('--svd-report',         action='store_true')        # print backend, time and residual of every call
+
+
+# what svds() uses unless told otherwise, configure() sets them from the command line
+settings = {'method': 'arpack', 'oversample': 10, 'power_iters': 2, 'lapack_max': 2000, 'report': False, 'seed': 0}
+
+# backend, N, r, seconds and residual of the last call
+last = {}
+
+
+def configure(args):
+    settings.update(method=args.svd, oversample=args.svd_oversample, power_iters=args.svd_power_iters,
+                    lapack_max=args.svd_lapack_max, report=args.svd_report)
+
+
+def dense(C):
+    return C.toarray() if sparse.issparse(C) else np.asarray(C)
+
+
+def svd_lapack(C, r):
+    C = dense(C)
+    if C.shape[0] == C.shape[1] and np.allclose(C, C.T):
+        # singular values of a symmetric matrix are its |eigenvalues|, U and V its eigenvectors up to sign
+        w, V = scipy.linalg.eigh(C)
+        order = np.argsort(-np.abs(w))[:r]
+        return V[:, order], np.abs(w[order]), (V[:, order] * np.sign(w[order])).T
+    U, s, Vt = scipy.linalg.svd(C, full_matrices=False)
+    return U[:, :r], s[:r], Vt[:r]
+
+
+def svd_arpack(C, r):
+    U, s, Vt = arpack_svds(C, r, v0=np.ones(C.shape[0]))
+    return U[:, ::-1], s[::-1], Vt[::-1]
+
+
+def orthonormal(Y):
+    Q, _ = scipy.linalg.qr(Y, mode='economic')
+    return Q
+
+
+def project(C, Q, r):
+    # SVD of C restricted to the range of Q, the r leading triplets
+    B = dense(C.T.dot(Q)).T
+    Ub, s, Vt = scipy.linalg.svd(B, full_matrices=False)
+    return Q.dot(Ub[:, :r]), s[:r], Vt[:r]
+
+
+def svd_randomized(C, r):
+    n_columns = min(r + settings['oversample'], min(C.shape))
+    Y = C.dot(np.random.RandomState(settings['seed']).randn(C.shape[1], n_columns))
+    for i in range(settings['power_iters']):
+        # re-orthonormalized every pass, the small singular values would drown in round-off otherwise
+        Y = C.dot(orthonormal(C.T.dot(orthonormal(Y))))
+    return project(C, orthonormal(Y), r)
+
+
+def svd_krylov(C, r):
+    n_columns = min(r + settings['oversample'], min(C.shape))
+    Y = orthonormal(C.dot(np.random.RandomState(settings['seed']).randn(C.shape[1], n_columns)))
+    blocks = [Y]
+    for i in range(settings['power_iters']):
+        Y = orthonormal(C.dot(orthonormal(C.T.dot(Y))))
+        blocks.append(Y)
+    return project(C, orthonormal(np.hstack(blocks)), r)
+
+
+backends = {'lapack': svd_lapack, 'arpack': svd_arpack, 'randomized': svd_randomized, 'krylov': svd_krylov}
+
+
+def choose(N, r):
+    if N <= settings['lapack_max'] or 2 * (r + settings['oversample']) >= N:
+        return 'lapack'
+    return 'randomized'
+
+
+def frobenius(C):
+    return np.sqrt(C.multiply(C).sum()) if sparse.issparse(C) else np.linalg.norm(C)
+
+
+def svds(C, r, method=None):
+    """
+    r leading singular triplets of C with the configured (or the given) backend, like
+    scipy.sparse.linalg.svds in ascending order
+    """
+    method = method or settings['method']
+    if method == 'auto':
+        method = choose(C.shape[0], r)
+    t_begin = time.time()
+    U, s, Vt = backends[method](C, r)
+    seconds = time.time() - t_begin
+    # U and V are orthonormal, so ||C - U S Vt||^2 = ||C||^2 - ||s||^2
+    norm = frobenius(C)
+    residual = np.sqrt(max(norm ** 2 - np.sum(s ** 2), 0.0)) / max(norm, 1e-12)
+    last.update(method=method, N=C.shape[0], r=r, seconds=seconds, residual=residual)
+    if settings['report']:
+        print('svd: {} N={} r={} in {:.2f}s, residual {:.4f}'.format(method, C.shape[0], r, seconds, residual))
+    return U[:, ::-1], s[::-1], Vt[::-1]
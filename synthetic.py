@@ -0,0 +1,156 @@
+"""
+Synthetic union-of-subspaces data
+
+SubspaceGenerator draws points from K random low-dimensional subspaces of the pixel (or latent) space,
+with optional noise, outliers, class imbalance and missing entries. Points are generated in chunks from
+per-chunk random states, so any chunk can be produced on its own and a 200k-point set never has to be
+held in memory unless generate() is asked for all of it.
+
+prepare_data() has the interface of the prepare_data_* functions of the training scripts, and is
+selected there with --dataset synthetic and the --synth-* options below.
+"""
+import os
+import numpy as np
+import masks
+
+
+def add_arguments(parser):
+    # options of --dataset synthetic
+    parser.add_argument('--synth-k',         type=int,   default=10)     # number of subspaces
+    parser.add_argument('--synth-m',         type=int,   default=50)     # average number of points per subspace
+    parser.add_argument('--synth-dim',       type=int,   default=5)      # dimension of each subspace
+    parser.add_argument('--synth-noise',     type=float, default=0.05)   # std of the noise, relative to the clean entries
+    parser.add_argument('--synth-outliers',  type=float, default=0.0)    # fraction of points not on their subspace
+    parser.add_argument('--synth-imbalance', type=float, default=1.0)    # ratio between the largest and smallest class
+    parser.add_argument('--synth-missing',   type=float, default=0.0)    # fraction of entries set to 0
+    parser.add_argument('--synth-seed',      type=int,   default=0)
+
+
+def class_sizes(n_class, n_per_class, imbalance=1.0):
+    """
+    n_class sizes of at least 1 summing to exactly n_class*n_per_class, falling off geometrically from the
+    largest to the smallest by a factor of `imbalance`, as closely as whole sizes allow
+    """
+    total = int(n_class * n_per_class)
+    if total < n_class:
+        raise ValueError('{} points cannot fill {} classes'.format(total, n_class))
+    weights = imbalance ** (-np.arange(n_class) / max(n_class - 1.0, 1.0))
+    exact = weights / weights.sum() * total
+    sizes = np.maximum(np.floor(exact).astype(int), 1)
+    # largest remainder rounding to the total, no class drops below 1
+    while sizes.sum() != total:
+        gap = exact - sizes
+        if sizes.sum() < total:
+            sizes[np.argmax(gap)] += 1
+        else:
+            gap[sizes == 1] = np.inf
+            sizes[np.argmin(gap)] -= 1
+    return sizes
+
+
+class SubspaceGenerator(object):
+    def __init__(self, n_class, n_per_class, dim, shape=(32, 32), noise=0.0, outliers=0.0, imbalance=1.0,
+                 missing=0.0, scale=1.0, seed=0, chunk_size=1024):
+        """
+        n_class    : number of subspaces K
+        n_per_class: average number of points per subspace, N = n_class * n_per_class
+        dim        : dimension of each subspace
+        shape      : [h, w] gives N x h x w x 1 images, [D] gives N x D latent vectors
+        noise      : std of the Gaussian noise on every entry, relative to the std of the clean entries
+        outliers   : fraction of points drawn from the whole space instead of their subspace, they keep
+                     their label
+        imbalance  : ratio between the largest and the smallest class
+        missing    : fraction of entries that are set to 0 and marked missing
+        scale      : std of the clean entries
+        chunk_size : number of points per chunk, the data depends on it together with the seed
+        """
+        self.n_class = n_class
+        self.dim = dim
+        self.shape = list(shape)
+        self.D = int(np.prod(self.shape))
+        self.noise = noise
+        self.outliers = outliers
+        self.missing = missing
+        self.scale = scale
+        self.seed = seed
+        self.chunk_size = chunk_size
+        rng = np.random.RandomState(seed)
+        self.sizes = class_sizes(n_class, n_per_class, imbalance)
+        self.N = int(self.sizes.sum())
+        self.labels = rng.permutation(np.repeat(np.arange(n_class), self.sizes)).astype(np.int32)
+        # one orthonormal D x dim basis per subspace, scaled so that clean entries have unit variance
+        self.bases = np.stack([np.linalg.qr(rng.randn(self.D, dim))[0] for k in range(n_class)])
+        self.bases = (self.bases * np.sqrt(self.D / float(dim))).astype(np.float32)
+
+    @property
+    def n_chunks(self):
+        return (self.N + self.chunk_size - 1) // self.chunk_size
+
+    def chunk(self, i):
+        """
+        rows [i*chunk_size, (i+1)*chunk_size) as (X, Label, observed): X is n x shape, observed a boolean
+        n x shape array (None without missing entries)
+        """
+        begin, end = i * self.chunk_size, min((i + 1) * self.chunk_size, self.N)
+        rng = np.random.RandomState([self.seed, i + 1])
+        Label = self.labels[begin:end]
+        coef = rng.randn(end - begin, self.dim).astype(np.float32)
+        X = np.empty([end - begin, self.D], dtype=np.float32)
+        for k in np.unique(Label):
+            rows = Label == k
+            X[rows] = coef[rows].dot(self.bases[k].T)
+        if self.outliers > 0:
+            outlier = rng.random_sample(end - begin) < self.outliers
+            X[outlier] = rng.randn(outlier.sum(), self.D)
+        if self.noise > 0:
+            X += self.noise * rng.randn(end - begin, self.D).astype(np.float32)
+        X *= self.scale
+        observed = None
+        if self.missing > 0:
+            observed = rng.random_sample([end - begin, self.D]) >= self.missing
+            X[~observed] = 0
+            observed = observed.reshape([-1] + self.shape)
+        return X.reshape([-1] + self.shape), Label, observed
+
+    def chunks(self):
+        for i in range(self.n_chunks):
+            yield self.chunk(i)
+
+    def generate(self):
+        """
+        all N points as (X, Label, Masks), Masks is a masks.MaskSet of the observed entries, None without
+        missing entries; images get a trailing channel axis
+        """
+        channel = [1] if len(self.shape) == 2 else []
+        X = np.empty([self.N] + self.shape + channel, dtype=np.float32)
+        packed = []
+        for i, (X_i, Label_i, observed_i) in enumerate(self.chunks()):
+            X[i * self.chunk_size:i * self.chunk_size + X_i.shape[0]] = X_i.reshape([-1] + self.shape + channel)
+            if observed_i is not None:
+                packed.append(np.packbits(observed_i.reshape(observed_i.shape[0], -1), axis=1))
+        Masks = masks.MaskSet(np.concatenate(packed), X.shape) if packed else None
+        return X, self.labels, Masks
+
+
+def prepare_data(folder, args):
+    # same returns as the scripts' prepare_data_* functions, on 32x32 images with the ORL architecture
+    n_input  = [32, 32]
+    n_hidden = [5, 3, 3]
+    kernel_size = [5, 3, 3]
+    disc_size = [200, 50, 1]
+    generator = SubspaceGenerator(args.synth_k, args.synth_m, args.synth_dim, shape=n_input,
+            noise=args.synth_noise, outliers=args.synth_outliers, imbalance=args.synth_imbalance,
+            missing=args.synth_missing, seed=args.synth_seed)
+    Img, Label, _ = generator.generate()
+    # the mean class size N/K of the generated set, the scripts take batch_size = K * n_sample_perclass = N
+    n_sample_perclass = generator.N // args.synth_k
+    # tunable numbers
+    k = args.synth_dim  # svds parameter
+    post_alpha = 3.5    # Laplacian parameter
+
+    all_subjects = [args.synth_k]
+    # every generator option is in the name, runs on different data don't restore each other's weights
+    model_path = os.path.join(folder, 'model-533-32x32-synthetic-{}x{}-dim{}-noise{:g}-outliers{:g}-imbalance{:g}-missing{:g}-seed{}-ckpt'.format(
+        args.synth_k, args.synth_m, args.synth_dim, args.synth_noise, args.synth_outliers, args.synth_imbalance,
+        args.synth_missing, args.synth_seed))
+    return Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
@@ -2,11 +2,9 @@ import tensorflow as tf
 import numpy as np
 from tensorflow.contrib import layers
 import scipy.io as sio
-from scipy.sparse.linalg import svds
 # from skcuda.linalg import svd as svd_cuda
 # import pycuda.gpuarray as gpuarray
 # from pycuda.tools import DeviceMemoryPool
-from sklearn import cluster
 from sklearn.preprocessing import normalize
 from munkres import Munkres
 import os
@@ -14,6 +12,16 @@ import time
 import argparse
 from functools import reduce
 import pdb
+import synthetic
+import pipeline
+import cpu
+import early_stop
+import eval_cache
+import eval_schedule
+import xla
+import svd_backend
+import spectral
+import affinity
 
 parser = argparse.ArgumentParser()
 parser.add_argument('name')
@@ -31,7 +39,7 @@ parser.add_argument('--lr2', type=float, default=2e-4)  # learning rate for disc
 parser.add_argument('--pretrain', type=int, default=0)  # number of iterations of pretraining
 parser.add_argument('--epochs', type=int, default=1000)  # number of epochs to train on eqn3 and eqn3plus
 parser.add_argument('--enable-at', type=int, default=300)  # epoch at which to enable eqn3plus
-parser.add_argument('--dataset', type=str, default='orl', choices=['yaleb', 'orl', 'coil20', 'coil100'])
+parser.add_argument('--dataset', type=str, default='orl', choices=['yaleb', 'orl', 'coil20', 'coil100', 'synthetic'])
 parser.add_argument('--interval', type=int, default=10)
 parser.add_argument('--interval2', type=int, default=1)
 parser.add_argument('--bound', type=float, default=0.02)  # discriminator weight clipping limit
@@ -68,6 +76,14 @@ parser.add_argument('--s_tau2',        type=float,     default=1.01)
 parser.add_argument('--s_lambda2',     type=float,     default=4.0)
 #parser.add_argument('--kernel-size',    type=int,       nargs='+',  default=None)
 parser.add_argument('--degerate',       action='store_true')
+parser.add_argument('--xla',            action='store_true')            # compile the self-expressive and loss subgraphs with XLA
+synthetic.add_arguments(parser)      # --synth-* options of --dataset synthetic
+cpu.add_arguments(parser)            # --*-threads and --*-cores of the CPU execution profile
+early_stop.add_arguments(parser)     # --early-stop and its --es-* criteria
+eval_cache.add_arguments(parser)     # --eval-cache of the post_proC labels, see eval_cache.py
+eval_schedule.add_arguments(parser)  # --adaptive-eval interval and its --eval-* options, see eval_schedule.py
+svd_backend.add_arguments(parser)    # --svd backend of post_proC, see svd_backend.py
+spectral.add_arguments(parser)       # --spectral clustering of post_proC, see spectral.py
 
 
 """
@@ -127,7 +143,8 @@ class ConvAE(object):
             L = tf.Variable(v * tf.ones([self.batch_size, r]), name='Coef_L')
             R = tf.Variable(v * tf.ones([r, self.batch_size]), name='Coef_R')
             Coef = tf.matmul(L, R, name='Coef_full')
-        z_c = tf.matmul(Coef, z, name='matmul_Cz')
+        with xla.jit_scope(args.xla):
+            z_c = tf.matmul(Coef, z, name='matmul_Cz')
         self.Coef = Coef
         Coef_weights = [v for v in tf.trainable_variables() if v.name.startswith('Coef')]
         latent_c = tf.reshape(z_c, tf.shape(latent))  # petential problem here
@@ -143,11 +160,12 @@ class ConvAE(object):
         self.loss_aereg = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)  # weight decay
 
         # Eqn 3 loss
-        self.loss_recon = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(self.x_r, self.x), 2.0))
-        #self.loss_sparsity = tf.reduce_sum(tf.pow(self.Coef, 2.0))
-        self.loss_sparsity = tf.reduce_sum(tf.abs(self.Coef))
-        self.loss_selfexpress = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0))
-        self.loss_eqn3 = self.loss_recon + lambda1 * self.loss_sparsity + lambda2 * self.loss_selfexpress + self.loss_aereg
+        with xla.jit_scope(args.xla):
+            self.loss_recon = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(self.x_r, self.x), 2.0))
+            #self.loss_sparsity = tf.reduce_sum(tf.pow(self.Coef, 2.0))
+            self.loss_sparsity = tf.reduce_sum(tf.abs(self.Coef))
+            self.loss_selfexpress = 0.5 * tf.reduce_sum(tf.pow(tf.subtract(z_c, z), 2.0))
+            self.loss_eqn3 = self.loss_recon + lambda1 * self.loss_sparsity + lambda2 * self.loss_selfexpress + self.loss_aereg
         with tf.variable_scope('optimizer_eqn3'):
             self.optimizer_eqn3 = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss_eqn3,
                                                                                                     var_list=eqn3_weights)
@@ -177,6 +195,7 @@ class ConvAE(object):
         self.u_ini = [tf.assign(u, u_prime) for u, u_prime in zip(self.Us, u_primes)]
 
         z_real = self.z
+        # the discriminator loss stays uncompiled, see xla.py
         self.score_disc, self.Us_update_op = self.compute_disc_loss(z_real, self.y_x)
 
         print('adding disc regularization')
@@ -191,7 +210,8 @@ class ConvAE(object):
 
         print('building eqn3plus optimizers')
         # Eqn 3 + generator loss
-        self.loss_eqn3plus = self.loss_eqn3 + lambda3 * self.score_disc
+        with xla.jit_scope(args.xla):
+            self.loss_eqn3plus = self.loss_eqn3 + lambda3 * self.score_disc
         with tf.variable_scope('optimizer_eqn3plus'):
             self.optimizer_eqn3plus = tf.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(
                 self.loss_eqn3plus, var_list=eqn3_weights)
@@ -212,6 +232,8 @@ class ConvAE(object):
         config = tf.ConfigProto()
         # config.gpu_options.allow_growth = True  # stop TF from eating up all GPU RAM
         # config.gpu_options.per_process_gpu_memory_fraction = 0.4
+        self.cpu = cpu.CPUProfile(args)  # thread pools and cores of the session and of post_proC
+        self.cpu.configure(config)
         self.sess = tf.InteractiveSession(config=config)
         self.sess.run(self.init)
         self.saver = tf.train.Saver([v for v in ae_weights if v.name.startswith('enc_w') or v.name.startswith('dec_w')])
@@ -552,40 +574,11 @@ def thrC(C, ro):
     return Cp
 
 
-def build_aff(C):
-    N = C.shape[0]
-    Cabs = np.abs(C)
-    ind = np.argsort(-Cabs, 0)
-    for i in range(N):
-        Cabs[:, i] = Cabs[:, i] / (Cabs[ind[0, i], i] + 1e-6)
-    Cksym = Cabs + Cabs.T;
-    return Cksym
-
-
-def spectral_cluster(L, n, eps=2.2 * 10 - 8):
-    """
-    L: Laplacian
-    n: number of clusters
-    Translates MATLAB code below:
-    N  = size(L, 1)
-    DN = diag( 1./sqrt(sum(L)+eps) );
-    LapN = speye(N) - DN * L * DN;
-    [~,~,vN] = svd(LapN);
-    kerN = vN(:,N-n+1:N);
-    normN = sum(kerN .^2, 2) .^.5;
-    kerNS = bsxfun(@rdivide, kerN, normN + eps);
-    groups = kmeans(kerNS,n,'maxiter',MAXiter,'replicates',REPlic,'EmptyAction','singleton');
-    """
-    N = L.shape[0]
-    DN = (1. / np.sqrt(L.sum(0) + eps))
-    LapN = np.eye(N) - DN * L * DN
-
-
 def post_proC(C, K, d, alpha):
     # C: coefficient matrix, K: number of clusters, d: dimension of each subspace
     C = 0.5 * (C + C.T)
     r = d * K + 1  # K=38, d=10
-    U, S, _ = svds(C, r, v0=np.ones(C.shape[0]))
+    U, S, _ = svd_backend.svds(C, r)
     # U, S, _ = svd_cuda(C, allocator=mem_pool)
     # take U and S from GPU
     # U = U[:, :r].get()
@@ -595,15 +588,13 @@ def post_proC(C, K, d, alpha):
     S = np.diag(S)
     U = U.dot(S)
     U = normalize(U, norm='l2', axis=1)
-    Z = U.dot(U.T)
-    #Z = Z * (Z > 0)
-    L = np.abs(np.abs(Z) ** alpha)
-    L = L / L.max()
-    L = 0.5 * (L + L.T)
-    spectral = cluster.SpectralClustering(n_clusters=K, eigen_solver='arpack', affinity='precomputed',
-                                          assign_labels='discretize')
-    spectral.fit(L)
-    grp = spectral.fit_predict(L)  # +1
+    kernel = affinity.kernel(alpha)
+    if spectral.settings['landmarks']:
+        # the same affinity, between the samples and the landmarks only
+        grp = spectral.landmark_cluster(U, K, kernel)
+        return grp, None
+    L = affinity.post_affinity(U, kernel)
+    grp = spectral.cluster(L, K)  # +1
     return grp, L
 
 
@@ -614,15 +605,7 @@ def err_rate(gt_s, s):
     return missrate
 
 
-def build_laplacian(C):
-    C = 0.5 * (np.abs(C) + np.abs(C.T))
-    W = np.sum(C, axis=0)
-    W = np.diag(1.0 / W)
-    L = W.dot(C)
-    return L
-
-
-def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5, alpha = 0.1):
+def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5, alpha = 0.1, stopper=None, cache=None, schedule=None):
 
     best_epoch=0
     best_acc=0
@@ -658,14 +641,15 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5, al
             AE l2 norm   : 29
             Ae recon loss: 13372
         """
+        minibatch_size = 128
+        batches = pipeline.BatchPrefetcher(Img, minibatch_size)  # shuffled mini-batches, prepared in the background
         for epoch in range(1, args.pretrain + 1):
-            minibatch_size = 128
-            indices = np.random.permutation(Img.shape[0])[:minibatch_size]
-            minibatch = Img[indices]  # pretrain with random mini-batch
+            minibatch, _, _ = next(batches)
             cost = CAE.partial_fit_pretrain(minibatch, args.lr)
             if epoch % 100 == 0:
                 norm = CAE.get_ae_weight_norm()
                 print('pretraining epoch {}, cost: {}, norm: {}'.format(epoch, cost / float(minibatch_size), norm))
+        batches.close()
         if args.save:
             CAE.save_model()
     ###
@@ -674,13 +658,14 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5, al
     print('Finetune for {} steps'.format(num_epochs))
     acc_x = 0.0
     y_x_mode = 'svd'
+    enable_at = args.enable_at  # moved forward by early stopping
     for epoch in range(1, num_epochs + 1):
         # eqn3
-        if epoch < args.enable_at:
+        if epoch < enable_at:
             cost, Coef = CAE.partial_fit_eqn3(Img, args.lr)
             interval = args.interval  # normal interval
         # overtrain discriminator
-        elif epoch == args.enable_at:
+        elif epoch == enable_at:
             print('Initialize discriminator for {} steps'.format(args.D_init))
             CAE.assign_u_parameter(Img, y_x)
             for i in range(args.D_init):
@@ -695,12 +680,21 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5, al
                 cost, Coef = CAE.partial_fit_eqn3plus(Img, y_x, args.lr2)
             interval = args.interval2  # GAN interval
         # every interval epochs, perform clustering and evaluate accuracy
-        if epoch % interval == 0:
+        if schedule is not None:
+            # --adaptive-eval, always before the GAN phase starts and at the end
+            evaluate = schedule.due(epoch, interval, force=epoch in (enable_at - 1, num_epochs))
+        else:
+            evaluate = epoch % interval == 0
+        if evaluate:
             print("epoch: %.1d" % epoch, "cost: %.8f" % (cost / float(batch_size)))
             Coef = thrC(Coef, alpha)
             t_begin = time.time()
             if y_x_mode == 'svd':
-                y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
+                with CAE.cpu.evaluation():
+                    if cache is not None:
+                        y_x_new = cache.evaluate(Coef, lambda C: post_proC(C, n_class, k, post_alpha)[0])
+                    else:
+                        y_x_new, _ = post_proC(Coef, n_class, k, post_alpha)
             else:
                 y_x_new = CAE.get_projection_y_x(Img)
             if len(set(list(np.squeeze(y_x_new)))) == n_class:
@@ -714,6 +708,8 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5, al
             acc_x = 1 - missrate_x
             print("accuracy: {}".format(acc_x))
             print('post processing time: {}'.format(t_end - t_begin))
+            if schedule is not None:
+                print('next evaluation in {} epochs'.format(schedule.update(epoch, y_x, t_end - t_begin)))
             CAE.log_accuracy(acc_x)
             clustered = True
             #if epoch < 300 and acc_x> 0.85 and acc_x<0.865:
@@ -721,6 +717,14 @@ def reinit_and_optimize(args, Img, Label, CAE, n_class, k=10, post_alpha=3.5, al
             if best_acc < acc_x:
                best_acc = acc_x
                sio.savemat('orl_label_nips_l1.mat', dict(s=y_x_new))
+            if stopper is not None and stopper.update(epoch, y_x, cost, Coef):
+                # converged without looking at Label: start the GAN phase now, or end the run
+                if epoch < enable_at <= num_epochs:
+                    print('early stopping: GAN phase from epoch {} on, {}'.format(epoch + 1, stopper.record(epoch, 'switch')))
+                    enable_at = epoch + 1
+                else:
+                    print('early stopping: stopped at epoch {}, {}'.format(epoch, stopper.record(epoch, 'stop')))
+                    break
 
     mean = acc_x
     median = acc_x
@@ -827,6 +831,12 @@ def prepare_data_coil100(folder):
     return alpha, Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path
 
 
+def prepare_data_synthetic(folder):
+    # K random subspaces, see synthetic.py
+    alpha = 0.1
+    return (alpha,) + synthetic.prepare_data(folder, args)
+
+
 def normalize_data(data):
     data = data - data.mean(axis=0)
     data = data / data.std(axis=0)
@@ -835,6 +845,8 @@ def normalize_data(data):
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    svd_backend.configure(args)
+    spectral.configure(args)
     assert args.name is not None and args.name != '', 'name of experiment must be specified'
 
     # prepare data
@@ -843,7 +855,8 @@ if __name__ == '__main__':
         'yaleb': prepare_data_YaleB,
         'orl': prepare_data_orl,
         'coil20': prepare_data_coil20,
-        'coil100': prepare_data_coil100}
+        'coil100': prepare_data_coil100,
+        'synthetic': prepare_data_synthetic}
     assert args.dataset in preparation_funcs
     alpha, Img, Label, n_input, n_hidden, kernel_size, n_sample_perclass, disc_size, k, post_alpha, all_subjects, model_path = \
             preparation_funcs[args.dataset](folder)
@@ -874,7 +887,18 @@ if __name__ == '__main__':
             model_path=model_path, restore_path=restore_path, logs_path=logs_path)
 
         # perform optimization
-        avg_i, med_i, best_epoch, best_acc, best_alpha, best_postalpha = reinit_and_optimize(args, Img, Label, CAE, n_class, k=k, post_alpha=post_alpha, alpha = alpha)
+        stopper = early_stop.make_early_stopping(args)
+        cache = eval_cache.make_eval_cache(args)
+        schedule = eval_schedule.make_schedule(args)
+        avg_i, med_i, best_epoch, best_acc, best_alpha, best_postalpha = reinit_and_optimize(args, Img, Label, CAE, n_class, k=k, post_alpha=post_alpha, alpha = alpha, stopper=stopper, cache=cache, schedule=schedule)
+        if stopper is not None:
+            stopper.save(os.path.join(logs_path, 'early_stop-{}.json'.format(n_class)))
+        if cache is not None:
+            print(cache.summary())
+            cache.save(os.path.join(logs_path, 'eval_cache-{}.json'.format(n_class)))
+        if schedule is not None:
+            print(schedule.summary())
+            schedule.save(os.path.join(logs_path, 'eval_schedule-{}.json'.format(n_class)))
         # add result to list
         avg.append(avg_i)
         med.append(med_i)
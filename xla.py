@@ -0,0 +1,31 @@
+"""
+XLA compilation of parts of the TF1 graphs
+
+With --xla the training scripts build the self-expressive layer and the Eqn 3 losses inside
+jit_scope(True). Those ops, and the gradient ops minimize() derives from them, are marked for XLA, which
+compiles each marked region into a few fused kernels: the squares, differences and sums around the Coef
+matmul no longer launch one kernel each. The discriminator loss is left out. Its per-group ops sit between
+tf.where and tf.gather, which XLA can't compile, so it only gets many tiny clusters, and on CPU those made
+the discriminator step slower than the uncompiled graph (partial_fit_disc ran ~1.7x slower).
+"""
+import contextlib
+import tensorflow as tf
+
+
+@contextlib.contextmanager
+def no_scope():
+    yield
+
+
+def jit_scope(enabled=True):
+    """
+    experimental_jit_scope if enabled, otherwise a scope that changes nothing
+    """
+    if not enabled:
+        return no_scope()
+    try:
+        from tensorflow.contrib.compiler import jit
+        return jit.experimental_jit_scope()
+    except ImportError:
+        # moved out of contrib in later versions
+        return tf.xla.experimental.jit_scope()